@@ -19,6 +19,8 @@ from mysql.replicant.errors import (
     NotSlaveError,
     )
 
+from mysql.replicant.group import ServerGroup
+
 import my_deployment
 
 print "# Executing 'show databases'"
@@ -34,8 +36,11 @@ try:
 except NotMasterError:
     print my_deployment.master.name, "is not configured as a master"
 
-for slave in my_deployment.slaves:
-    try:
-        print "Slave position is:", fetch_slave_pos(slave)
-    except NotSlaveError:
-        print slave.name, "not configured as a slave"
+slaves = ServerGroup(my_deployment.slaves, timeout=10)
+for outcome in slaves.call(fetch_slave_pos):
+    if isinstance(outcome.error, NotSlaveError):
+        print outcome.server.name, "not configured as a slave"
+    elif outcome.error:
+        print outcome.server.name, "failed:", outcome.error
+    else:
+        print "Slave position is:", outcome.result
@@ -0,0 +1,297 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Use of this source code is goverened by a BSD licence that can be
+# found in the LICENCE file.
+
+"""Module holding a non-blocking interface to servers.
+
+An asynchronous server wraps a server and returns futures instead of
+blocking until the result is available, so that a control process can
+have operations outstanding on a large number of servers at the same
+time::
+
+   servers = [AsyncServer(server) for server in deployment]
+   futures = [server.asql("SHOW SLAVE STATUS") for server in servers]
+   for future in futures:
+       print future.result()["Seconds_Behind_Master"]
+
+Futures support callbacks, which allows them to be integrated with an
+event loop by having the callback wake up the loop.
+
+SQL statements are executed by a shared executor with a bounded
+number of threads, since the connector is blocking. Shell commands do
+not need a thread each: the processes are started directly and their
+output is collected by a single thread watching all running processes.
+"""
+
+import errno
+import os
+import select
+import subprocess
+import threading
+import Queue
+
+class Future(object):
+    """The result of an operation that might not have completed yet.
+    """
+
+    def __init__(self):
+        self.__cond = threading.Condition()
+        self.__done = False
+        self.__result = None
+        self.__exception = None
+        self.__callbacks = []
+
+    def done(self):
+        "Return True if the operation has completed."
+        return self.__done
+
+    def __wait(self, timeout):
+        with self.__cond:
+            if not self.__done:
+                self.__cond.wait(timeout)
+            if not self.__done:
+                from mysql.replicant.errors import ServerTimeoutError
+                raise ServerTimeoutError("No result within %s seconds"
+                                         % (timeout,))
+
+    def result(self, timeout=None):
+        """Wait for the operation to complete and return the result,
+        or raise the exception raised by the operation."""
+        self.__wait(timeout)
+        if self.__exception is not None:
+            raise self.__exception
+        return self.__result
+
+    def exception(self, timeout=None):
+        """Wait for the operation to complete and return the exception
+        raised by the operation, or None."""
+        self.__wait(timeout)
+        return self.__exception
+
+    def add_done_callback(self, func):
+        """Call func with the future as argument when the operation
+        completes. If it already has, func is called immediately.
+        Callbacks are called from the thread completing the
+        operation."""
+        with self.__cond:
+            if not self.__done:
+                self.__callbacks.append(func)
+                return
+        func(self)
+
+    def __complete(self, result, exception):
+        with self.__cond:
+            self.__result = result
+            self.__exception = exception
+            self.__done = True
+            callbacks, self.__callbacks = self.__callbacks, []
+            self.__cond.notify_all()
+        for func in callbacks:
+            try:
+                func(self)
+            except Exception:   # pylint: disable=W0703
+                pass            # A failing callback must not stop others
+
+    def set_result(self, result):
+        self.__complete(result, None)
+
+    def set_exception(self, exception):
+        self.__complete(None, exception)
+
+class Executor(object):
+    """Execute functions using a bounded number of threads.
+
+    Threads are started when needed, up to workers threads.
+    """
+
+    def __init__(self, workers=32):
+        self.__workers = workers
+        self.__threads = 0
+        self.__idle = 0
+        self.__lock = threading.Lock()
+        self.__tasks = Queue.Queue()
+
+    def submit(self, func, *args, **kwargs):
+        "Call func(*args, **kwargs) and return a future for the result."
+        future = Future()
+        self.__tasks.put((future, func, args, kwargs))
+        with self.__lock:
+            if self.__tasks.qsize() > self.__idle \
+                    and self.__threads < self.__workers:
+                self.__threads += 1
+                thread = threading.Thread(target=self.__work)
+                thread.daemon = True
+                thread.start()
+        return future
+
+    def __work(self):
+        while True:
+            with self.__lock:
+                self.__idle += 1
+            future, func, args, kwargs = self.__tasks.get()
+            with self.__lock:
+                self.__idle -= 1
+            try:
+                result = func(*args, **kwargs)
+            except Exception, err:  # pylint: disable=W0703
+                future.set_exception(err)
+            else:
+                future.set_result(result)
+
+class _ProcessWatcher(object):
+    """Collect the output of processes using a single thread.
+
+    The thread waits for output from all processes at the same time
+    and completes the future of a process with its output split into
+    lines when the process closes its output.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__processes = {}   # fd -> (process, chunks, future)
+        self.__wakeup = os.pipe()
+        self.__thread = None
+
+    def watch(self, process):
+        "Return a future for the output of a process."
+        future = Future()
+        with self.__lock:
+            self.__processes[process.stdout.fileno()] = (process, [], future)
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run)
+                self.__thread.daemon = True
+                self.__thread.start()
+        os.write(self.__wakeup[1], 'x')
+        return future
+
+    def __run(self):
+        wakeup = self.__wakeup[0]
+        while True:
+            try:
+                ready = self.__poll(wakeup)
+            except Exception, err:  # pylint: disable=W0703
+                # We cannot tell which process caused the failure, so
+                # all pending futures are failed rather than left
+                # waiting forever.
+                with self.__lock:
+                    fds = self.__processes.keys()
+                for fd in fds:
+                    self.__complete(fd, None, err)
+                continue
+            for fd, _ in ready:
+                if fd == wakeup:
+                    os.read(wakeup, 512)
+                    continue
+                try:
+                    lines = self.__read(fd)
+                except Exception, err:  # pylint: disable=W0703
+                    self.__complete(fd, None, err)
+                else:
+                    if lines is not None:
+                        self.__complete(fd, lines, None)
+
+    def __poll(self, wakeup):
+        "Wait for output and return the ready file descriptors."
+        with self.__lock:
+            fds = self.__processes.keys()
+        # Using poll rather than select, since select is limited
+        # to file descriptors below FD_SETSIZE.
+        poller = select.poll()
+        for fd in [wakeup] + fds:
+            poller.register(fd, select.POLLIN)
+        try:
+            return poller.poll()
+        except select.error, err:
+            if err.args[0] == errno.EINTR:
+                return []
+            raise
+
+    def __read(self, fd):
+        """Read output from a process and return its output split into
+        lines if the process closed its output, otherwise None."""
+        data = os.read(fd, 65536)
+        process, chunks, _ = self.__processes[fd]
+        if data:
+            chunks.append(data)
+            return None
+        process.stdout.close()
+        process.wait()
+        return ''.join(chunks).split("\n")
+
+    def __complete(self, fd, lines, exception):
+        "Stop watching a process and complete its future."
+        with self.__lock:
+            process, _, future = self.__processes.pop(fd)
+        if exception is None:
+            future.set_result(lines)
+        else:
+            try:
+                process.stdout.close()
+            except Exception:   # pylint: disable=W0703
+                pass
+            future.set_exception(exception)
+
+_EXECUTOR = None
+_WATCHER = _ProcessWatcher()
+_LOCK = threading.Lock()
+
+def _default_executor():
+    global _EXECUTOR
+    with _LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = Executor()
+        return _EXECUTOR
+
+class AsyncServer(object):
+    """A non-blocking proxy for a server.
+
+    The methods asql(), assh(), and acall() start an operation on the
+    server and return a future for the result. All other attributes
+    are those of the server.
+
+    Each SQL statement is executed on a connection checked out from
+    the connection pool of the server for the duration of the
+    statement, so statements that rely on session state, such as
+    locks or user variables, should be executed using the server
+    directly.
+    """
+
+    def __init__(self, server, executor=None):
+        self.server = server
+        self.__executor = executor
+
+    def __getattr__(self, name):
+        return getattr(self.server, name)
+
+    @property
+    def executor(self):
+        return self.__executor or _default_executor()
+
+    def acall(self, func, *args, **kwargs):
+        """Call func(server, *args, **kwargs) in the executor and
+        return a future for the result."""
+        return self.executor.submit(_call, self.server, func, args, kwargs)
+
+    def asql(self, command, args=None, database=''):
+        """Execute a SQL command on the server and return a future
+        for the result, which is the same as for Server.sql()."""
+        return self.acall(_sql, command, args, database)
+
+    def assh(self, command):
+        """Execute a shell command on the server and return a future
+        for the output, which is the same as for Server.ssh()."""
+        process = subprocess.Popen(self.server._ssh_command(command),
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+        return _WATCHER.watch(process)
+
+def _call(server, func, args, kwargs):
+    try:
+        return func(server, *args, **kwargs)
+    finally:
+        server.disconnect()
+
+def _sql(server, command, args, database):
+    return server.sql(command, args, database)
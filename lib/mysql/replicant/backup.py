@@ -13,6 +13,8 @@ import os.path
 import subprocess
 import urlparse
 
+from mysql.replicant.ssh import SESSIONS
+
 class BackupImage(object):
     """A backup image.
 
@@ -50,9 +52,8 @@ class PhysicalBackup(BackupImage):
             path = self.url.path
         server.ssh(["tar", "zpscf", path, "-C", datadir] + database)
         if server.host != "localhost":
-            subprocess.check_call([
-                    "scp", server.host + ":" + path, self.url.path
-                    ])
+            subprocess.check_call(SESSIONS.scp_command(
+                    [server.host + ":" + path], self.url.path))
         server.sql("UNLOCK TABLES")
         return position
 
@@ -67,9 +68,8 @@ class PhysicalBackup(BackupImage):
         try:
             server.stop()
             if server.host != "localhost":
-                subprocess.check_call([
-                        "scp", self.url.path, server.host + ":" + path
-                        ])
+                subprocess.check_call(SESSIONS.scp_command(
+                        [self.url.path], server.host + ":" + path))
             server.ssh(["tar", "zxf", path, "-C", datadir])
         finally:
             server.start()
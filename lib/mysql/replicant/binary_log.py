@@ -37,12 +37,21 @@ INCIDENT_EVENT = 26
 HEARTBEAT_EVENT = 27
 IGNORABLE_EVENT = 28
 ROWS_QUERY_EVENT = 29
-
+WRITE_ROWS_EVENT_V2 = 30
+UPDATE_ROWS_EVENT_V2 = 31
+DELETE_ROWS_EVENT_V2 = 32
+GTID_LOG_EVENT = 33
+ANONYMOUS_GTID_LOG_EVENT = 34
+PREVIOUS_GTIDS_LOG_EVENT = 35
+
+import itertools
 import struct
 import time
 
 import mysql.replicant.errors as _errors
 
+from mysql.replicant.gtid import GTID, GTIDSet, uuid_from_bytes
+
 class _DecodeBuffer(object):
     """Helper class to decode a string by feeding it pieces of format
     strings.
@@ -121,7 +130,7 @@ class UnknownEvent(Event):
     type_name = "Unknown"
 
     def __init__(self, stub):
-        Event.__init__(stub)
+        Event.__init__(self, stub)
 
 class StartEvent(Event):
     "A start event"
@@ -139,17 +148,24 @@ class QueryEvent(Event):
         dbuf = _DecodeBuffer(stub.body)
 
         # Decode the post-header fields
-        field = dbuf.readfrm("<LLBHH")
+        field = dbuf.readfrm("<LLBH")
         self.thread_id = field[0]
         self.exec_time = field[1]
         db_len = field[2]
         self.error_code = field[3]
 
-        # Fields after this are post-5.0 !
-        # TODO: handle pre-5.0 events
+        # The status variables were added in 5.0, so pre-5.0 events
+        # have a shorter post-header without the status variable
+        # length.
+        if stub.post_header_length > dbuf.offset:
+            sv_len, = dbuf.readfrm("<H")
+        else:
+            sv_len = 0
 
-        # Decode the status variables
-        sv_end = field[4] + dbuf.offset
+        # Decode the status variables, which start after the
+        # post-header, wherever that ends.
+        dbuf.offset = stub.post_header_length
+        sv_end = sv_len + dbuf.offset
         while dbuf.offset < sv_end:
             code, = dbuf.readfrm("<B")
             if code == 0:                       # Q_FLAGS2_CODE
@@ -189,7 +205,7 @@ class QueryEvent(Event):
         self.database = dbuf.readstr(db_len)
         # Database name is NUL-terminated, so we skip that
         dbuf.offset += 1
-        self.query = dbuf.readstr(stub.size - dbuf.offset)
+        self.query = dbuf.readstr(stub.data_length - dbuf.offset)
 
     def to_string(self):
         result = super(QueryEvent, self)._mkstr({
@@ -213,8 +229,14 @@ class RotateEvent(Event):
     def __init__(self, stub):
         super(RotateEvent, self).__init__(stub)
         dbuf = _DecodeBuffer(stub.body)
-        self.next_pos = dbuf.readfrm("<Q")[0]
-        self.next_file = dbuf.readstr(stub.size - dbuf.offset)
+        # Binlog format 1 does not have a post-header, and always
+        # starts the next file at position 4.
+        if stub.post_header_length >= 8:
+            self.next_pos = dbuf.readfrm("<Q")[0]
+        else:
+            self.next_pos = 4
+        dbuf.offset = stub.post_header_length
+        self.next_file = dbuf.readstr(stub.data_length - dbuf.offset)
 
 _INTVAR_TYPE = [
     { 'brief': 'Invalid int', 'ident': '*INVALID*' },
@@ -332,16 +354,61 @@ class UservarEvent(Event):
         return result
         
 
+# Server version from which events carry a checksum algorithm in the
+# format description event.
+_CHECKSUM_VERSION = (5, 6, 1)
+
+CHECKSUM_OFF = 0
+CHECKSUM_CRC32 = 1
+
 class FormatDescriptionEvent(Event):
+    """A format description event.
+
+    The format description event describes the layout of all
+    following events in the binary log: the length of the common
+    header and the length of the post-header for each event type.
+    """
+
     type_name = "FormatDescription"
 
     def __init__(self, stub):
         super(FormatDescriptionEvent, self).__init__(stub)
         dbuf = _DecodeBuffer(stub.body)
-        field = dbuf.readfrm("<H50sL")
+        field = dbuf.readfrm("<H50sLB")
         self.binlog_version = field[0]
         self.server_version = field[1].rstrip('\0')
         self.created = field[2]
+        self.header_length = field[3]
+
+        # Servers that support checksums add the checksum algorithm
+        # and the checksum of this event after the post-header
+        # lengths.
+        end = len(stub.body)
+        self.checksum_alg = CHECKSUM_OFF
+        if _version_tuple(self.server_version) >= _CHECKSUM_VERSION:
+            end -= 5
+            self.checksum_alg = ord(stub.body[end])
+
+        # The post-header lengths are indexed by type code, but the
+        # array starts with type code 1.
+        self.post_header_lengths = [0] + [
+            ord(c) for c in stub.body[dbuf.offset:end]
+            ]
+
+    def post_header_length(self, type_code):
+        """Get the length of the post-header for an event type, or
+        None if the event type is not known to the server that wrote
+        the binary log."""
+        if 0 < type_code < len(self.post_header_lengths):
+            return self.post_header_lengths[type_code]
+        return None
+
+    @property
+    def checksum_length(self):
+        "Length of the checksum at the end of each event."
+        if self.checksum_alg == CHECKSUM_OFF:
+            return 0
+        return 4
 
 class XidEvent(Event):
     type_name = "Xid"
@@ -427,6 +494,73 @@ class RowsQueryEvent(Event):
     def __init__(self, stub):
         super(RowsQueryEvent, self).__init__(stub)
 
+class WriteRowsV2Event(Event):
+    type_name = "WriteRowsV2"
+
+    def __init__(self, stub):
+        super(WriteRowsV2Event, self).__init__(stub)
+
+class UpdateRowsV2Event(Event):
+    type_name = "UpdateRowsV2"
+
+    def __init__(self, stub):
+        super(UpdateRowsV2Event, self).__init__(stub)
+
+class DeleteRowsV2Event(Event):
+    type_name = "DeleteRowsV2"
+
+    def __init__(self, stub):
+        super(DeleteRowsV2Event, self).__init__(stub)
+
+_GTID_FRM = struct.Struct("<B16sQ")
+
+class GtidEvent(Event):
+    """Event holding the GTID of the transaction following it.
+    """
+
+    type_name = "Gtid"
+
+    def __init__(self, stub):
+        super(GtidEvent, self).__init__(stub)
+        self.commit_flag, sid, self.gno = _GTID_FRM.unpack_from(stub.body)
+        self.sid = uuid_from_bytes(sid)
+
+    @property
+    def gtid(self):
+        return GTID(self.sid, self.gno)
+
+class AnonymousGtidEvent(GtidEvent):
+    type_name = "AnonymousGtid"
+
+_INTERVAL_FRM = struct.Struct("<qq")
+
+def _decode_gtid_set(body):
+    """Decode a GTID set in the binary format used in Previous_gtids
+    events, where the ends of the intervals are exclusive."""
+    dbuf = _DecodeBuffer(body)
+    gtids = {}
+    sid_count, = dbuf.readfrm("<Q")
+    for _ in range(sid_count):
+        sid, count = dbuf.readfrm("<16sQ")
+        starts, ends = [], []
+        for _ in range(count):
+            start, end = dbuf.readfrm(_INTERVAL_FRM)
+            starts.append(start)
+            ends.append(end - 1)
+        gtids[uuid_from_bytes(sid)] = (starts, ends)
+    return GTIDSet._from_intervals(gtids)
+
+class PreviousGtidsEvent(Event):
+    """Event at the start of each binary log holding the GTIDs of the
+    transactions in all preceding binary logs.
+    """
+
+    type_name = "PreviousGtids"
+
+    def __init__(self, stub):
+        super(PreviousGtidsEvent, self).__init__(stub)
+        self.gtids = _decode_gtid_set(stub.body[stub.post_header_length:])
+
 _CLASS_FOR = [
     UnknownEvent,
     StartEvent,
@@ -458,44 +592,190 @@ _CLASS_FOR = [
     HeartbeatEvent,
     IgnorableEvent,
     RowsQueryEvent,
+    WriteRowsV2Event,
+    UpdateRowsV2Event,
+    DeleteRowsV2Event,
+    GtidEvent,
+    AnonymousGtidEvent,
+    PreviousGtidsEvent,
     ]
 
 
+# Post-header lengths of binlog format 4, used for events that are
+# read without a format description event, which is always the case
+# for the format description event itself. Its post-header is
+# decoded from the fixed part, which is the same as the post-header
+# of the start event of binlog format 1 and 3.
+_DEFAULT_POST_HEADER_LENGTH = {
+    START_EVENT: 56,
+    QUERY_EVENT: 13,
+    STOP_EVENT: 0,
+    ROTATE_EVENT: 8,
+    INTVAR_EVENT: 0,
+    LOAD_EVENT: 18,
+    SLAVE_EVENT: 0,
+    CREATE_FILE_EVENT: 4,
+    APPEND_BLOCK_EVENT: 4,
+    EXEC_LOAD_EVENT: 4,
+    DELETE_FILE_EVENT: 4,
+    NEWLOAD_EVENT: 18,
+    RAND_EVENT: 0,
+    USER_VAR_EVENT: 0,
+    FORMAT_DESCRIPTION_EVENT: 56,
+    XID_EVENT: 0,
+    BEGIN_LOAD_QUERY_EVENT: 4,
+    EXECUTE_LOAD_QUERY_EVENT: 26,
+    TABLE_MAP_EVENT: 8,
+    PRE_GA_WRITE_ROWS_EVENT: 0,
+    PRE_GA_UPDATE_ROWS_EVENT: 0,
+    PRE_GA_DELETE_ROWS_EVENT: 0,
+    WRITE_ROWS_EVENT: 8,
+    UPDATE_ROWS_EVENT: 8,
+    DELETE_ROWS_EVENT: 8,
+    INCIDENT_EVENT: 2,
+    HEARTBEAT_EVENT: 0,
+    IGNORABLE_EVENT: 0,
+    ROWS_QUERY_EVENT: 0,
+    WRITE_ROWS_EVENT_V2: 10,
+    UPDATE_ROWS_EVENT_V2: 10,
+    DELETE_ROWS_EVENT_V2: 10,
+    GTID_LOG_EVENT: 25,
+    ANONYMOUS_GTID_LOG_EVENT: 25,
+    PREVIOUS_GTIDS_LOG_EVENT: 0,
+    }
+
+_HEADER_FRM = struct.Struct("<LBLL")
+_HEADER_V4_FRM = struct.Struct("<LBLLLH")
+
+def _version_tuple(version):
+    """Turn a server version string such as '5.1.41-log' into a
+    tuple of integers."""
+    result = []
+    for part in version.split('-', 1)[0].split('.'):
+        digits = ''
+        for char in part:
+            if not char.isdigit():
+                break
+            digits += char
+        result.append(int(digits or 0))
+    return tuple(result)
+
 class Stub(object):             # pylint: disable=R0902
     """An undecoded event.
+
+    If a format description event is provided, it is used to decide
+    the length of the common header, the length of the post-header
+    for the event, and if there is a checksum at the end of the
+    event. Otherwise, the default layout of binlog format 4 is used.
     """
 
     HEADER_LENGTH = 19
 
-    def __init__(self, istream):
+    def __init__(self, istream, format_description=None):
         """Read the common header into the class and also fetch the
         rest of the event bytes.
         """
 
+        if format_description is None:
+            header_length = self.HEADER_LENGTH
+        else:
+            header_length = format_description.header_length
+        self.format_description = format_description
         self.pos = istream.tell()
-        header = istream.read(self.HEADER_LENGTH)
-        if (len(header) < self.HEADER_LENGTH):
+        header = istream.read(header_length)
+        if (len(header) < header_length):
             raise EOFError("Stream empty")
-        field = struct.unpack("<LBLLLH", header)
+        if header_length >= _HEADER_V4_FRM.size:
+            field = _HEADER_V4_FRM.unpack_from(header)
+        else:
+            # Binlog format 1 and 3 do not have the end position or
+            # the flags in the common header.
+            field = _HEADER_FRM.unpack_from(header)
+            field += (self.pos + field[3], 0)
         self.when = field[0]
         self.type_code = field[1]
         self.server_id = field[2]
         self.size = field[3]
         self.end_pos = field[4]
         self.flags = field[5]
-        self.body = istream.read(self.size - self.HEADER_LENGTH)
+        self.body = istream.read(self.size - header_length)
+
+    @property
+    def post_header_length(self):
+        "Length of the post-header of this event."
+        if self.format_description is None:
+            return _DEFAULT_POST_HEADER_LENGTH.get(self.type_code, 0)
+        return self.format_description.post_header_length(self.type_code)
+
+    @property
+    def data_length(self):
+        "Length of the body of this event, excluding any checksum."
+        if self.format_description is None:
+            return len(self.body)
+        return len(self.body) - self.format_description.checksum_length
+
+    @property
+    def type_name(self):
+        "Name of the type of this event."
+        if self.is_supported():
+            return _CLASS_FOR[self.type_code].type_name
+        return UnknownEvent.type_name
+
+    def is_supported(self):
+        """Check if the event can be decoded.
+
+        An event cannot be decoded if it has a type code that is not
+        known to the reader, or if the format description of the
+        binary log says that the type code is not known to the server
+        that wrote it. Such events are decoded as unknown events.
+        """
+        if not 0 < self.type_code < len(_CLASS_FOR):
+            return False
+        return self.post_header_length is not None
 
     def __str__(self):
         tstr = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.when))
-        return _EVENT_FRM.format(self.pos, tstr,
-                                 _CLASS_FOR[self.type_code].type_name,
+        return _EVENT_FRM.format(self.pos, tstr, self.type_name,
                                  self.server_id, self.end_pos)
 
     def decode(self):
-        try:
+        if self.is_supported():
             return _CLASS_FOR[self.type_code](self)
-        except IndexError:
-            return UnknownEvent(self)
+        return UnknownEvent(self)
+
+# Flag set in the format description event while the binary log is
+# being written to.
+LOG_EVENT_BINLOG_IN_USE_F = 0x1
+
+# Columns of the common header saved in the parse cache, with the
+# array type codes used to store them.
+_CACHE_COLUMNS = [
+    ('pos', 'I'), ('when', 'I'), ('type_code', 'B'), ('server_id', 'I'),
+    ('size', 'I'), ('end_pos', 'I'), ('flags', 'H'),
+    ]
+
+class _CachedStub(Stub):
+    """A stub created from the parse cache.
+
+    The common header is taken from the cache, and the body of the
+    event is only read from the binary log if it is needed.
+    """
+
+    def __init__(self, istream, format_description, fields):
+        # pylint: disable=W0231
+        self.__istream = istream
+        self.format_description = format_description
+        (self.pos, self.when, self.type_code, self.server_id,
+         self.size, self.end_pos, self.flags) = fields
+
+    @property
+    def body(self):
+        if self.format_description is None:
+            header_length = self.HEADER_LENGTH
+        else:
+            header_length = self.format_description.header_length
+        self.__istream.seek(self.pos + header_length)
+        return self.__istream.read(self.size - header_length)
 
 class Reader(object):
     "Base class for all readers."
@@ -516,6 +796,7 @@ class FileReader(Reader):
     def __init__(self, filename):
         instream = open(filename, 'rb')
         super(FileReader, self).__init__(instream)
+        self.filename = filename
         magic = self.istream.read(4)
         if magic != self.MAGIC:
             raise _errors.BadMagicError("Incorrect magic bytes for file")
@@ -551,24 +832,161 @@ def create_reader(url):
 class BinaryLog(object):
     "Container for sequence of events"
 
-    def __init__(self, reader):
+    def __init__(self, reader, cache=None):
         """Create a binary log.
         
         If a string is provided, it is assumed to be a URL and is used
         to construct a reader for reading events. Any other value is
         assumed to behave as a Reader and used directly.
+
+        If a cache (see mysql.replicant.cache) is provided, it is used
+        for binary logs read from files. The common headers of the
+        events are then loaded from the cache if the file was parsed
+        before, and saved to the cache once all events of a binary
+        log that is not in use are read.
         """
         if (isinstance(reader, basestring)):
             reader = create_reader(reader)
         self.__reader = reader
+        self.__cache = cache
         self.format_description = None
 
     def events(self):
+        """Generator returning the stubs for the events in the binary
+        log.
+
+        The format description events are decoded as they are read
+        and used to frame the events that follow them. Note that relay
+        logs can contain several format description events.
+        """
+        filename = getattr(self.__reader, 'filename', None)
+        if self.__cache is None or filename is None:
+            for stub in self.__read_events(None):
+                yield stub
+            return
+
+        columns = self.__cache.load(filename, 'binlog')
+        if columns is not None:
+            for stub in self.__cached_events(columns):
+                yield stub
+            return
+
+        values = dict((name, []) for name, _ in _CACHE_COLUMNS)
+        for stub in self.__read_events(values):
+            yield stub
+        first = self.format_description
+        if first is not None and not first.flags & LOG_EVENT_BINLOG_IN_USE_F:
+            from mysql.replicant.cache import pack_array
+            self.__cache.store(filename, 'binlog', dict(
+                    (name, pack_array(code, values[name]))
+                    for name, code in _CACHE_COLUMNS))
+
+    def __read_events(self, values):
+        """Read the events from the reader, optionally saving the
+        common header fields in values."""
+        istream = self.__reader.istream
         try:
-            event = Stub(self.__reader.istream)
-            self.format_description = event.decode()
-            yield event
             while True:
-                yield Stub(self.__reader.istream)
+                stub = Stub(istream, self.format_description)
+                if stub.type_code == FORMAT_DESCRIPTION_EVENT:
+                    self.format_description = stub.decode()
+                if values is not None:
+                    for name, _ in _CACHE_COLUMNS:
+                        values[name].append(getattr(stub, name))
+                yield stub
         except EOFError:
             pass
+
+    def __cached_events(self, columns):
+        """Create stubs from the common header fields in the cache.
+
+        The format description events are read from the binary log,
+        since they are needed to interpret the other events.
+        """
+        from mysql.replicant.cache import unpack_array
+        istream = self.__reader.istream
+        fields = [unpack_array(code, columns[name])
+                  for name, code in _CACHE_COLUMNS]
+        for field in itertools.izip(*fields):
+            if field[2] == FORMAT_DESCRIPTION_EVENT:
+                istream.seek(field[0])
+                stub = Stub(istream, self.format_description)
+                self.format_description = stub.decode()
+            else:
+                stub = _CachedStub(istream, self.format_description, field)
+            yield stub
+
+def _query_text(stub):
+    """Extract the query of a query event without decoding the status
+    variables, which are skipped using their length."""
+    db_len, = struct.unpack_from("<B", stub.body, 8)
+    sv_len, = struct.unpack_from("<H", stub.body, 11)
+    start = stub.post_header_length + sv_len + db_len + 1
+    return stub.body[start:stub.data_length]
+
+class GTIDTracker(object):
+    """Track the executed GTID set while reading a binary log.
+
+    The tracker is seeded from the Previous_gtids event at the start
+    of each binary log and adds the GTID of each transaction when the
+    transaction ends, so when reading the events through feed(), the
+    executed set holds exactly the transactions the consumer has
+    processed::
+
+       tracker = GTIDTracker()
+       for stub in tracker.feed(BinaryLog('master-bin.000001').events()):
+           process(stub)
+           if time_to_checkpoint():
+               save(tracker.snapshot())
+
+    Only GTID, Previous_gtids, query, and XID events are decoded.
+    """
+
+    def __init__(self, executed=None):
+        if executed is None:
+            executed = GTIDSet('')
+        elif not isinstance(executed, GTIDSet):
+            executed = GTIDSet(executed)
+        self.executed = executed
+        self.__pending = None
+        self.__in_transaction = False
+
+    def snapshot(self):
+        "Return a copy of the executed GTID set."
+        return self.executed.copy()
+
+    def __commit(self):
+        self.executed.add(*self.__pending)
+        self.__pending = None
+        self.__in_transaction = False
+
+    def update(self, stub):
+        """Update the executed set with an event that has been
+        processed."""
+        type_code = stub.type_code
+        if type_code == GTID_LOG_EVENT:
+            if self.__pending is not None:
+                # The previous transaction ended without an event
+                # that we recognize as the end of a transaction.
+                self.__commit()
+            event = stub.decode()
+            self.__pending = (event.sid, event.gno)
+        elif self.__pending is None:
+            if type_code == PREVIOUS_GTIDS_LOG_EVENT:
+                self.executed.union(stub.decode().gtids)
+        elif type_code == XID_EVENT:
+            self.__commit()
+        elif type_code == QUERY_EVENT:
+            query = _query_text(stub)
+            if query == "BEGIN":
+                self.__in_transaction = True
+            elif not self.__in_transaction or query in ("COMMIT",
+                                                         "ROLLBACK"):
+                self.__commit()
+
+    def feed(self, stubs):
+        """Generator passing on the stubs and updating the executed
+        set with each stub once the consumer asks for the next one."""
+        for stub in stubs:
+            yield stub
+            self.update(stub)
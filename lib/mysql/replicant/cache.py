@@ -0,0 +1,119 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Use of this source code is goverened by a BSD licence that can be
+# found in the LICENCE file.
+
+"""Module holding a persistent cache for parsed binary logs.
+
+Closed binary logs and dumps from mysqlbinlog do not change, so the
+result of parsing them can be saved and re-used the next time the
+same file is read. The cache is opt-in: create a cache for a
+directory and pass it to the reader::
+
+   cache = ParseCache('/var/tmp/replicant-cache')
+   for event in read_events(open('master-bin.000001.txt'), cache=cache):
+       ...
+   for stub in BinaryLog('master-bin.000001', cache=cache).events():
+       ...
+
+Each parsed file is stored in a cache file of its own, holding the
+events column by column: numeric columns as packed arrays, and other
+columns as lists serialized using marshal. A cache file is only used
+if the path, size, modification time, and a content hash of the file
+match what was stored.
+"""
+
+import array
+import hashlib
+import marshal
+import os
+import tempfile
+
+_MAGIC = "RPLCACHE\x01"
+
+# Number of bytes at the beginning and at the end of a file that are
+# hashed to detect changes that the size and modification time do not
+# reveal. Hashing the complete file would cost about as much as the
+# parse we are trying to avoid.
+_HASH_SAMPLE = 1024 * 1024
+
+def _content_hash(path, size):
+    """Compute a hash of the contents of a file by sampling the
+    beginning and the end of the file."""
+    digest = hashlib.md5()
+    with open(path, 'rb') as istream:
+        digest.update(istream.read(_HASH_SAMPLE))
+        if size > _HASH_SAMPLE:
+            istream.seek(max(_HASH_SAMPLE, size - _HASH_SAMPLE))
+            digest.update(istream.read(_HASH_SAMPLE))
+    return digest.hexdigest()
+
+def pack_array(typecode, values):
+    "Pack a sequence of numbers into a string."
+    return array.array(typecode, values).tostring()
+
+def unpack_array(typecode, string):
+    "Unpack a string created with pack_array()."
+    result = array.array(typecode)
+    result.fromstring(string)
+    return result
+
+class ParseCache(object):
+    """A persistent cache of parsed files, stored in a directory.
+
+    The parsed contents of a file is a dictionary of columns, which
+    are created and interpreted by the reader using the cache. The
+    kind is used to separate caches from different readers for the
+    same file.
+    """
+
+    def __init__(self, directory):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+
+    def _key(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        return (path, stat.st_size, int(stat.st_mtime),
+                _content_hash(path, stat.st_size))
+
+    def _cache_file(self, path, kind):
+        name = hashlib.md5(os.path.abspath(path)).hexdigest()
+        return os.path.join(self.directory, "%s.%s" % (name, kind))
+
+    def load(self, path, kind):
+        """Load the columns for a file from the cache.
+
+        Returns None if the file is not in the cache or if the file
+        has changed since it was stored.
+        """
+        try:
+            with open(self._cache_file(path, kind), 'rb') as istream:
+                if istream.read(len(_MAGIC)) != _MAGIC:
+                    return None
+                key = marshal.load(istream)
+                if key != self._key(path):
+                    return None
+                return marshal.load(istream)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+
+    def store(self, path, kind, columns):
+        """Store the columns for a file in the cache.
+
+        The cache file is written to a temporary file first and then
+        renamed, so readers never see a partially written cache file.
+        """
+        key = self._key(path)
+        handle, tmpfile = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(handle, 'wb') as output:
+                output.write(_MAGIC)
+                marshal.dump(key, output)
+                marshal.dump(columns, output)
+            os.rename(tmpfile, self._cache_file(path, kind))
+        except:
+            os.remove(tmpfile)
+            raise
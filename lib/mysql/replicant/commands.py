@@ -6,6 +6,8 @@
 
 import mysql.replicant.errors as _errors
 
+from mysql.replicant.ssh import SESSIONS
+
 import subprocess
 
 def lock_database(server):
@@ -32,15 +34,16 @@ def change_master(slave, master, position=None):
     except AttributeError:
         raise _errors.NotMasterError
 
-    slave.sql("STOP SLAVE")
-    if position:
-        slave.sql(_CHANGE_MASTER_TO,
-                  (master.host, master.port, user.name, user.passwd,
-                   position.file, position.pos))
-    else:
-        slave.sql(_CHANGE_MASTER_TO_NO_POS,
-                  (master.host, master.port, user.name, user.passwd))
-    slave.sql("START SLAVE")
+    with slave.batch() as batch:
+        batch.sql("STOP SLAVE")
+        if position:
+            batch.sql(_CHANGE_MASTER_TO,
+                      (master.host, master.port, user.name, user.passwd,
+                       position.file, position.pos))
+        else:
+            batch.sql(_CHANGE_MASTER_TO_NO_POS,
+                      (master.host, master.port, user.name, user.passwd))
+        batch.sql("START SLAVE")
     slave.disconnect()
 
 def fetch_master_position(server):
@@ -48,11 +51,10 @@ def fetch_master_position(server):
     the binary log"""
 
     from mysql.replicant.server import Position
-    try:
-        result = server.sql("SHOW MASTER STATUS")
-        return Position(result["File"], result["Position"])
-    except _errors.EmptyRowError:
+    result = server.status('master')
+    if result is None:
         raise _errors.NotMasterError
+    return Position(result["File"], result["Position"])
 
 def fetch_slave_position(server):
     """Get the position of the next event to be read from the master.
@@ -61,12 +63,11 @@ def fetch_slave_position(server):
 
     from mysql.replicant.server import Position
 
-    try:
-        result = server.sql("SHOW SLAVE STATUS")
-        return Position(result["Relay_Master_Log_File"],
-                        result["Exec_Master_Log_Pos"])
-    except _errors.EmptyRowError:
+    result = server.status('slave')
+    if result is None:
         raise _errors.NotSlaveError
+    return Position(result["Relay_Master_Log_File"],
+                    result["Exec_Master_Log_Pos"])
 
 _START_SLAVE_UNTIL = """START SLAVE UNTIL
     MASTER_LOG_FILE=%s, MASTER_LOG_POS=%s"""
@@ -77,11 +78,18 @@ def slave_wait_for_pos(slave, position):
     slave.sql(_MASTER_POS_WAIT, (position.file, position.pos))
 
 def slave_status_wait_until(server, field, pred):
+    """Poll the slave status until the value of field satisfies pred,
+    fetching the status at most once every status_ttl seconds, or
+    continuously if status_ttl is zero."""
     while True:
-        row = server.sql("SHOW SLAVE STATUS")
+        row = server.status('slave')
+        if row is None:
+            raise _errors.NotSlaveError
         value = row[field]
         if pred(value):
             return value
+        if server.status_ttl:
+            server.sleep(server.status_ttl)
 
 def slave_wait_and_stop(slave, position):
     """Set up replication so that it will wait for the position to be
@@ -93,7 +101,9 @@ def slave_wait_and_stop(slave, position):
     
 def slave_wait_for_empty_relay_log(server):
     "Wait until the relay log is empty and return."
-    result = server.sql("SHOW SLAVE STATUS")
+    result = server.status('slave', refresh=True)
+    if result is None:
+        raise _errors.NotSlaveError
     fname = result["Master_Log_File"]
     pos = result["Read_Master_Log_Pos"]
     if server.sql(_MASTER_POS_WAIT, (fname, pos)) is None:
@@ -141,7 +151,8 @@ def clone(slave, source, master = None):
     source.ssh("tar Pzcf " + backup_name + " /usr/var/mysql")
     if master is not None:
         source.sql("START SLAVE")
-    subprocess.call(["scp", source.host + ":" + backup_name, slave.host + ":."])
+    subprocess.call(SESSIONS.scp_command([source.host + ":" + backup_name],
+                                         slave.host + ":."))
     slave.ssh("tar Pzxf " + backup_name + " /usr/var/mysql")
     if master is None:
         change_master(slave, source, position)
@@ -6,6 +6,8 @@
 
 import os, shutil, re, tempfile, subprocess, ConfigParser
 
+from mysql.replicant.ssh import SESSIONS
+
 _NONE_MARKER = "<>"
 
 def _fetch_file(host, user, filename):
@@ -17,7 +19,7 @@ def _fetch_file(host, user, filename):
 
     if host != "localhost":
         source = user + "@" + host + ":" + filename
-        subprocess.check_call(["scp", "-qB", source, tmpfile])
+        subprocess.check_call(SESSIONS.scp_command([source], tmpfile))
     else:
         shutil.copyfile(filename, tmpfile)
     return tmpfile
@@ -25,7 +27,7 @@ def _fetch_file(host, user, filename):
 def _replace_file(host, user, filename, source):
     if host != "localhost":
         target = user + "@" + host + ":" + filename
-        subprocess.check_call(["scp", "-qB", source, target])
+        subprocess.check_call(SESSIONS.scp_command([source], target))
     else:
         shutil.copyfile(source, filename)
 
@@ -0,0 +1,187 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Use of this source code is goverened by a BSD licence that can be
+# found in the LICENCE file.
+
+"""Module for aggregating statistics about queries in a binary log.
+
+Queries are normalized into fingerprints, where literals are replaced
+with placeholders, lists of values are collapsed, and whitespace is
+folded, so that statements that differ only in their parameters end
+up with the same digest. Statistics are then collected for each
+digest in a single pass over a stream of query events, which tells
+what kind of statements dominate the work a slave has to do when
+applying the binary log::
+
+   digests = Digester()
+   digests.feed(BinaryLog('master-bin.000001').events())
+   for stats in digests.top(10):
+       print stats.count, stats.fingerprint
+
+Query events from both the binary log reader and the mysqlbinlog
+parser can be used.
+"""
+
+import collections
+import hashlib
+import re
+
+# Tokenizer for literals, comments, and whitespace. The order of the
+# alternatives matters: comments and strings have to be recognized
+# before anything inside them is considered.
+_TOKEN_CRE = re.compile(
+    r"(?P<comment>/\*.*?\*/|(?:--\s|#)[^\n]*)"
+    r"|(?P<string>'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\")"
+    r"|(?P<ident>`(?:[^`]|``)*`|[A-Za-z_$][\w$]*)"
+    r"|(?P<number>(?:0x[0-9A-Fa-f]+|\d+(?:\.\d*)?(?:[eE][-+]?\d+)?"
+    r"|\.\d+(?:[eE][-+]?\d+)?))"
+    r"|(?P<space>\s+)",
+    re.DOTALL)
+
+_SPACE_CRE = re.compile(r" {2,}")
+_COMMA_CRE = re.compile(r" ?, ?")
+_PAREN_CRE = re.compile(r"(?<=\() | (?=\))")
+_LIST_START_CRE = re.compile(r"\b(in|values) ?\(")
+# A minus is unary, and part of the literal, when it follows an
+# operator, an opening parenthesis, a comma, or a keyword that is
+# followed by an expression.
+_NEGATIVE_CRE = re.compile(
+    r"(^|[(,=<>!+\-*/%]|\b(?:select|where|and|or|not|xor|on|by|when|then"
+    r"|else|set|values|limit|offset|between|like|is|in|interval|return))"
+    r"( ?)- ?\?")
+_IN_LIST_CRE = re.compile(r"\bin \(\?(?:, ?\?)*\)")
+_VALUES_LIST_CRE = re.compile(r"\((?:\?, ?)*\?\)(?:, ?\((?:\?, ?)*\?\))+")
+
+def _replace_token(mobj):
+    kind = mobj.lastgroup
+    if kind == 'ident':
+        ident = mobj.group(kind)
+        if ident[0] == '`':
+            return ident
+        return ident.lower()
+    elif kind in ('space', 'comment'):
+        return ' '
+    else:
+        return '?'
+
+def fingerprint(query):
+    """Normalize a query into a fingerprint.
+
+    All string and numeric literals are replaced with '?', comments
+    are removed, whitespace is folded into single spaces, and
+    unquoted identifiers and keywords are lowercased. Spacing around
+    commas and parentheses is normalized and a unary minus is folded
+    into the literal following it. Lists of placeholders in IN-lists
+    and multi-row VALUES lists are collapsed into a single '?+' and
+    '(?+)' respectively.
+    """
+    result = _TOKEN_CRE.sub(_replace_token, query)
+    result = _SPACE_CRE.sub(' ', result).strip()
+    result = _COMMA_CRE.sub(", ", result)
+    result = _PAREN_CRE.sub("", result)
+    result = _LIST_START_CRE.sub(r"\1 (", result)
+    result = _NEGATIVE_CRE.sub(r"\1\2?", result)
+    result = _IN_LIST_CRE.sub("in (?+)", result)
+    result = _VALUES_LIST_CRE.sub("(?+)", result)
+    return result.rstrip(';').rstrip()
+
+class DigestStats(object):
+    "Statistics collected for a single digest."
+
+    __slots__ = ('digest', 'fingerprint', 'count', 'bytes',
+                 'exec_time', 'max_exec_time', 'errors')
+
+    def __init__(self, digest, fprint):
+        self.digest = digest
+        self.fingerprint = fprint
+        self.count = 0
+        self.bytes = 0
+        self.exec_time = 0
+        self.max_exec_time = 0
+        self.errors = collections.defaultdict(int)
+
+    def __str__(self):
+        return "{0} count={1} bytes={2} exec_time={3} {4}".format(
+            self.digest, self.count, self.bytes, self.exec_time,
+            self.fingerprint)
+
+class Digester(object):
+    """Aggregate query events into statistics per digest.
+
+    Normalizing a query is the expensive part of the aggregation, so
+    the digests of the most recently seen query texts are remembered
+    in a LRU memo of memo_size entries. Identical query texts are
+    common in statement-based binary logs since applications tend to
+    issue the same statements with the same parameters repeatedly.
+    """
+
+    def __init__(self, memo_size=4096):
+        self.__memo = collections.OrderedDict()
+        self.__memo_size = memo_size
+        self.__stats = {}
+
+    def digest(self, query):
+        """Compute the digest and fingerprint for a query.
+
+        Returns a tuple (digest, fingerprint), where digest is a
+        hexadecimal hash of the fingerprint.
+        """
+        memo = self.__memo
+        try:
+            result = memo.pop(query)
+        except KeyError:
+            fprint = fingerprint(query)
+            result = (hashlib.md5(fprint).hexdigest()[:16], fprint)
+            if len(memo) >= self.__memo_size:
+                memo.popitem(last=False)
+        memo[query] = result
+        return result
+
+    def add(self, event):
+        """Add a single query event to the statistics."""
+        digest, fprint = self.digest(event.query)
+        try:
+            stats = self.__stats[digest]
+        except KeyError:
+            stats = self.__stats[digest] = DigestStats(digest, fprint)
+        exec_time = int(event.exec_time)
+        stats.count += 1
+        stats.bytes += event.size
+        stats.exec_time += exec_time
+        if exec_time > stats.max_exec_time:
+            stats.max_exec_time = exec_time
+        error_code = int(event.error_code)
+        if error_code:
+            stats.errors[error_code] += 1
+
+    def feed(self, events):
+        """Add all query events in a stream of events.
+
+        Events that are not query events are ignored, and stubs from
+        the binary log reader are decoded only if they are query
+        events.
+        """
+        from mysql.replicant.binary_log import Stub, QUERY_EVENT
+        for event in events:
+            if isinstance(event, Stub):
+                if event.type_code != QUERY_EVENT:
+                    continue
+                event = event.decode()
+            if hasattr(event, 'query'):
+                self.add(event)
+        return self
+
+    def stats(self):
+        "Return the statistics for all digests seen."
+        return self.__stats.values()
+
+    def top(self, count=None, key='exec_time'):
+        """Return the statistics for the digests sorted on the given
+        key in descending order, optionally limited to the first count
+        entries."""
+        result = sorted(self.__stats.values(),
+                        key=lambda stats: getattr(stats, key), reverse=True)
+        if count is not None:
+            result = result[:count]
+        return result
@@ -64,3 +64,19 @@ class BadMagicError(Error):
     """Exception raised when the magic for a binary log is incorrect.
     """
     pass
+
+class ConnectionPoolTimeoutError(Error):
+    """Exception raised when no connection could be checked out from
+    a connection pool within the timeout.
+    """
+    pass
+
+class ServerTimeoutError(Error):
+    """Exception raised when an operation on a server does not
+    complete within the allotted time."""
+    pass
+
+class StreamOpenError(Error):
+    """Exception raised when a statement is executed while a streamed
+    result on the same connection still has rows to read."""
+    pass
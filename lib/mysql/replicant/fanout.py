@@ -0,0 +1,324 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Use of this source code is goverened by a BSD licence that can be
+# found in the LICENCE file.
+
+"""Module for distributing one binary log stream to several consumers.
+
+A hub reads the events of a binary log once and publishes the raw
+event bytes into a ring buffer placed in shared memory. Each consumer
+keeps its own cursor into the ring buffer and will only decode the
+events it is interested in, which means that several agents working
+on the same binary log do not have to read and frame it independently.
+
+The hub and the consumers have to be created before the consumer
+processes are started (that is, before the processes are forked), so
+a typical usage is::
+
+   hub = Hub(BinaryLog('master-bin.000001'))
+   consumers = [hub.subscribe() for _ in range(3)]
+   procs = [multiprocessing.Process(target=work, args=(c,))
+            for c in consumers]
+   for proc in procs:
+       proc.start()
+   hub.run()
+
+"""
+
+import mmap
+import multiprocessing
+import struct
+
+import mysql.replicant.binary_log as _binlog
+
+BLOCK = 'block'
+DROP = 'drop'
+
+# Each record in the ring buffer consists of a record header holding
+# the length of the event and the position of the event in the binary
+# log, followed by the raw event bytes (common header and body).
+_RECORD_HEADER = struct.Struct("<LQ")
+
+# Cursor value used for consumers that have stopped reading. It is
+# larger than any real cursor, so it never holds back the hub.
+_DETACHED = 2 ** 63
+
+# Room for the format description event record pinned for each
+# consumer. The event is about a hundred bytes in all server versions.
+_PINNED_SIZE = 1024
+
+class _RecordStream(object):
+    """Stream over the raw bytes of one event, used to construct a
+    stub from a ring buffer record.
+    """
+    def __init__(self, data, pos):
+        self.__data = data
+        self.__pos = pos
+        self.__offset = 0
+
+    def tell(self):
+        return self.__pos + self.__offset
+
+    def read(self, count):
+        result = self.__data[self.__offset:self.__offset + count]
+        self.__offset += len(result)
+        return result
+
+class Consumer(object):
+    """A consumer of the events published by a hub.
+
+    A consumer is created using Hub.subscribe() and can then be passed
+    to a separate process. The events are read using the events()
+    method, which will return undecoded stubs.
+    """
+
+    def __init__(self, hub, index):
+        self.__hub = hub
+        self.__index = index
+
+    @property
+    def dropped(self):
+        """Number of events that were dropped for this consumer because
+        it did not keep up with the hub."""
+        return self.__hub._dropped[self.__index]
+
+    def close(self):
+        """Stop consuming events, which allows the hub to continue
+        without waiting for this consumer."""
+        with self.__hub._cond:
+            self.__hub._cursor[self.__index] = _DETACHED
+            self.__hub._cond.notify_all()
+
+    def events(self, types=None):
+        """Generator returning the stubs for the events in the stream.
+
+        If types is given, it should be a collection of type codes and
+        only events of those types will be returned. Other events are
+        skipped by just looking at the common header.
+
+        The format description events are always decoded, since they
+        are needed to frame the events following them.
+        """
+        hub = self.__hub
+        index = self.__index
+        header_length = _RECORD_HEADER.size
+        type_offset = header_length + 4
+        format_description = None
+        while True:
+            with hub._cond:
+                pinned = hub._unpin(index)
+            if pinned is not None:
+                # The hub dropped a format description event that we
+                # had not read, so we use the copy it pinned for us.
+                _, pos = _RECORD_HEADER.unpack(pinned[:header_length])
+                stream = _RecordStream(pinned[header_length:], pos)
+                stub = _binlog.Stub(stream, format_description)
+                format_description = stub.decode()
+                if types is None or stub.type_code in types:
+                    yield stub
+                continue
+
+            with hub._cond:
+                cursor = hub._cursor[index]
+                while cursor == hub._written.value and not hub._closed.value:
+                    hub._cond.wait()
+                    cursor = hub._cursor[index]
+                if cursor >= hub._written.value:
+                    return
+
+            length, pos = _RECORD_HEADER.unpack(hub._peek(cursor,
+                                                          header_length))
+            data = None
+            if types is None:
+                data = hub._peek(cursor + header_length, length)
+            else:
+                type_code = ord(hub._peek(cursor + type_offset, 1))
+                if type_code in types or \
+                        type_code == _binlog.FORMAT_DESCRIPTION_EVENT:
+                    data = hub._peek(cursor + header_length, length)
+
+            with hub._cond:
+                # If the hub moved our cursor while we were copying,
+                # the record was dropped and might have been
+                # overwritten, so we just restart from the new cursor.
+                if hub._cursor[index] != cursor:
+                    continue
+                hub._cursor[index] = cursor + header_length + length
+                hub._cond.notify_all()
+
+            if data is None:
+                continue
+            stub = _binlog.Stub(_RecordStream(data, pos), format_description)
+            if stub.type_code == _binlog.FORMAT_DESCRIPTION_EVENT:
+                format_description = stub.decode()
+            if types is None or stub.type_code in types:
+                yield stub
+
+class Hub(object):
+    """Hub reading a binary log once and distributing the events to
+    several consumers through a ring buffer in shared memory.
+
+    The policy decides what to do when the ring buffer is full
+    because a consumer is not keeping up:
+
+    BLOCK
+       The hub will wait for the slowest consumer to catch up. This is
+       the default.
+
+    DROP
+       The oldest events of the slow consumers are dropped to make
+       room for new events. The number of dropped events is available
+       from Consumer.dropped. If a format description event is
+       dropped, a copy of it is kept and delivered to the consumer
+       before the events following the drop, since they cannot be
+       decoded without it.
+    """
+
+    def __init__(self, binlog, size=16 * 1024 * 1024, consumers=8,
+                 policy=BLOCK):
+        if policy not in (BLOCK, DROP):
+            raise ValueError("Unknown policy '%s'" % (policy,))
+        self.__binlog = binlog
+        self.__size = size
+        self.__policy = policy
+        self.__subscribed = 0
+
+        # Anonymous shared mappings are inherited by forked processes,
+        # so the ring buffer is visible to all consumer processes.
+        self.__buffer = mmap.mmap(-1, size)
+
+        # Cursors are byte counts from the start of the stream and
+        # are never wrapped; the position in the ring buffer is the
+        # cursor modulo the size of the ring buffer.
+        self._cond = multiprocessing.Condition()
+        self._written = multiprocessing.Value('L', 0, lock=False)
+        self._closed = multiprocessing.Value('b', 0, lock=False)
+        self._cursor = multiprocessing.Array('L', consumers, lock=False)
+        self._dropped = multiprocessing.Array('L', consumers, lock=False)
+        self._pinned = multiprocessing.Array('c', consumers * _PINNED_SIZE,
+                                             lock=False)
+        self._pinned_length = multiprocessing.Array('L', consumers,
+                                                    lock=False)
+
+    def subscribe(self):
+        """Create a new consumer of the events.
+
+        All consumers have to be created before the hub starts to
+        publish events.
+        """
+        if self.__subscribed == len(self._cursor):
+            raise ValueError("Too many consumers for hub")
+        consumer = Consumer(self, self.__subscribed)
+        self.__subscribed += 1
+        return consumer
+
+    def _peek(self, cursor, count):
+        """Read count bytes from the ring buffer starting at cursor."""
+        start = cursor % self.__size
+        end = start + count
+        if end <= self.__size:
+            return self.__buffer[start:end]
+        return self.__buffer[start:] + self.__buffer[:end - self.__size]
+
+    def _poke(self, cursor, data):
+        """Write data into the ring buffer starting at cursor."""
+        start = cursor % self.__size
+        split = min(len(data), self.__size - start)
+        self.__buffer[start:start + split] = data[:split]
+        if split < len(data):
+            self.__buffer[:len(data) - split] = data[split:]
+
+    def __pin(self, index, cursor, count):
+        """Copy the record of a format description event that is
+        dropped for a consumer, so that it can still be delivered.
+        Has to be called with the condition held."""
+        if self._pinned_length[index]:
+            # The event pinned before is replaced without being read
+            self._dropped[index] += 1
+        start = index * _PINNED_SIZE
+        self._pinned[start:start + count] = self._peek(cursor, count)
+        self._pinned_length[index] = count
+
+    def _unpin(self, index):
+        """Return the record of the format description event pinned
+        for a consumer, or None if there is none. Has to be called
+        with the condition held."""
+        count = self._pinned_length[index]
+        if count == 0:
+            return None
+        self._pinned_length[index] = 0
+        start = index * _PINNED_SIZE
+        return self._pinned[start:start + count]
+
+    def _make_room(self, needed):
+        """Ensure that there is room for needed bytes in the ring
+        buffer, either by waiting for the consumers or by dropping
+        events for the slow consumers. Has to be called with the
+        condition held."""
+        written = self._written.value
+        limit = written + needed - self.__size
+        if self.__policy == BLOCK:
+            while self.__subscribed and \
+                    min(self._cursor[:self.__subscribed]) < limit:
+                self._cond.wait()
+        else:
+            type_offset = _RECORD_HEADER.size + 4
+            for index in range(self.__subscribed):
+                cursor = self._cursor[index]
+                while cursor < limit:
+                    length, _ = _RECORD_HEADER.unpack(
+                        self._peek(cursor, _RECORD_HEADER.size))
+                    count = _RECORD_HEADER.size + length
+                    type_code = ord(self._peek(cursor + type_offset, 1))
+                    if type_code == _binlog.FORMAT_DESCRIPTION_EVENT:
+                        self.__pin(index, cursor, count)
+                    else:
+                        self._dropped[index] += 1
+                    cursor += count
+                self._cursor[index] = cursor
+
+    def publish(self, stub):
+        """Publish the raw bytes of a single event to the consumers."""
+        header = struct.pack("<LBLLLH", stub.when, stub.type_code,
+                             stub.server_id, stub.size, stub.end_pos,
+                             stub.flags)
+        if stub.format_description is not None:
+            # Keep the common header the length the consumers expect
+            header_length = stub.format_description.header_length
+            header = header[:header_length].ljust(header_length, '\0')
+        record = _RECORD_HEADER.pack(len(header) + len(stub.body),
+                                     stub.pos) + header + stub.body
+        if len(record) > self.__size:
+            raise ValueError("Event at %d does not fit in ring buffer"
+                             % (stub.pos,))
+        if stub.type_code == _binlog.FORMAT_DESCRIPTION_EVENT and \
+                len(record) > _PINNED_SIZE:
+            raise ValueError("Format description event at %d is too large"
+                             % (stub.pos,))
+        with self._cond:
+            self._make_room(len(record))
+            written = self._written.value
+        # Only the hub writes into the ring buffer and the consumers
+        # will not look beyond the written count, so we can copy the
+        # record without holding the lock.
+        self._poke(written, record)
+        with self._cond:
+            self._written.value = written + len(record)
+            self._cond.notify_all()
+
+    def close(self):
+        """Mark the end of the stream so that the consumers stop once
+        they have read all published events."""
+        with self._cond:
+            self._closed.value = 1
+            self._cond.notify_all()
+
+    def run(self):
+        """Read all events from the binary log and publish them to the
+        consumers."""
+        try:
+            for stub in self.__binlog.events():
+                self.publish(stub)
+        finally:
+            self.close()
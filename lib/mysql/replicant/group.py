@@ -0,0 +1,231 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Use of this source code is goverened by a BSD licence that can be
+# found in the LICENCE file.
+
+"""Module for executing operations on many servers concurrently.
+
+A server group runs the same operation on all its servers using a
+bounded number of worker threads, which means that the time to
+collect, for example, the slave status of a large number of servers
+is dominated by the slowest server instead of by the sum of them::
+
+   group = ServerGroup(slaves, workers=64, timeout=10)
+   for outcome in group.sql("SHOW SLAVE STATUS").as_completed():
+       if outcome.error:
+           print outcome.server.name, "failed:", outcome.error
+       else:
+           print outcome.server.name, outcome.result["Seconds_Behind_Master"]
+
+Any function taking a server as first argument, such as the functions
+in mysql.replicant.commands, can be run using call().
+"""
+
+import collections
+import threading
+import time
+import Queue
+
+from mysql.replicant import errors
+
+Outcome = collections.namedtuple('Outcome', 'server,result,error')
+
+_STARTED, _DONE = range(2)
+
+class GroupCall(object):
+    """The outcome of running an operation on all servers of a group.
+
+    The operation is started when the object is created and the
+    outcomes can be retrieved, as they complete, in server order, or
+    all at once. Each outcome is an Outcome tuple holding the server,
+    the result, and the exception raised by the operation (or None).
+
+    If a timeout is given, a server where the operation has not
+    completed within timeout seconds from when it started gets a
+    ServerTimeoutError as error. Threads cannot be interrupted, so the
+    operation will still occupy its thread until it returns, but the
+    result is ignored. A new worker is started in its place, so that
+    the servers that have not been started yet are not held up, and
+    the thread of the operation that timed out exits when the
+    operation returns.
+    """
+
+    def __init__(self, servers, func, args, kwargs, workers, timeout):
+        self.servers = list(servers)
+        self.__timeout = timeout
+        self.__tasks = Queue.Queue()
+        self.__events = Queue.Queue()
+        self.__outcomes = {}
+        self.__order = []
+        self.__started = {}
+        self.__abandoned = set()    # Servers that timed out
+        self.__lock = threading.Lock()
+        self.__abandon_lock = threading.Lock()
+        self.__operation = (func, args, kwargs)
+        for index in range(len(self.servers)):
+            self.__tasks.put(index)
+        for _ in range(min(workers, len(self.servers))):
+            self.__start_worker()
+
+    def __start_worker(self):
+        thread = threading.Thread(target=self.__work, args=self.__operation)
+        thread.daemon = True
+        thread.start()
+
+    def __work(self, func, args, kwargs):
+        while True:
+            try:
+                index = self.__tasks.get_nowait()
+            except Queue.Empty:
+                return
+            server = self.servers[index]
+            self.__events.put((_STARTED, index, time.time()))
+            result, error = None, None
+            try:
+                result = func(server, *args, **kwargs)
+            except Exception, err:  # pylint: disable=W0703
+                error = err
+            finally:
+                # Return the connection of this thread to the pool,
+                # since the worker thread will not use it again.
+                disconnect = getattr(server, 'disconnect', None)
+                if disconnect is not None:
+                    try:
+                        disconnect()
+                    except Exception:   # pylint: disable=W0703
+                        pass
+            self.__events.put((_DONE, index, Outcome(server, result, error)))
+            with self.__abandon_lock:
+                if index in self.__abandoned:
+                    return      # A replacement worker was started
+
+    def __complete(self, index, outcome):
+        "Record an outcome unless the server already has one."
+        if index in self.__outcomes:
+            return False
+        self.__outcomes[index] = outcome
+        self.__order.append(index)
+        return True
+
+    def __abandon(self, index):
+        """Give up on the worker running the operation on a server and
+        start a new worker if there are servers left to start."""
+        with self.__abandon_lock:
+            self.__abandoned.add(index)
+        if not self.__tasks.empty():
+            self.__start_worker()
+
+    def __collect(self):
+        """Wait for the next outcome and record it. Returns False if
+        all outcomes have been recorded."""
+        if len(self.__outcomes) == len(self.servers):
+            return False
+        while True:
+            wait = None
+            if self.__timeout is not None:
+                now = time.time()
+                pending = [(start, index)
+                           for index, start in self.__started.iteritems()
+                           if index not in self.__outcomes]
+                if pending:
+                    start, index = min(pending)
+                    wait = start + self.__timeout - now
+                    if wait <= 0:
+                        error = errors.ServerTimeoutError(
+                            "No result within %s seconds" % (self.__timeout,))
+                        self.__complete(
+                            index, Outcome(self.servers[index], None, error))
+                        self.__abandon(index)
+                        return True
+            try:
+                event = self.__events.get(timeout=wait)
+            except Queue.Empty:
+                continue
+            if event[0] == _STARTED:
+                self.__started[event[1]] = event[2]
+            elif self.__complete(event[1], event[2]):
+                return True
+
+    def as_completed(self):
+        "Iterate over the outcomes in the order they complete."
+        position = 0
+        while True:
+            with self.__lock:
+                while position == len(self.__order):
+                    if not self.__collect():
+                        return
+                index = self.__order[position]
+            position += 1
+            yield self.__outcomes[index]
+
+    def __iter__(self):
+        "Iterate over the outcomes in the order of the servers."
+        for index in range(len(self.servers)):
+            with self.__lock:
+                while index not in self.__outcomes:
+                    self.__collect()
+            yield self.__outcomes[index]
+
+    def wait(self):
+        "Wait for all outcomes and return them in server order."
+        return list(self)
+
+    def results(self):
+        """Wait for all outcomes and return a dictionary from server
+        to result for the servers where the operation succeeded."""
+        return dict((outcome.server, outcome.result)
+                    for outcome in self if outcome.error is None)
+
+    def errors(self):
+        """Wait for all outcomes and return a dictionary from server
+        to exception for the servers where the operation failed."""
+        return dict((outcome.server, outcome.error)
+                    for outcome in self if outcome.error is not None)
+
+class ServerGroup(object):
+    """A group of servers where operations are executed concurrently.
+
+    workers
+       Maximum number of servers that an operation is running on at
+       the same time.
+
+    timeout
+       Default number of seconds an operation may run on a single
+       server before it is considered failed, or None to wait
+       forever.
+    """
+
+    def __init__(self, servers, workers=16, timeout=None):
+        self.servers = list(servers)
+        self.workers = workers
+        self.timeout = timeout
+
+    def __iter__(self):
+        return iter(self.servers)
+
+    def __len__(self):
+        return len(self.servers)
+
+    def call(self, func, *args, **kwargs):
+        """Call func(server, *args, **kwargs) for all servers in the
+        group and return a GroupCall for the outcomes. A timeout
+        keyword argument overrides the timeout of the group."""
+        timeout = kwargs.pop('timeout', self.timeout)
+        return GroupCall(self.servers, func, args, kwargs,
+                         self.workers, timeout)
+
+    def sql(self, command, args=None, database='', timeout=None):
+        "Execute a SQL command on all servers in the group."
+        return self.call(_sql, command, args, database,
+                         timeout=timeout or self.timeout)
+
+    def ssh(self, command, timeout=None):
+        "Execute a shell command on all servers in the group."
+        return self.call(_ssh, command, timeout=timeout or self.timeout)
+
+def _sql(server, command, args, database):
+    return server.sql(command, args, database)
+
+def _ssh(server, command):
+    return server.ssh(command)
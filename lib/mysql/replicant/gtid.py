@@ -0,0 +1,431 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Use of this source code is goverened by a BSD licence that can be
+# found in the LICENCE file.
+
+"""Module holding GTIDs and GTID sets.
+
+"""
+
+import bisect
+import collections
+import re
+
+from itertools import izip
+from uuid import UUID
+
+GTID = collections.namedtuple('GTID', 'uuid,gid')
+
+def _normalize(rngs):
+    """Normalize a list of ranges by merging ranges, if possible, and
+    turning single-position ranges into tuples.
+
+    The normalization is sort the ranges first on the tuples, which
+    makes comparisons easy when merging range sets.
+    """
+
+    result = []
+    last = None
+    for rng in sorted(rngs):
+        if len(rng) == 1:
+            rng = (rng[0], rng[0])
+        if last is None:
+            last = rng
+        elif rng[1] <= last[1]:
+            pass
+        elif rng[0] <= last[1] or last[1] + 1 >= rng[0]:
+            last = (last[0], max(rng[1], last[1]))
+        else:
+            result.append(last)
+            last = rng
+    result.append(last)
+    return result
+
+
+# The ranges of each UUID in a GTID set are kept as a pair of sorted
+# parallel lists (starts, ends) of inclusive bounds, where the ranges
+# are disjoint and not adjacent. This allows membership tests using
+# bisect and linear merges of sets without building tuples.
+
+def _intervals(rngs):
+    "Create the interval lists for a normalized list of ranges."
+    return [rng[0] for rng in rngs], [rng[1] for rng in rngs]
+
+def _union(lhs, rhs):
+    """Merge two interval lists into a new interval list holding the
+    ranges of both."""
+    lstarts, lends = lhs
+    rstarts, rends = rhs
+    lcount, rcount = len(lstarts), len(rstarts)
+    starts, ends = [], []
+    i = j = 0
+    while i < lcount or j < rcount:
+        if j == rcount or (i < lcount and lstarts[i] <= rstarts[j]):
+            start, end = lstarts[i], lends[i]
+            i += 1
+        else:
+            start, end = rstarts[j], rends[j]
+            j += 1
+        if ends and start <= ends[-1] + 1:
+            if end > ends[-1]:
+                ends[-1] = end
+        else:
+            starts.append(start)
+            ends.append(end)
+    return starts, ends
+
+def _subset(lhs, rhs):
+    """Check if all ranges of the lhs interval list are included in
+    the rhs interval list.
+
+    Since the ranges are not adjacent, each range of lhs has to be
+    inside a single range of rhs. The ranges of rhs that end before a
+    range of lhs starts are skipped using bisect.
+    """
+    rstarts, rends = rhs
+    rcount = len(rstarts)
+    j = 0
+    for start, end in izip(*lhs):
+        j = bisect.bisect_left(rends, start, j)
+        if j == rcount or rstarts[j] > start or rends[j] < end:
+            return False
+    return True
+
+def _intersection(lhs, rhs):
+    """Compute the intersection of two interval lists."""
+    lstarts, lends = lhs
+    rstarts, rends = rhs
+    lcount, rcount = len(lstarts), len(rstarts)
+    starts, ends = [], []
+    i = j = 0
+    while i < lcount and j < rcount:
+        start = max(lstarts[i], rstarts[j])
+        end = min(lends[i], rends[j])
+        if start <= end:
+            starts.append(start)
+            ends.append(end)
+        if lends[i] < rends[j]:
+            i += 1
+        else:
+            j += 1
+    return starts, ends
+
+def _difference(lhs, rhs):
+    """Compute the ranges of the lhs interval list that are not in the
+    rhs interval list."""
+    rstarts, rends = rhs
+    rcount = len(rstarts)
+    starts, ends = [], []
+    j = 0
+    for start, end in izip(*lhs):
+        # Skip the rhs ranges ending before this range
+        j = bisect.bisect_left(rends, start, j)
+        k = j
+        while k < rcount and rstarts[k] <= end:
+            if rstarts[k] > start:
+                starts.append(start)
+                ends.append(rstarts[k] - 1)
+            start = rends[k] + 1
+            k += 1
+        if start <= end:
+            starts.append(start)
+            ends.append(end)
+        # The last rhs range can overlap the next lhs range as well
+        j = max(j, k - 1)
+    return starts, ends
+
+def _compare_sets(lhs, rhs):
+    """Compare two GTID sets.
+
+    Return a tuple (lhs, rhs) where lhs is a boolean indicating that
+    the left hand side had at least one more item than the right hand
+    side, and vice verse.
+    """
+    return not lhs.issubset(rhs), not rhs.issubset(lhs)
+
+def _coerce(obj):
+    "Turn an object into a GTID set, if it is not already one."
+    if isinstance(obj, GTIDSet):
+        return obj
+    return GTIDSet(obj)
+
+# Canonical UUID strings, which are used as is, and a cache of parsed
+# UUIDs mapping the text in GTID sets to interned canonical strings.
+_UUID_CRE = re.compile(
+    r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\Z')
+_UUIDS = {}
+_UUIDS_MAX = 10000
+
+def _parse_uuid(text):
+    """Parse a UUID into its canonical form. The result is interned,
+    so all GTID sets share the same string for a UUID."""
+    try:
+        return _UUIDS[text]
+    except KeyError:
+        pass
+    uuid = text.strip()
+    if not _UUID_CRE.match(uuid):
+        # This fandango is done to handle other forms of UUID that
+        # the UUID class can handle. We, however, use the standard
+        # form for our UUIDs.
+        uuid = str(UUID(uuid))
+    if len(_UUIDS) >= _UUIDS_MAX:
+        _UUIDS.clear()
+    uuid = _UUIDS[text] = intern(str(uuid))
+    return uuid
+
+def uuid_from_bytes(data):
+    """Return the interned canonical form of a UUID given as 16 bytes,
+    as stored in binary log events."""
+    try:
+        return _UUIDS[data]
+    except KeyError:
+        pass
+    if len(_UUIDS) >= _UUIDS_MAX:
+        _UUIDS.clear()
+    uuid = _UUIDS[data] = _parse_uuid(str(UUID(bytes=data)))
+    return uuid
+
+def _parse_ranges(parts):
+    """Parse the ranges of a UUID set into an interval list.
+
+    Servers print normalized sets, so the ranges are collected
+    directly and only normalized if they turn out to be unordered or
+    overlapping.
+    """
+    starts, ends = [], []
+    ordered = True
+    for part in parts:
+        first, sep, last = part.partition('-')
+        start = int(first)
+        end = int(last) if sep else start
+        if start > end:
+            raise ValueError("Range %s is not a valid range" % (part,))
+        if ends and start <= ends[-1] + 1:
+            ordered = False
+        starts.append(start)
+        ends.append(end)
+    if ordered:
+        return starts, ends
+    return _intervals(_normalize(zip(starts, ends)))
+
+class GTIDSet(object):
+    """A set of GTIDs.
+
+    The set can be created from the string representation used by the
+    server, for example the value of gtid_executed, where newlines
+    between the UUID sets are allowed. The string representation is
+    cached until the set is changed.
+    """
+
+    def __init__(self, obj):
+        gtids = {}
+        if not isinstance(obj, basestring):
+            obj = str(obj)      # Try to make it into a string that we parse
+
+        # Parse the string and construct a GTID set. An empty string
+        # is the empty set, as printed by the server.
+        uuid_sets = obj.split(',') if obj.strip() else []
+        for uuid_set in uuid_sets:
+            parts = uuid_set.split(':')
+            uuid = _parse_uuid(parts.pop(0))
+            if len(parts) == 0 or not parts[0]:
+                raise ValueError("At least one range have to be provided")
+            intervals = _parse_ranges(parts)
+            if uuid in gtids:
+                intervals = _union(gtids[uuid], intervals)
+            gtids[uuid] = intervals
+        self.__gtids = gtids
+        self.__str = None
+
+    @classmethod
+    def _from_intervals(cls, gtids):
+        """Create a GTID set from a dictionary mapping UUIDs to
+        interval lists, which are used without copying."""
+        result = cls.__new__(cls)
+        result.__gtids = gtids
+        result.__str = None
+        return result
+
+    def copy(self):
+        "Return a copy of the GTID set."
+        return GTIDSet._from_intervals(dict(
+                (uuid, (list(starts), list(ends)))
+                for uuid, (starts, ends) in self.__gtids.iteritems()))
+
+    def __str__(self):
+        if self.__str is None:
+            sets = []
+            for uuid, (starts, ends) in sorted(self.__gtids.items()):
+                sets.append(uuid + ':' + ':'.join(
+                        map('%d-%d'.__mod__, izip(starts, ends))))
+            self.__str = ','.join(sets)
+        return self.__str
+
+    def union(self, other):
+        """Compute the union of this GTID set and the GTID set in
+        other.
+
+        The update of the GTID set is done in-place, so if you want to
+        compute the union of two sets 'lhs' and 'rhs' without changing
+        them, use 'lhs | rhs' instead.
+        """
+
+        # If it wasn't already a GTIDSet, try to make it one.
+        other = _coerce(other)
+        gtids = self.__gtids
+        self.__str = None
+        for uuid, intervals in other.__gtids.iteritems():
+            if uuid not in gtids:
+                gtids[uuid] = (list(intervals[0]), list(intervals[1]))
+            else:
+                gtids[uuid] = _union(gtids[uuid], intervals)
+
+    def add(self, uuid, gid):
+        """Add a single GTID to the set. The uuid has to be in the
+        canonical form.
+
+        Adding the GTID following the last GTID of a UUID, which is
+        the normal case when following a binary log, extends the last
+        range in constant time.
+        """
+        self.__str = None
+        intervals = self.__gtids.get(uuid)
+        if intervals is None:
+            self.__gtids[uuid] = ([gid], [gid])
+            return
+        starts, ends = intervals
+        if ends[-1] + 1 == gid:
+            ends[-1] = gid
+        elif ends[-1] < gid:
+            starts.append(gid)
+            ends.append(gid)
+        else:
+            self.__gtids[uuid] = _union(intervals, ([gid], [gid]))
+
+    def issubset(self, other):
+        """Check if all GTIDs of this set are also in other, without
+        building any intermediate sets."""
+        other = _coerce(other)
+        for uuid, intervals in self.__gtids.iteritems():
+            if uuid not in other.__gtids:
+                return False
+            if not _subset(intervals, other.__gtids[uuid]):
+                return False
+        return True
+
+    def __lt__(self, other):
+        other = _coerce(other)
+        return self.issubset(other) and not other.issubset(self)
+
+    def __le__(self, other):
+        return self.issubset(other)
+
+    def __eq__(self, other):
+        # Interval lists are normalized, so equal sets have equal
+        # interval lists.
+        if not isinstance(other, GTIDSet):
+            try:
+                other = GTIDSet(other)
+            except ValueError:
+                return False
+        return self.__gtids == other.__gtids
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __ge__(self, other):
+        return _coerce(other).issubset(self)
+
+    def __gt__(self, other):
+        return _coerce(other).__lt__(self)
+
+    def __or__(self, other):
+        result = self.copy()
+        result.union(other)
+        return result
+
+    def intersection(self, other):
+        "Return a new GTID set with the GTIDs in both sets."
+        other = _coerce(other)
+        gtids = {}
+        for uuid, intervals in self.__gtids.iteritems():
+            if uuid in other.__gtids:
+                result = _intersection(intervals, other.__gtids[uuid])
+                if result[0]:
+                    gtids[uuid] = result
+        return GTIDSet._from_intervals(gtids)
+
+    def difference(self, other):
+        """Return a new GTID set with the GTIDs in this set that are
+        not in other."""
+        other = _coerce(other)
+        gtids = {}
+        for uuid, intervals in self.__gtids.iteritems():
+            if uuid in other.__gtids:
+                result = _difference(intervals, other.__gtids[uuid])
+            else:
+                result = (list(intervals[0]), list(intervals[1]))
+            if result[0]:
+                gtids[uuid] = result
+        return GTIDSet._from_intervals(gtids)
+
+    def symmetric_difference(self, other):
+        """Return a new GTID set with the GTIDs that are in exactly one
+        of the sets."""
+        other = _coerce(other)
+        result = self.difference(other)
+        result.union(other.difference(self))
+        return result
+
+    __and__ = intersection
+    __sub__ = difference
+    __xor__ = symmetric_difference
+
+    def __contains__(self, gtid):
+        """Check if a GTID is in the set. The GTID can be a GTID tuple
+        or a string of the form 'uuid:number'."""
+        if isinstance(gtid, basestring):
+            uuid, gid = gtid.rsplit(':', 1)
+        else:
+            uuid, gid = gtid
+        gid = int(gid)
+        intervals = self.__gtids.get(uuid)
+        if intervals is None:
+            intervals = self.__gtids.get(str(UUID(uuid)))
+            if intervals is None:
+                return False
+        starts, ends = intervals
+        index = bisect.bisect_right(starts, gid) - 1
+        return index >= 0 and ends[index] >= gid
+
+    def __len__(self):
+        "Return the number of transactions in the set."
+        return sum(sum(ends) - sum(starts) + len(starts)
+                   for starts, ends in self.__gtids.itervalues())
+
+    def ranges(self):
+        """Iterate over the ranges of the set as tuples (uuid, first,
+        last), sorted on UUID and first GTID."""
+        for uuid, (starts, ends) in sorted(self.__gtids.items()):
+            for start, end in izip(starts, ends):
+                yield uuid, start, end
+
+    def gaps(self):
+        """Iterate over the ranges missing from the set as tuples (uuid,
+        first, last), that is, the GTIDs between 1 and the largest GTID
+        of each UUID that are not in the set."""
+        for uuid, (starts, ends) in sorted(self.__gtids.items()):
+            last = 0
+            for start, end in izip(starts, ends):
+                if start > last + 1:
+                    yield uuid, last + 1, start - 1
+                last = end
+
+    def missing(self, other):
+        """Iterate over the ranges of other that are missing from this
+        set as tuples (uuid, first, last). For example, the ranges
+        that a slave has to apply to catch up with a master are
+        slave_gtids.missing(master_gtids)."""
+        return _coerce(other).difference(self).ranges()
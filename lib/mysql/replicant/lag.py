@@ -0,0 +1,143 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Use of this source code is goverened by a BSD licence that can be
+# found in the LICENCE file.
+
+"""Module for computing how far slaves are behind their master.
+
+The lag of a slave is computed from the position of the master and
+the position of the slave, as the number of bytes of binary log and
+the number of binary log files the slave has left to execute. To
+compute the number of bytes when the positions are in different
+files, the sizes of the binary logs of the master are needed. These
+are fetched using SHOW BINARY LOGS and cached until the master rotates
+to a new binary log, so polling the lag of many slaves only needs one
+query to the master for each poll::
+
+   lag = LagCalculator(master)
+   for slave, behind in lag.poll(slaves).items():
+       print slave.name, behind.bytes, behind.files
+"""
+
+import collections
+import re
+
+from mysql.replicant import commands
+
+Lag = collections.namedtuple('Lag', 'bytes,files')
+
+# Size of the magic number at the start of each binary log, which is
+# not counted as part of the lag.
+_MAGIC_SIZE = 4
+
+_SEQUENCE_CRE = re.compile(r'^(.*)\.(\d+)$')
+
+def binlog_sequence(name):
+    """Split a binary log name into the base name and the sequence
+    number, such that binary log names can be compared numerically.
+    Names without a numeric extension get sequence number -1."""
+    mobj = _SEQUENCE_CRE.match(name)
+    if mobj is None:
+        return name, -1
+    return mobj.group(1), int(mobj.group(2))
+
+class LagCalculator(object):
+    """Compute the lag of slaves of a master.
+
+    The sizes of the binary logs of the master are cached together
+    with the accumulated sizes, so computing the lag of a slave is a
+    constant-time operation once the binary logs are known.
+    """
+
+    def __init__(self, master):
+        self.master = master
+        self.__names = []       # Binary logs, in sequence order
+        self.__index = {}       # Binary log name -> index
+        self.__offset = [0]     # Bytes before start of each binary log
+
+    def refresh(self):
+        "Fetch the names and sizes of the binary logs of the master."
+        logs = sorted(((row["Log_name"], row["File_size"])
+                       for row in self.master.sql("SHOW BINARY LOGS")),
+                      key=lambda log: binlog_sequence(log[0]))
+        self.__names = [name for name, _ in logs]
+        self.__index = dict((name, i) for i, name in enumerate(self.__names))
+        offset = [0]
+        for _, size in logs:
+            offset.append(offset[-1] + int(size) - _MAGIC_SIZE)
+        self.__offset = offset
+
+    def __refresh_once(self, refreshed):
+        """Fetch the binary logs of the master unless they have already
+        been fetched, as recorded in the one-element list refreshed."""
+        if not refreshed[0]:
+            self.refresh()
+            refreshed[0] = True
+
+    def __locate(self, fname, refreshed):
+        """Return the index of a binary log, fetching the binary logs
+        of the master if the file is not known."""
+        index = self.__index.get(fname)
+        if index is None:
+            self.__refresh_once(refreshed)
+            index = self.__index.get(fname)
+            if index is None:
+                raise ValueError("Binary log '%s' not found on master"
+                                 % (fname,))
+        return index
+
+    def lag(self, master_pos, slave_pos):
+        """Compute the lag between a master position and a slave
+        position. Returns a Lag tuple with the number of bytes and the
+        number of binary log files the slave is behind.
+
+        Raises ValueError if the binary log of either position is not
+        on the master, for example because it has been purged."""
+        return self.__lag(master_pos, slave_pos, [False])
+
+    def __lag(self, master_pos, slave_pos, refreshed):
+        if master_pos.file == slave_pos.file:
+            return Lag(max(master_pos.pos - slave_pos.pos, 0), 0)
+
+        # The size of the last binary log is not final, so if the
+        # master is not in the last binary log we know about, the
+        # master has rotated and the sizes have to be fetched again.
+        master_index = self.__index.get(master_pos.file)
+        if master_index is None or master_index != len(self.__names) - 1:
+            self.__refresh_once(refreshed)
+        master_index = self.__locate(master_pos.file, refreshed)
+        slave_index = self.__locate(slave_pos.file, refreshed)
+        if slave_index > master_index:
+            return Lag(0, 0)
+        offset = self.__offset
+        master_bytes = offset[master_index] + master_pos.pos - _MAGIC_SIZE
+        slave_bytes = offset[slave_index] + slave_pos.pos - _MAGIC_SIZE
+        files = (binlog_sequence(master_pos.file)[1]
+                 - binlog_sequence(slave_pos.file)[1])
+        return Lag(max(master_bytes - slave_bytes, 0), files)
+
+    def poll(self, slaves, workers=16):
+        """Compute the lag of a number of slaves.
+
+        The master position is fetched once and the slave positions
+        are fetched concurrently. The binary logs of the master are
+        fetched at most once. Returns a dictionary mapping each slave
+        to its lag, or to None if the position of the slave could not
+        be fetched or the slave is in a binary log that is not on the
+        master.
+        """
+        from mysql.replicant.group import ServerGroup
+        master_pos = commands.fetch_master_position(self.master)
+        result = {}
+        refreshed = [False]
+        group = ServerGroup(slaves, workers=workers)
+        for outcome in group.call(commands.fetch_slave_position):
+            result[outcome.server] = None
+            if outcome.error is None:
+                try:
+                    result[outcome.server] = self.__lag(
+                        master_pos, outcome.result, refreshed)
+                except ValueError:
+                    pass        # Binary log purged on the master
+        return result
@@ -9,8 +9,15 @@ present it using an API.
 
 """
 
-import subprocess
+import Queue
+import collections
+import itertools
+import mmap
+import multiprocessing
+import os
 import re
+import subprocess
+import threading
 import time
 
 from .. import errors
@@ -106,56 +113,223 @@ class StartEvent(LogEvent):
         self.binlog_version = binlog_version
         self.server_version = server_version
 
+class TableMapEvent(LogEvent):
+    """
+    Table map event, mapping a table id to a table.
+    """
+    def __init__(self, event_type, start_log_pos, end_log_pos, timestamp,
+                 server_id, database, table, table_id):
+        LogEvent.__init__(self, event_type, start_log_pos, end_log_pos,
+                          timestamp, server_id)
+        self.database = database
+        self.table = table
+        self.table_id = table_id
+
+# Pseudo-SQL lines that mysqlbinlog --verbose writes for row events.
+# The values are written as "@N=value", optionally followed by a
+# comment with type information when -vv is used.
+_ROW_STMT_CRE = re.compile(r'^### (INSERT INTO|UPDATE|DELETE FROM) '
+                           r'(\S+)[ \t]*$', re.MULTILINE)
+_ROW_VALUE_CRE = re.compile(r'^###   @(\d+)=(.*?)(?: /\*.*\*/)?[ \t]*$',
+                            re.MULTILINE)
+_ROW_INT_CRE = re.compile(r'-?\d+$')
+_ROW_FLOAT_CRE = re.compile(r'-?\d*\.\d+(?:[eE][-+]?\d+)?$')
+_ROW_ESCAPES = {
+    '0': '\0', 'b': '\b', 'n': '\n', 'r': '\r', 't': '\t', 'Z': '\x1a',
+    }
+# The hexadecimal escapes have to be tried first, since the second
+# alternative matches any escaped character, including "x".
+_ROW_ESCAPE_CRE = re.compile(r'\\x([0-9a-fA-F]{2})|\\(.)')
+
+def _unescape(mobj):
+    if mobj.group(1):
+        return chr(int(mobj.group(1), 16))
+    return _ROW_ESCAPES.get(mobj.group(2), mobj.group(2))
+
+def _row_value(value):
+    """Convert a value written by mysqlbinlog into a Python value.
+
+    Strings are unquoted, integers and floating-point numbers are
+    converted, NULL becomes None, and anything else (such as the
+    signed and unsigned representations of an integer) is returned as
+    written.
+    """
+    if value.startswith("'") and value.endswith("'") and len(value) > 1:
+        return _ROW_ESCAPE_CRE.sub(_unescape, value[1:-1])
+    elif value == 'NULL':
+        return None
+    elif _ROW_INT_CRE.match(value):
+        return int(value)
+    elif _ROW_FLOAT_CRE.match(value):
+        return float(value)
+    return value
+
+def _parse_row_images(body):
+    """Parse the row images of a row event.
+
+    Returns a list with one tuple (statement, table, images) for each
+    row, where images is a list of row images in the order they are
+    written and each image is a dictionary from column number (1 for
+    the first column) to value.
+    """
+    result = []
+    stmts = list(_ROW_STMT_CRE.finditer(body))
+    for stmt, nxt in zip(stmts, stmts[1:] + [None]):
+        end = len(body) if nxt is None else nxt.start()
+        images = []
+        image = None
+        for line_start in _find_image_starts(body, stmt.end(), end):
+            if line_start is None:
+                image = None
+                continue
+            mobj = _ROW_VALUE_CRE.match(body, line_start)
+            if image is None:
+                image = {}
+                images.append(image)
+            image[int(mobj.group(1))] = _row_value(mobj.group(2))
+        result.append((stmt.group(1), stmt.group(2), images))
+    return result
+
+def _find_image_starts(body, start, end):
+    """Generator yielding the start of each value line in
+    body[start:end], and None for each WHERE or SET line, which
+    starts a new row image."""
+    pos = start
+    while pos < end:
+        pos = body.find('\n###', pos, end)
+        if pos < 0:
+            return
+        pos += 1
+        if body.startswith('###   @', pos):
+            yield pos
+        else:
+            yield None
+
+class RowsEvent(LogEvent):
+    """
+    Base class for the row events.
+
+    The row images are parsed from the pseudo-SQL that mysqlbinlog
+    writes when run with --verbose. Parsing the row images is only
+    done when the rows attribute is read for the first time, so the
+    cost of reading row events that are not used is small.
+    """
+
+    def __init__(self, event_type, start_log_pos, end_log_pos, timestamp,
+                 server_id, table_id, flags, body):
+        LogEvent.__init__(self, event_type, start_log_pos, end_log_pos,
+                          timestamp, server_id)
+        self.table_id = table_id
+        self.flags = flags
+        self.__body = body
+        self.__rows = None
+
+    def _images(self):
+        """Return the parsed row images. The body is dropped once the
+        images are parsed, since it is not needed any more."""
+        if self.__rows is None:
+            self.__rows = _parse_row_images(self.__body)
+            self.__body = None
+        return self.__rows
+
+    @property
+    def table(self):
+        """The table the rows belong to, as written by mysqlbinlog, or
+        None if the event does not contain any row images."""
+        rows = self._images()
+        if rows:
+            return rows[0][1]
+        return None
+
+class WriteRowsEvent(RowsEvent):
+    """
+    Write rows event. The rows are a list of dictionaries mapping
+    column number to value.
+    """
+
+    @property
+    def rows(self):
+        return [images[0] for _, _, images in self._images()]
+
+class DeleteRowsEvent(RowsEvent):
+    """
+    Delete rows event. The rows are a list of dictionaries mapping
+    column number to value.
+    """
+
+    @property
+    def rows(self):
+        return [images[0] for _, _, images in self._images()]
+
+class UpdateRowsEvent(RowsEvent):
+    """
+    Update rows event. The rows are a list of tuples (before, after)
+    where each image is a dictionary mapping column number to value.
+    """
+
+    @property
+    def rows(self):
+        return [tuple(images[0:2]) for _, _, images in self._images()]
+
 class UnknownEvent(LogEvent):
     """An unknown event"""
     def __init__(self, event_type, start_log_pos, end_log_pos, timestamp,
-                 server_id, binlog_version, server_version):
+                 server_id):
         LogEvent.__init__(self, event_type, start_log_pos, end_log_pos,
                           timestamp, server_id)
 
 
+# Cache of parsed timestamps. Events are written at a rate of many
+# events each second, so consecutive events usually share the same
+# timestamp string.
+_TIMESTAMP_CACHE = {}
+_TIMESTAMP_CACHE_SIZE = 1024
+
+def _parse_timestamp(timestamp):
+    """Parse a timestamp in the format used by mysqlbinlog, using a
+    cache for timestamps seen recently."""
+    try:
+        return _TIMESTAMP_CACHE[timestamp]
+    except KeyError:
+        if len(_TIMESTAMP_CACHE) >= _TIMESTAMP_CACHE_SIZE:
+            _TIMESTAMP_CACHE.clear()
+        result = time.strptime(timestamp, "%y%m%d %H:%M:%S")
+        _TIMESTAMP_CACHE[timestamp] = result
+        return result
+
 class LogEventReader(object):
     """Base class for log event readers.
 
-    All event readers inherit from this class.
+    All event readers inherit from this class. A reader is created
+    once for each parse and the read() method is then called for each
+    event of the type the reader handles, with the fields of the
+    common event header as a tuple, the remains of the event header
+    line, and the body of the event, which is all the lines of the
+    event following the header line.
 
     """
 
-    def __init__(self, event_type, start_pos, end_pos, server_id,
-                 timestamp, delimiter):
-        self.event_type = event_type
-        self.start_pos = int(start_pos)
-        self.end_pos = int(end_pos)
-        self.server_id = int(server_id)
-        self.timestamp = time.strptime(timestamp, "%y%m%d %H:%M:%S")
+    def __init__(self, delimiter):
         self.delimiter = delimiter
-        self.line = None
 
-    def read(self, rest, istream):
+    def read(self, header, rest, body):
         return None
 
-    def _eat_until_next_event(self, istream):
-        """Read lines until it matches the beginning of a new event"""
-        mobj, line = None, None
-        while not mobj:
-            line = istream.next()
-            mobj = re.match(r'# at (\d+)', line)
-        self.line = line
+    def _strip_delimiter(self, string):
+        """Remove the delimiter, if present, from the end of a
+        string."""
+        if string.endswith(self.delimiter):
+            return string[:-len(self.delimiter)]
+        return string
 
 class UnrecognizedEventReader(LogEventReader):
     """
-    Reader that will always return an event representing 
+    Reader that will always return an event representing an unknown
+    event.
     """
-    def __init__(self, event_type, start_pos, end_pos, server_id,
-                 timestamp, delimiter):
-        LogEventReader.__init__(self, event_type, start_pos, end_pos,
-                                server_id, timestamp, delimiter)
-        self.line = None
 
-    def read(self, rest, istream):
-        self._eat_until_next_event(istream)
-        return UnknownEvent(self.event_type, self.start_pos, self.end_pos,
-                            self.server_id, self.timestamp)
+    def read(self, header, rest, body):
+        return UnknownEvent(*header)
 
 class QueryEventReader(LogEventReader):
     """
@@ -166,102 +340,67 @@ class QueryEventReader(LogEventReader):
 
     _QUERY_CRE = re.compile(r'\s*thread_id=(\d+)\s+'
                             r'exec_time=(\d+)\s+'
-                            r'error_code=(\d+)\s+')
-
-    def __init__(self, event_type, start_pos, end_pos, server_id,
-                 timestamp, delimiter):
-        LogEventReader.__init__(self, event_type, start_pos, end_pos,
-                                server_id, timestamp, delimiter)
-        self.line = None
-
-    def read(self, rest, istream):
+                            r'error_code=(\d+)')
+
+    def __init__(self, delimiter):
+        LogEventReader.__init__(self, delimiter)
+        # The body starts with a sequence of lines ending in the
+        # delimiter. These are generated by mysqlbinlog to encode
+        # special information. Then comes the query, consisting of
+        # one or more lines, ending with a single line with the
+        # delimiter.
+        self.__special_cre = re.compile(
+            r'(?:[^\n]*[^\n]%s\n)*' % (re.escape(delimiter),))
+        self.__end = '\n' + delimiter
+
+    def read(self, header, rest, body):
         """
-        Will return a new event and the first line that is not part of
-        the event, or None if there are no more lines.
+        Will return a new event from the header line and the body of
+        the event.
         """
 
         thread_id, exec_time, error_code = _match_regex(self._QUERY_CRE, rest)
-
-        # After the header line, there is a sequence of lines ending
-        # in the delimiter. These are generated by mysqlbinlog to
-        # encode special information.
-        self.line = istream.next()
-        while self.line[-len(self.delimiter):] == self.delimiter:
-            self.line = istream.next()
-
-        # Now comes the query, consisting of one or more lines ending
-        # with a single line with the delimiter.
-        query_lines = []
-        while self.line[:-1] != self.delimiter:
-            query_lines.append(self.line)
-            self.line = istream.next()
-
-        # Then we need to ensure that self.line is the next line that
-        # is not part of the event.
-        self.line = istream.next()
-
-        return QueryEvent(self.event_type, self.start_pos, self.end_pos,
-                          self.server_id, self.timestamp,
-                          thread_id, exec_time, error_code,
-                          ''.join(query_lines))
+        start = self.__special_cre.match(body).end()
+        end = body.rfind(self.__end, start)
+        if end < 0:
+            end = len(body)
+        event_type, start_pos, end_pos, timestamp, server_id = header
+        return QueryEvent(event_type, start_pos, end_pos, server_id,
+                          timestamp, thread_id, exec_time, error_code,
+                          body[start:end])
 
 class IntvarEventReader(LogEventReader):
     """Reader to read an Intvar event for handling auto_increment values."""
 
     TYPE_STRING = "Intvar"
 
-    def __init__(self, event_type, start_pos, end_pos, server_id,
-                 timestamp, delimiter):
-        LogEventReader.__init__(self, event_type, start_pos, end_pos,
-                                server_id, timestamp, delimiter)
-
-    def read(self, rest, istream):
-        self.line = istream.next()
-        mobj = re.match("set\s+(\w+)\s*=\s*(.+)", self.line, re.IGNORECASE)
-        if not mobj:
-            raise UnrecognizedFormatError, self.line
-        name, value = mobj.groups()
-        self._eat_until_next_event(istream)
-        return IntvarEvent(self.event_type, self.start_pos, self.end_pos,
-                           self.server_id, self.timestamp, name, value)
+    _INTVAR_CRE = re.compile(r"set\s+(\w+)\s*=\s*(.+)", re.IGNORECASE)
+
+    def read(self, header, rest, body):
+        name, value = _match_regex(self._INTVAR_CRE, body)
+        return IntvarEvent(*header + (name, self._strip_delimiter(value)))
 
 class UservarEventReader(LogEventReader):
     """Reader for processing a user variable assignment event."""
 
     TYPE_STRING = "User_var"
 
-    def __init__(self, event_type, start_pos, end_pos, server_id,
-                 timestamp, delimiter):
-        LogEventReader.__init__(self, event_type, start_pos, end_pos,
-                                server_id, timestamp, delimiter)
-        
-    def read(self, rest, istream):
-        self.line = istream.next()
-        mobj = re.match("set\s+(@\S+)\s*:=\s*(.+)", self.line, re.IGNORECASE)
-        if not mobj:
-            raise UnrecognizedFormatError, self.line
-        name, value = mobj.groups()
-        self._eat_until_next_event(istream)
-        return UservarEvent(self.event_type, self.start_pos, self.end_pos,
-                            self.server_id, self.timestamp, name, value)
-            
+    _USERVAR_CRE = re.compile(r"set\s+(@\S+?)\s*:=\s*(.+)", re.IGNORECASE)
+
+    def read(self, header, rest, body):
+        name, value = _match_regex(self._USERVAR_CRE, body)
+        return UservarEvent(*header + (name, self._strip_delimiter(value)))
 
 class XidEventReader(LogEventReader):
+    """Reader for transaction commit events."""
+
     TYPE_STRING = "Xid"
 
-    def __init__(self, event_type, start_pos, end_pos, server_id,
-                 timestamp, delimiter):
-        LogEventReader.__init__(self, event_type, start_pos, end_pos,
-                                server_id, timestamp, delimiter)
+    _XID_CRE = re.compile(r"\s*=\s*(\d+)")
 
-    def read(self, rest, istream):
-        mobj = re.match("\s*=\s*(\d+)", rest)
-        if not mobj:
-            raise UnrecognizedFormatError, rest
-        xid = mobj.groups()
-        self._eat_until_next_event(istream)
-        return XidEvent(self.event_type, self.start_pos, self.end_pos,
-                        self.server_id, self.timestamp, xid)
+    def read(self, header, rest, body):
+        xid, = _match_regex(self._XID_CRE, rest)
+        return XidEvent(*header + (xid,))
 
 class StartEventReader(LogEventReader):
     """Start event reader.
@@ -274,19 +413,52 @@ class StartEventReader(LogEventReader):
                             r'server v\s*(\S+)\s+'
                             r'created\s*(\d{6}\s+\d?\d:\d\d:\d\d)')
 
-    def __init__(self, event_type, start_pos, end_pos, server_id,
-                 timestamp, delimiter):
-        LogEventReader.__init__(self, event_type, start_pos, end_pos,
-                                server_id, timestamp, delimiter)
-        self.line = None
-
-    def read(self, rest, istream):
+    def read(self, header, rest, body):
         matches = _match_regex(self._START_CRE, rest)
         binlog_version, server_string = matches[0:2]
-        self._eat_until_next_event(istream)
-        return StartEvent(self.event_type, self.start_pos, self.end_pos,
-                          self.server_id, self.timestamp,
-                          binlog_version, server_string)
+        return StartEvent(*header + (binlog_version, server_string))
+
+class TableMapEventReader(LogEventReader):
+    """Reader for table map events."""
+
+    TYPE_STRING = "Table_map"
+
+    _TABLE_MAP_CRE = re.compile(r':\s*`((?:[^`]|``)*)`\.`((?:[^`]|``)*)`'
+                                r'\s+mapped to number\s+(\d+)')
+
+    def read(self, header, rest, body):
+        database, table, table_id = _match_regex(self._TABLE_MAP_CRE, rest)
+        return TableMapEvent(*header + (database, table, int(table_id)))
+
+class RowsEventReader(LogEventReader):
+    """Reader for row events.
+
+    The body of the event is kept by the event and only parsed if the
+    rows of the event are requested.
+    """
+
+    EVENT_CLASS = None
+
+    _ROWS_CRE = re.compile(r':\s*table id\s+(\d+)(?:\s+flags:\s*(.*?))?\s*$')
+
+    def read(self, header, rest, body):
+        table_id, flags = _match_regex(self._ROWS_CRE, rest)
+        return self.EVENT_CLASS(*header + (int(table_id), flags, body))
+
+class WriteRowsEventReader(RowsEventReader):
+    """Reader for write rows events."""
+    TYPE_STRING = "Write_rows"
+    EVENT_CLASS = WriteRowsEvent
+
+class UpdateRowsEventReader(RowsEventReader):
+    """Reader for update rows events."""
+    TYPE_STRING = "Update_rows"
+    EVENT_CLASS = UpdateRowsEvent
+
+class DeleteRowsEventReader(RowsEventReader):
+    """Reader for delete rows events."""
+    TYPE_STRING = "Delete_rows"
+    EVENT_CLASS = DeleteRowsEvent
 
 # We could probably loop the dictionary and find all the events of the
 # form "...Reader", but I prefer to be explicit here and name the
@@ -297,61 +469,488 @@ _READER = {
     UservarEventReader.TYPE_STRING: UservarEventReader,
     XidEventReader.TYPE_STRING: XidEventReader,
     StartEventReader.TYPE_STRING: StartEventReader,
+    TableMapEventReader.TYPE_STRING: TableMapEventReader,
+    WriteRowsEventReader.TYPE_STRING: WriteRowsEventReader,
+    UpdateRowsEventReader.TYPE_STRING: UpdateRowsEventReader,
+    DeleteRowsEventReader.TYPE_STRING: DeleteRowsEventReader,
 }
 
+# Some versions write version 1 of the row events with a suffix.
+for _reader in (WriteRowsEventReader, UpdateRowsEventReader,
+                DeleteRowsEventReader):
+    _READER[_reader.TYPE_STRING + '_v1'] = _reader
+del _reader
+
+# Each event starts with a "# at" line followed by the event header
+# line, so a single expression is used to find the event boundaries
+# and the fields of the event header at the same time.
+_EVENT_CRE = re.compile(r'^# at (\d+)[ \t]*\n'            # Position
+                        r'#(\d{6}\s+\d?\d:\d\d:\d\d)\s+'  # Datetime
+                        r'server id\s+(\d+)\s+'           # Server ID
+                        r'end_log_pos\s+(\d+)\s+'         # End log pos
+                        r'(?:CRC32\s+0x[0-9a-fA-F]+\s+)?'  # Checksum
+                        r'(\w+)'                          # Type
+                        r'([^\n]*)\n?',                   # Rest of line
+                        re.MULTILINE)
+
+_DELIMITER_CRE = re.compile(r'^delimiter (\S+)[ \t]*$',
+                            re.IGNORECASE | re.MULTILINE)
+_AT_CRE = re.compile(r'^# at (\d+)[ \t]*\n', re.MULTILINE)
+_END_CRE = re.compile(r'^DELIMITER\b', re.MULTILINE)
+
+# Size of the pieces read from the input when parsing.
+_CHUNK_SIZE = 4 * 1024 * 1024
+
+def _event_start_before(text, end):
+    """Return the offset of the start of the last event that starts
+    before end in text, or -1 if there is none after the start of the
+    text. Lines starting with "# at" in a query are not event starts,
+    so the header line following the "# at" line is checked as well."""
+    pos = end
+    while True:
+        pos = text.rfind('\n# at ', 0, pos)
+        if pos < 0:
+            return -1
+        if _EVENT_CRE.match(text, pos + 1):
+            return pos + 1
+
+def _event_start_after(text, start):
+    """Return the offset of the start of the first event that starts
+    at or after start in text, or -1 if there is none. See
+    _event_start_before()."""
+    pos = start - 1
+    while True:
+        pos = text.find('\n# at ', pos + 1)
+        if pos < 0:
+            return -1
+        if _EVENT_CRE.match(text, pos + 1):
+            return pos + 1
+
+def _read_chunks(istream, size):
+    """Read chunks of text from a stream.
+
+    The stream can be either a file-like object or an iterable over
+    lines, such as the output of commands.fetch_binlog().
+    """
+    if hasattr(istream, 'read'):
+        while True:
+            chunk = istream.read(size)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        lines, length = [], 0
+        for line in istream:
+            lines.append(line)
+            length += len(line)
+            if length >= size:
+                yield ''.join(lines)
+                lines, length = [], 0
+        if lines:
+            yield ''.join(lines)
+
+def parse_header(text):
+    """Parse the header of the output from mysqlbinlog.
+
+    Returns a tuple with the delimiter in use and the offset of the
+    first event in text.
+    """
+    mobj = _DELIMITER_CRE.search(text)
+    if not mobj:
+        raise UnrecognizedFormatError, text[:80]
+    delimiter = mobj.group(1)
+    mobj = _AT_CRE.search(text, mobj.end())
+    if not mobj:
+        raise UnrecognizedFormatError, text[:80]
+    return delimiter, mobj.start()
+
+def parse_events(text, delimiter, start=0, end=None):
+    """
+    Generator that parses the events in text[start:end].
+
+    The text should start with the "# at" line of an event and end
+    either at the "# at" line of the event following the last event,
+    or at the end of the output from mysqlbinlog.
+    """
 
-_TYPE_CRE = re.compile(r'#(\d{6}\s+\d?\d:\d\d:\d\d)\s+' # Datetime
-                       r'server id\s+(\d+)\s+'          # Server ID
-                       r'end_log_pos\s+(\d+)\s+'        # End log pos
-                       r'(\w+)')                        # Type
-                       
-def read_events(istream):
+    if end is None:
+        end = len(text)
+
+    readers = {}
+    unrecognized = UnrecognizedEventReader(delimiter)
+    previous, header, rest = start, None, None
+    for mobj in _EVENT_CRE.finditer(text, start, end):
+        if header is None:
+            if mobj.start() != start:
+                raise UnrecognizedFormatError, \
+                    text[start:text.find('\n', start)]
+        else:
+            yield reader.read(header, rest, text[previous:mobj.start() - 1])
+        (bytepos, datetime, server_id, end_pos,
+         type_str, rest) = mobj.groups()
+        header = (type_str, int(bytepos), int(end_pos),
+                  _parse_timestamp(datetime), int(server_id))
+        try:
+            reader = readers[type_str]
+        except KeyError:
+            reader_class = _READER.get(type_str)
+            if reader_class is None:
+                reader = unrecognized
+            else:
+                reader = reader_class(delimiter)
+            readers[type_str] = reader
+        previous = mobj.end()
+
+    if header is None:
+        if start < end:
+            raise UnrecognizedFormatError, text[start:text.find('\n', start)]
+        return
+
+    # The last event might be followed by the trailer that mysqlbinlog
+    # writes, which starts with a delimiter line.
+    trailer = _END_CRE.search(text, previous, end)
+    if trailer:
+        end = trailer.start()
+    yield reader.read(header, rest, text[previous:end].rstrip('\n'))
+
+# Attributes that all events have, and that are stored in columns of
+# their own in the parse cache.
+_COMMON_ATTRIBUTES = ('event_type', 'start_pos', 'end_pos', 'timestamp',
+                      'server_id')
+
+class _CacheColumns(object):
+    """Collect the attributes of events into columns for the parse
+    cache.
+
+    Event types and timestamps are stored in tables with each distinct
+    value only once, and referenced by index. The remaining attributes
+    are stored in one column for each event class and attribute.
     """
-    Generator that accepts a stream of input lines and parses it into
-    a sequence of events.
+
+    def __init__(self):
+        self.classes = []
+        self.types = []
+        self.timestamps = []
+        self.__index = {}
+        self.class_column = []
+        self.type_column = []
+        self.timestamp_column = []
+        self.start_pos = []
+        self.end_pos = []
+        self.server_id = []
+        self.attributes = {}
+
+    def __intern(self, table, value):
+        key = (id(table), value)
+        try:
+            return self.__index[key]
+        except KeyError:
+            self.__index[key] = len(table)
+            table.append(value)
+            return len(table) - 1
+
+    def add(self, event):
+        "Add the attributes of an event to the columns."
+        cls = type(event).__name__
+        self.class_column.append(self.__intern(self.classes, cls))
+        self.type_column.append(self.__intern(self.types, event.event_type))
+        self.timestamp_column.append(
+            self.__intern(self.timestamps, tuple(event.timestamp)))
+        self.start_pos.append(event.start_pos)
+        self.end_pos.append(event.end_pos)
+        self.server_id.append(event.server_id)
+        for name, value in vars(event).iteritems():
+            if name not in _COMMON_ATTRIBUTES:
+                self.attributes.setdefault(cls + '.' + name, []).append(value)
+
+    def pack(self):
+        "Pack the columns into a dictionary for the cache."
+        from mysql.replicant.cache import pack_array
+        return {
+            'classes': self.classes,
+            'types': self.types,
+            'timestamps': self.timestamps,
+            'class': pack_array('I', self.class_column),
+            'type': pack_array('I', self.type_column),
+            'timestamp': pack_array('I', self.timestamp_column),
+            'start_pos': pack_array('L', self.start_pos),
+            'end_pos': pack_array('L', self.end_pos),
+            'server_id': pack_array('L', self.server_id),
+            'attributes': self.attributes,
+            }
+
+def _cached_events(columns):
+    "Generator re-creating the events stored in the parse cache."
+    from mysql.replicant.cache import unpack_array
+    classes = [globals()[name] for name in columns['classes']]
+    types = columns['types']
+    timestamps = [time.struct_time(ts) for ts in columns['timestamps']]
+
+    # The attributes of each event class are consumed in order, so we
+    # keep an iterator for each attribute column of each class.
+    attributes = dict((cls, []) for cls in classes)
+    for key, values in columns['attributes'].iteritems():
+        cls_name, name = key.split('.', 1)
+        cls = globals()[cls_name]
+        attributes[cls].append((name, iter(values)))
+
+    for cls, type_idx, ts_idx, start_pos, end_pos, server_id in itertools.izip(
+        unpack_array('I', columns['class']),
+        unpack_array('I', columns['type']),
+        unpack_array('I', columns['timestamp']),
+        unpack_array('L', columns['start_pos']),
+        unpack_array('L', columns['end_pos']),
+        unpack_array('L', columns['server_id'])):
+        cls = classes[cls]
+        event = cls.__new__(cls)
+        state = dict((name, values.next()) for name, values in attributes[cls])
+        state['event_type'] = types[type_idx]
+        state['timestamp'] = timestamps[ts_idx]
+        state['start_pos'] = start_pos
+        state['end_pos'] = end_pos
+        state['server_id'] = server_id
+        event.__dict__ = state
+        yield event
+
+def read_events(istream, cache=None):
+    """
+    Generator that accepts a stream of input and parses it into a
+    sequence of events.
 
     It assumes that the input stream represents the complete output
     from mysqlbinlog and will first read the header, continuing with
     each individual event.
+
+    The stream is read in large chunks and only complete events are
+    parsed from each chunk, so the input does not have to fit in
+    memory.
+
+    If a cache (see mysql.replicant.cache) is provided and the stream
+    is a file, the events are loaded from the cache if the file was
+    parsed before, and saved to the cache once the complete file has
+    been parsed.
     """
 
-    # Read header
-    mobj = None
-    while not mobj:
-        line = istream.next()
-        mobj = re.match(r'delimiter (\S+)', line, re.IGNORECASE)
+    filename = getattr(istream, 'name', None)
+    if cache is None or not isinstance(filename, basestring) \
+            or not os.path.isfile(filename):
+        for event in _parse_stream(istream):
+            yield event
+        return
+
+    columns = cache.load(filename, 'mysqlbinlog')
+    if columns is not None:
+        for event in _cached_events(columns):
+            yield event
+        return
+
+    collected = _CacheColumns()
+    for event in _parse_stream(istream):
+        collected.add(event)
+        yield event
+    cache.store(filename, 'mysqlbinlog', collected.pack())
+
+def _parse_stream(istream):
+    "Generator parsing the events in a stream, see read_events()."
+
+    delimiter = None
+    text = ''
+    for chunk in _read_chunks(istream, _CHUNK_SIZE):
+        text += chunk
+        if delimiter is None:
+            try:
+                delimiter, start = parse_header(text)
+            except UnrecognizedFormatError:
+                continue        # Header not read completely yet
+            text = text[start:]
+
+        # Parse all events up to the start of the last event, which
+        # might not have been read completely.
+        last = _event_start_before(text, len(text))
+        if last > 0:
+            for event in parse_events(text, delimiter, 0, last):
+                yield event
+            text = text[last:]
+
+    if delimiter is None:
+        raise UnrecognizedFormatError, text[:80]
+    if text:
+        for event in parse_events(text, delimiter):
+            yield event
+
+# Size of the chunks that a dump file is split into for parallel
+# parsing.
+_PARALLEL_CHUNK_SIZE = 64 * 1024 * 1024
+
+def _find_split_points(text, start, chunk_size):
+    """Find the offsets in text where it can be split into chunks of
+    approximately chunk_size bytes. Each chunk will start at a "# at"
+    line, so all events in a chunk will be complete.
+
+    Returns a list of offsets, starting with start and ending with
+    the length of text.
+    """
+    result = [start]
+    size = len(text)
+    target = start + chunk_size
+    while target < size:
+        split = _event_start_after(text, target)
+        if split < 0:
+            break
+        result.append(split)
+        target = split + chunk_size
+    result.append(size)
+    return result
+
+def _parse_chunk(args):
+    """Parse the events in a chunk of a dump file. This is executed in
+    the worker processes, which map the file themselves so that only
+    the offsets and the events have to be passed between processes."""
+    filename, delimiter, start, end = args
+    with open(filename, 'rb') as istream:
+        text = mmap.mmap(istream.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return list(parse_events(text[start:end], delimiter))
+        finally:
+            text.close()
+
+def read_events_parallel(filename, processes=None,
+                         chunk_size=_PARALLEL_CHUNK_SIZE):
+    """
+    Generator that parses a file containing the output of mysqlbinlog
+    using several processes, returning the events in the order of the
+    file.
+
+    The file is memory-mapped and split into chunks of approximately
+    chunk_size bytes at event boundaries, after which the chunks are
+    parsed by a pool of processes (by default, one for each CPU). The
+    delimiter is read from the header of the file and passed to each
+    process. At most two chunks for each process are parsed ahead of
+    the chunk being returned, to bound the memory used.
+    """
 
-    delimiter = mobj.group(1)
+    with open(filename, 'rb') as istream:
+        text = mmap.mmap(istream.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            delimiter, start = parse_header(text[:_CHUNK_SIZE])
+            splits = _find_split_points(text, start, chunk_size)
+        finally:
+            text.close()
+
+    tasks = [(filename, delimiter, begin, end)
+             for begin, end in zip(splits, splits[1:])]
+    if len(tasks) <= 1:
+        for task in tasks:
+            for event in _parse_chunk(task):
+                yield event
+        return
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes)
+    try:
+        pending = collections.deque()
+        tasks = iter(tasks)
+        for task in itertools.islice(tasks, 2 * processes):
+            pending.append(pool.apply_async(_parse_chunk, (task,)))
+        while pending:
+            events = pending.popleft().get()
+            for task in itertools.islice(tasks, 1):
+                pending.append(pool.apply_async(_parse_chunk, (task,)))
+            for event in events:
+                yield event
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+class _QueueStream(object):
+    """Stream reading the chunks of output that a producer thread puts
+    into a queue. The end of the output is marked with None, and an
+    exception in the queue is raised in the reader."""
+
+    def __init__(self, queue):
+        self.__queue = queue
+
+    def read(self, size=None):
+        chunk = self.__queue.get()
+        if chunk is None:
+            return ''
+        if isinstance(chunk, Exception):
+            raise chunk
+        return chunk
+
+class _Producer(threading.Thread):
+    """Thread running mysqlbinlog for a single file and putting the
+    output into a bounded queue.
+    """
+
+    def __init__(self, command, stopped, queue_size):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue = Queue.Queue(queue_size)
+        self.proc = None
+        self.__command = command
+        self.__stopped = stopped
+
+    def __put(self, item):
+        "Put an item in the queue unless the reader stopped."
+        while not self.__stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def run(self):
+        # Any exception is passed to the reader, which would otherwise
+        # wait forever for the end of the output.
+        try:
+            self.__produce()
+        except Exception, err:  # pylint: disable=W0703
+            self.__put(err)
+
+    def __produce(self):
+        "Run the process and put its output into the queue."
+        self.proc = subprocess.Popen(self.__command, stdout=subprocess.PIPE)
+        read = self.proc.stdout.read
+        while True:
+            chunk = read(_PIPE_CHUNK_SIZE)
+            if not chunk or not self.__put(chunk):
+                break
+        self.proc.stdout.close()
+        if self.proc.wait() != 0 and not self.__stopped.is_set():
+            self.__put(subprocess.CalledProcessError(
+                self.proc.returncode, self.__command))
+        self.__put(None)
+
+    def stop(self):
+        "Stop the process, if it is still running."
+        if self.proc is not None and self.proc.poll() is None:
+            try:
+                self.proc.terminate()
+            except OSError:
+                pass            # Process already finished
+
+# Size of the pieces read from the output of mysqlbinlog.
+_PIPE_CHUNK_SIZE = 64 * 1024
+
+def mysqlbinlog(files, user=None, passwd=None, host="localhost", port=3306,
+                processes=4, queue_size=64):
+    """
+    Generator returning the events of a list of binary log files
+    read from a server using the mysqlbinlog program.
 
-    while not re.match(r'# at \d+', line):
-        line = istream.next()
+    One mysqlbinlog process is started for each file, with at most
+    processes running at the same time. The output of each process
+    is passed to the parser through a queue of queue_size chunks, so
+    a process is stalled if the events are not consumed fast
+    enough. The events are returned in the order of the files.
 
-    while line:
-        # Here, line matches "# at \d+" or "DELIMITER ..."
-        mobj = re.match(r'# at (\d+)', line)
-        if not mobj:
-            if re.match("DELIMITER", line):
-                return          # End of binlog file
-            else:
-                raise UnrecognizedFormatError, line
-        bytepos = mobj.group(1)
-
-        # Read the type by reading the beginning of the next line
-        line = istream.next()
-        mobj = _TYPE_CRE.match(line)
-        if not mobj:
-            raise UnrecognizedFormatError, line
-
-        # Fetch the correct reader class and initialize it with the
-        # remains of the line and passing in the file handle to allow
-        # it to read lines.
-        reader_class = _READER.get(mobj.group(4), UnrecognizedEventReader)
-        reader = reader_class(mobj.group(4), bytepos, mobj.group(3),
-                              mobj.group(2), mobj.group(1), delimiter)
-        yield reader.read(line[mobj.end():], istream)
-        line = reader.line
-
-def mysqlbinlog(files, user=None, passwd=None, host="localhost", port=3306):
+    If the generator is closed before all events are read, the
+    processes still running are terminated.
+    """
     command = [
         "mysqlbinlog",
         "--force",
@@ -363,9 +962,27 @@ def mysqlbinlog(files, user=None, passwd=None, host="localhost", port=3306):
         command.append("--user=%s" % user)
     if passwd:
         command.append("--password=%s" % passwd)
-        
-    proc = subprocess.Popen(command + files, stdout=subprocess.PIPE)
-
-    read_events(proc.stdout)
-
 
+    stopped = threading.Event()
+    producers = [_Producer(command + [fname], stopped, queue_size)
+                 for fname in files]
+
+    # The producers are started in file order, keeping at most
+    # processes of them running from the file being parsed and
+    # forward. A producer that is done with its process will just
+    # wait for its queue to be consumed.
+    started = 0
+    try:
+        for index, producer in enumerate(producers):
+            while started < min(index + processes, len(producers)):
+                producers[started].start()
+                started += 1
+            for event in read_events(_QueueStream(producer.queue)):
+                yield event
+    finally:
+        stopped.set()
+        for producer in producers:
+            producer.stop()
+        for producer in producers:
+            if producer.is_alive():
+                producer.join()
@@ -0,0 +1,161 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Use of this source code is goverened by a BSD licence that can be
+# found in the LICENCE file.
+
+"""Module holding a pool of connections to a server.
+
+The pool keeps connections that are not in use so that they can be
+re-used instead of connecting again, which is the dominant cost for
+short statements. Connections that have been idle for too long are
+closed, and connections that have been idle for a while are checked
+using a ping before they are handed out, since the server might have
+closed them in the meantime.
+"""
+
+import collections
+import threading
+import time
+
+from mysql.replicant import errors
+
+class ConnectionPool(object):
+    """A bounded pool of connections.
+
+    The connect function is called without arguments to create a new
+    connection, which should have a ping() and a close() method.
+
+    size
+       Maximum number of connections, both idle and checked out.
+
+    idle_timeout
+       Number of seconds a connection can be idle in the pool before
+       it is closed.
+
+    ping_interval
+       Number of seconds a connection can be idle before it is
+       checked with a ping when checked out.
+
+    checkout_timeout
+       Number of seconds to wait for a connection to be returned to
+       the pool when all connections are checked out, or None to wait
+       forever.
+    """
+
+    def __init__(self, connect, size=8, idle_timeout=300, ping_interval=1,
+                 checkout_timeout=30):
+        self.__connect = connect
+        self.__size = size
+        self.__idle_timeout = idle_timeout
+        self.__ping_interval = ping_interval
+        self.__checkout_timeout = checkout_timeout
+        self.__cond = threading.Condition()
+        self.__idle = collections.deque()    # (conn, time returned)
+        self.__count = 0
+
+    @property
+    def size(self):
+        "Maximum number of connections."
+        return self.__size
+
+    def __len__(self):
+        "Number of connections open, both idle and checked out."
+        return self.__count
+
+    def warm_up(self, count=None):
+        """Open connections up front so that the first checkouts do
+        not have to connect. By default, the pool is filled."""
+        if count is None:
+            count = self.__size
+        conns = []
+        try:
+            for _ in range(count):
+                conns.append(self.checkout())
+        finally:
+            for conn in conns:
+                self.checkin(conn)
+
+    def __expire(self, now):
+        """Close connections that have been idle for too long. Has to
+        be called with the condition held."""
+        while self.__idle and now - self.__idle[0][1] > self.__idle_timeout:
+            conn, _ = self.__idle.popleft()
+            self.__count -= 1
+            self.__close(conn)
+
+    @staticmethod
+    def __close(conn):
+        try:
+            conn.close()
+        except Exception:       # pylint: disable=W0703
+            pass                # Already closed or server gone
+
+    def checkout(self):
+        """Check out a connection from the pool, creating a new one if
+        there are no idle connections.
+
+        Raises ConnectionPoolTimeoutError if all connections are
+        checked out and none is returned within the timeout.
+        """
+        deadline = None
+        if self.__checkout_timeout is not None:
+            deadline = time.time() + self.__checkout_timeout
+        with self.__cond:
+            while True:
+                now = time.time()
+                self.__expire(now)
+                if self.__idle:
+                    # Most recently used first, so that surplus
+                    # connections can expire.
+                    conn, returned = self.__idle.pop()
+                    break
+                if self.__count < self.__size:
+                    conn, returned = None, None
+                    self.__count += 1
+                    break
+                if deadline is not None and now >= deadline:
+                    raise errors.ConnectionPoolTimeoutError(
+                        "No connection available within %s seconds"
+                        % (self.__checkout_timeout,))
+                self.__cond.wait(None if deadline is None else deadline - now)
+
+        # Connecting and pinging is done without holding the lock.
+        try:
+            if conn is not None and now - returned > self.__ping_interval:
+                try:
+                    conn.ping()
+                except Exception:   # pylint: disable=W0703
+                    self.__close(conn)
+                    conn = None
+            if conn is None:
+                conn = self.__connect()
+        except Exception:
+            self.discard(None)
+            raise
+        return conn
+
+    def checkin(self, conn):
+        "Return a connection to the pool."
+        with self.__cond:
+            self.__idle.append((conn, time.time()))
+            self.__cond.notify()
+
+    def discard(self, conn):
+        """Close a checked out connection instead of returning it to
+        the pool, for example because it holds session state."""
+        if conn is not None:
+            self.__close(conn)
+        with self.__cond:
+            self.__count -= 1
+            self.__cond.notify()
+
+    def clear(self):
+        """Close all idle connections, for example because the server
+        was restarted. Checked out connections are not affected."""
+        with self.__cond:
+            while self.__idle:
+                conn, _ = self.__idle.popleft()
+                self.__count -= 1
+                self.__close(conn)
+            self.__cond.notify_all()
@@ -176,13 +176,18 @@ class Relay(Role):
         self._enable_binlog(server)
         config.set('log-slave-updates')
         server.stop().replace_config(config).start()
-        server.sql("SET SQL_LOG_BIN = 0")
-        for row in server.sql("SHOW DATABASES"):
-            database = row["Database"]
-            if database in ('information_schema', 'mysql'):
-                continue
+        databases = [row["Database"] for row in server.sql("SHOW DATABASES")
+                     if row["Database"] not in ('information_schema', 'mysql')]
+        batch = server.batch()
+        batch.sql("SET SQL_LOG_BIN = 0")
+        for database in databases:
             for table in server.sql("SHOW TABLES FROM %s" % (database,)):
-                server.sql("ALTER TABLE %s.%s ENGINE=BLACKHOLE" %
-                           (database, table["Tables_in_" + database]))
-        server.sql("SET SQL_LOG_BIN = 1")
+                batch.sql("ALTER TABLE %s.%s ENGINE=BLACKHOLE" %
+                          (database, table["Tables_in_" + database]))
+        # The server skips the rest of the batch if an ALTER fails, so
+        # binary logging is restored separately, on the same connection.
+        try:
+            batch.execute()
+        finally:
+            server.sql("SET SQL_LOG_BIN = 1")
         
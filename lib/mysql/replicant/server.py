@@ -9,16 +9,34 @@
 """
 
 import MySQLdb as _connector
+import array
 import collections
+import threading
+import time
 import warnings
-import copy
+import weakref
+
+try:
+    import numpy as _numpy
+except ImportError:
+    _numpy = None
+
+from mysql.replicant.gtid import (  # pylint: disable=W0611
+    GTID,
+    GTIDSet,
+    _compare_sets,
+    _normalize,
+    )
 
-from uuid import UUID
+from mysql.replicant.lag import binlog_sequence
 
 from mysql.replicant import (
     configmanager,
+    pool,
     roles,
     errors,
+    ssh,
+    stats,
     )
 
 class Position(collections.namedtuple('Position', 'file,pos')):
@@ -27,160 +45,240 @@ class Position(collections.namedtuple('Position', 'file,pos')):
     """
 
     def __cmp__(self, other):
-        """Compare two positions lexicographically.  If the positions
-        are from different servers, a ValueError exception will be
-        raised.
+        """Compare two positions lexicographically, comparing the
+        sequence numbers of the binary log files numerically.  If the
+        positions are from different servers, a ValueError exception
+        will be raised.
         """
-        return cmp((self.file, self.pos), (other.file, other.pos))
+        return cmp(self._key(), other._key())
 
-User = collections.namedtuple('User', 'name,passwd')
+    def _key(self):
+        return binlog_sequence(self.file), self.pos
 
-GTID = collections.namedtuple('GTID', 'uuid,gid')
+    # The tuple comparison operators take precedence over __cmp__, so
+    # they have to be replaced as well.
+    def __lt__(self, other):
+        return self._key() < other._key()
 
-def _normalize(rngs):
-    """Normalize a list of ranges by merging ranges, if possible, and
-    turning single-position ranges into tuples.
+    def __le__(self, other):
+        return self._key() <= other._key()
 
-    The normalization is sort the ranges first on the tuples, which
-    makes comparisons easy when merging range sets.
-    """
+    def __gt__(self, other):
+        return self._key() > other._key()
 
-    result = []
-    last = None
-    for rng in sorted(rngs):
-        if len(rng) == 1:
-            rng = (rng[0], rng[0])
-        if last is None:
-            last = rng
-        elif rng[1] <= last[1]:
-            pass
-        elif rng[0] <= last[1] or last[1] + 1 >= rng[0]:
-            last = (last[0], max(rng[1], last[1]))
-        else:
-            result.append(last)
-            last = rng
-    result.append(last)
-    return result
+    def __ge__(self, other):
+        return self._key() >= other._key()
 
-    
-def _compare_sets(lhs, rhs):
-    """Compare two GTID sets.
+User = collections.namedtuple('User', 'name,passwd')
 
-    Return a tuple (lhs, rhs) where lhs is a boolean indicating that
-    the left hand side had at least one more item than the right hand
-    side, and vice verse.
+class _Session(object):
+    """The connection checked out by a thread, and whether statements
+    leaving state in the session were executed on it."""
+
+    __slots__ = ('conn', 'stateful', 'guard')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.stateful = False
+        self.guard = None       # Weak reference to the guard of the thread
+
+class _Guard(object):
+    """Object kept in the thread-local storage of a thread holding a
+    connection, which is freed when the thread exits."""
+    pass
+
+_STATUS_STATEMENTS = {
+    'master': "SHOW MASTER STATUS",
+    'slave': "SHOW SLAVE STATUS",
+}
+
+def _quiet_cursor(cursor_class):
+    """Return a subclass of a cursor class that does not issue the
+    warnings of a statement using the warnings module, leaving them to
+    be fetched by the caller."""
+    def _warning_check(self):
+        pass
+    return type(cursor_class.__name__, (cursor_class,),
+                {'_warning_check': _warning_check})
+
+def _cursor_classes(quiet):
+    "Return the cursor classes indexed by (stream, tuples)."
+    cursors = _connector.cursors
+    classes = {
+        (False, False): cursors.DictCursor,
+        (False, True): cursors.Cursor,
+        (True, False): cursors.SSDictCursor,
+        (True, True): cursors.SSCursor,
+        }
+    if quiet:
+        classes = dict((key, _quiet_cursor(cls))
+                       for key, cls in classes.items())
+    return classes
+
+_CURSORS = _cursor_classes(False)
+_QUIET_CURSORS = _cursor_classes(True)
+
+def _fetch_warnings(conn):
+    """Return the warnings of the last statement executed on a
+    connection as a list of warnings.WarningMessage. The server is
+    only asked for the warnings if the warning count, which is sent
+    with the result of every statement, is non-zero."""
+    if not conn.warning_count():
+        return []
+    return [warnings.WarningMessage(_connector.Warning(message),
+                                    _connector.Warning, __file__, 0)
+            for _, _, message in conn.show_warnings()]
+
+class _CompactRow(tuple):
+    """Base class for compact rows.
+
+    A compact row is a tuple holding the column values, where the
+    mapping from column name to index is shared by all rows with the
+    same columns. Columns can be accessed both by name and by index.
     """
 
-    lcheck, rcheck = False, False
+    __slots__ = ()
+    _fields = ()
+    _index = {}
 
-    # Create a union of the lhs and rhs for comparison
-    both = copy.deepcopy(lhs)
-    both.union(rhs)
+    def __getitem__(self, key):
+        if isinstance(key, basestring):
+            key = self._index[key]
+        return tuple.__getitem__(self, key)
 
-    for uuid, rngs in both._GTIDSet__gtids.items():
-        if lcheck and rcheck:
-            return lcheck, rcheck     # They are incomparable, just return
+    def get(self, key, default=None):
+        "Return the value of a column, or default if there is none."
+        try:
+            return self[key]
+        except (KeyError, IndexError):
+            return default
 
-        def _inner_compare(gtid_set):
-            if uuid not in gtid_set._GTIDSet__gtids:
-                return True # UUID not in lhs ==> right hand side has more
-            else:
-                for rng1, rng2 in zip(rngs, gtid_set._GTIDSet__gtids[uuid]):
-                    if rng1 != rng2:
-                        return True
-            return False
+    def keys(self):
+        "Return the column names."
+        return list(self._fields)
 
-        if _inner_compare(lhs):
-            rcheck = True
-        if _inner_compare(rhs):
-            lcheck = True
-
-    return lcheck, rcheck
-
-class GTIDSet(object):
-    def __init__(self, obj):
-        gtids = {}
-        if not isinstance(obj, basestring):
-            obj = str(obj)      # Try to make it into a string that we parse
-
-        # Parse the string and construct a GTID set
-        for uuid_set in obj.split(','):
-            parts = uuid_set.split(':')
-
-            # This fandango is done to handle other forms of UUID that
-            # the UUID class can handle. We, however, use the standard
-            # form for our UUIDs.
-            uuid = str(UUID(parts.pop(0)))
-
-            if len(parts) == 0 or not parts[0]:
-                raise ValueError("At least one range have to be provided")
-            rngs = [ tuple(int(x) for x in part.split('-')) for part in parts ]
-            for rng in rngs:
-                if len(rng) > 2 or len(rng) == 2 and int(rng[0]) > int(rng[1]):
-                    raise ValueError("Range %s in '%s' is not a valid range" % (
-                            '-'.join(str(i) for i in rng), rng
-                            ))
-            gtids[uuid] = _normalize(rngs)
-        self.__gtids = gtids
-
-    def __str__(self):
-        sets = []
-        for uuid, rngs in sorted(self.__gtids.items()):
-            uuid_set = ':'.join(
-                [str(uuid)] + [ '-'.join(str(i) for i in rng) for rng in rngs ]
-                )
-            sets.append(uuid_set)
-        return ','.join(sets)
-
-    def union(self, other):
-        """Compute the union of this GTID set and the GTID set in
-        other.
-
-        The update of the GTID set is done in-place, so if you want to
-        compute the union of two sets 'lhs' and 'rhs' you have to do
-        something like::
-
-           result = copy.deepcopy(lhs)
-           result.union(rhs)
-           
-        """
+    def values(self):
+        "Return the column values."
+        return list(self)
 
-        # If it wasn't already a GTIDSet, try to make it one.
-        if not isinstance(other, GTIDSet):
-            other = GTIDSet(other)
+    def items(self):
+        "Return pairs of column name and value."
+        return zip(self._fields, self)
 
-        gtids = self.__gtids
-        for uuid, rngs in other.__gtids.items():
-            if uuid not in gtids:
-                gtids[uuid] = rngs
-            else:
-                gtids[uuid] = _normalize(gtids[uuid] + rngs)
-        self.__gtids = gtids
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, ", ".join(
+            "%s=%r" % item for item in self.items()))
 
-    def __lt__(self, other):
-        lhs, rhs = _compare_sets(self, other)
-        return not lhs and rhs 
+_ROW_CLASSES = {}
 
-    def __le__(self, other):
-        lhs, _ = _compare_sets(self, other)
-        return not lhs
-
-    def __eq__(self, other):
-        lhs, rhs = _compare_sets(self, other)
-        return not (lhs or rhs)
-
-    def __ne__(self, other):
-        return not self.__eq__(other)
-
-    def __ge__(self, other):
-        return other.__le__(self)
-
-    def __gt__(self, other):
-        return other.__lt__(self)
+def _row_class(fields):
+    """Return the compact row class for a list of column names.
 
-    def __or__(self, other):
-        result = copy.deepcopy(self)
-        result.union(other)
+    Classes are created once for each distinct list of columns and
+    then re-used for all result sets with the same columns.
+    """
+    fields = tuple(fields)
+    try:
+        return _ROW_CLASSES[fields]
+    except KeyError:
+        index = dict((name, i) for i, name in enumerate(fields))
+        cls = type('Row', (_CompactRow,), {
+            '__slots__': (), '_fields': fields, '_index': index,
+        })
+        return _ROW_CLASSES.setdefault(fields, cls)
+
+# Array type codes for numeric column types, indexed by the field type
+# codes of the client protocol. Decimal columns are kept as lists to
+# not lose precision.
+_COLUMN_TYPECODE = {
+    1: 'l',                     # TINY
+    2: 'l',                     # SHORT
+    3: 'l',                     # LONG
+    4: 'd',                     # FLOAT
+    5: 'd',                     # DOUBLE
+    8: 'l',                     # LONGLONG
+    9: 'l',                     # INT24
+    13: 'l',                    # YEAR
+}
+
+def _read_columns(cursor, batch_size):
+    """Read a result column by column.
+
+    Returns an ordered dictionary mapping column names to columns.
+    Numeric columns are NumPy arrays if NumPy is available and arrays
+    otherwise, while other columns are lists. A numeric column that
+    contains NULL or values that do not fit in the array is returned
+    as a list as well.
+    """
+    names = []
+    columns = []
+    for description in cursor.description or ():
+        names.append(description[0])
+        typecode = _COLUMN_TYPECODE.get(description[1])
+        columns.append(array.array(typecode) if typecode else [])
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for i, values in enumerate(zip(*rows)):
+            column = columns[i]
+            length = len(column)
+            try:
+                column.extend(values)
+            except (TypeError, OverflowError):
+                # The values before the failing one have already been
+                # added to the array, so remove them before adding the
+                # batch again.
+                del column[length:]
+                columns[i] = list(column)
+                columns[i].extend(values)
+    if _numpy is not None:
+        for i, column in enumerate(columns):
+            if isinstance(column, array.array):
+                columns[i] = _numpy.frombuffer(column, column.typecode)
+    return collections.OrderedDict(zip(names, columns))
+
+BatchResult = collections.namedtuple('BatchResult',
+                                    'command,rows,rowcount,error')
+
+def _batch_query(conn, statements):
+    """Build a single multi-statement query from a list of statements
+    and arguments, quoting the arguments the same way as
+    cursor.execute() does."""
+    commands = []
+    for command, args in statements:
+        if args is not None:
+            if isinstance(args, dict):
+                args = dict((key, conn.literal(value))
+                            for key, value in args.iteritems())
+            else:
+                args = conn.literal(args)
+            command = command % args
+        commands.append(command.strip().rstrip(';'))
+    return ";\n".join(commands)
+
+def _batch_results(cursor, statements):
+    """Collect the results of each statement of an executed
+    multi-statement query.
+
+    Returns a list of BatchResult, one for each statement that the
+    server executed. If a statement fails, the server does not
+    execute the statements following it, so the list ends with the
+    result of the failed statement, holding the exception raised.
+    """
+    results = []
+    for command, _ in statements:
+        if results:
+            try:
+                if not cursor.nextset():
+                    break
+            except Exception, err:  # pylint: disable=W0703
+                results.append(BatchResult(command, None, None, err))
+                break
+        rows = cursor.fetchall()
+        results.append(BatchResult(command, list(rows or ()),
+                                   cursor.rowcount, None))
+    return results
 
 class Server(object):
     """A representation of a MySQL server.
@@ -195,11 +293,40 @@ class Server(object):
         For statements that return a single row, the object can be
         treated as a row as well.
 
+        If a batch size is given, rows are fetched from the cursor
+        batch_size rows at a time using fetchmany(), which is used
+        with server-side cursors to avoid one round trip for each row
+        while still not reading the entire result into memory.
+
+        If compact is true, the cursor is expected to return tuples,
+        which are turned into compact rows sharing the column names
+        of the result instead of having one dictionary per row.
+
         """
 
-        def __init__(self, cursor):
+        def __init__(self, cursor, batch_size=None, compact=False):
             self.__cursor = cursor
-            self.__row = cursor.fetchone()
+            self.rowcount = cursor.rowcount
+            self.__batch_size = batch_size
+            self.__batch = iter(())
+            self.__class = None
+            if compact and cursor.description is not None:
+                self.__class = _row_class(
+                    column[0] for column in cursor.description)
+            self.__row = self.__fetch()
+
+        def __fetch(self):
+            if self.__batch_size is None:
+                row = self.__cursor.fetchone()
+            else:
+                row = next(self.__batch, None)
+                if row is None:
+                    rows = self.__cursor.fetchmany(self.__batch_size)
+                    self.__batch = iter(rows)
+                    row = next(self.__batch, None)
+            if row is not None and self.__class is not None:
+                row = self.__class(row)
+            return row
 
         def __iter__(self):
             return self
@@ -209,8 +336,23 @@ class Server(object):
             if row is None:
                 raise StopIteration
             else:
-                self.__row = self.__cursor.fetchone()
+                self.__row = self.__fetch()
                 return row
+
+        def close(self):
+            """Close the cursor, discarding any rows not read. For a
+            server-side cursor, this is necessary before another
+            statement can be executed on the connection."""
+            if self.__cursor is not None:
+                self.__cursor.close()
+                self.__cursor = None
+                self.__batch = iter(())
+                self.__row = None
+
+        def finished(self):
+            """Return true if all rows have been read or the result
+            has been closed."""
+            return self.__row is None
         
         def __getitem__(self, key):
             from mysql.replicant.errors import EmptyRowError
@@ -226,12 +368,73 @@ class Server(object):
             else:
                 raise EmptyRowError
     
+    class Batch(object):
+        """A batch of SQL statements executed in a single round trip.
+
+        Statements are collected using sql() and sent to the server as
+        one multi-statement query when the batch is executed, which is
+        done automatically when the batch is used as a context
+        manager::
+
+           with server.batch() as batch:
+               batch.sql("STOP SLAVE")
+               batch.sql("START SLAVE")
+           for result in batch.results:
+               print result.command, result.rowcount
+
+        The results are available as a list of BatchResult, one for
+        each statement executed. If a statement fails, the server
+        skips the remaining statements, the failed statement gets the
+        exception as the error of its result, and the exception is
+        raised. Warnings for all statements are collected in warnings.
+
+        """
+
+        def __init__(self, server, database=''):
+            self.__server = server
+            self.__database = database
+            self.__statements = []
+            self.results = None
+            self.warnings = []
+
+        def __len__(self):
+            return len(self.__statements)
+
+        def sql(self, command, args=None):
+            """Add a statement to the batch. Statements are executed
+            in the order they were added."""
+            if self.results is not None:
+                raise ValueError("Batch already executed")
+            self.__statements.append((command, args))
+            return self
+
+        def execute(self):
+            "Execute all statements of the batch."
+            statements = self.__statements
+            self.results = []
+            if statements:
+                self.results = self.__server._execute_batch(
+                    statements, self.__database, self.warnings)
+            for result in self.results:
+                if result.error is not None:
+                    raise result.error
+            return self.results
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc_value, traceback):
+            if exc_type is None:
+                self.execute()
+            return False
+
     def __init__(self, name, sql_user, machine, ssh_user=None,
                  config_manager=configmanager.ConfigManagerFile(),
                  role=roles.Vagabond(), 
                  server_id=None, host='localhost', port=3306,
                  socket='/tmp/mysqld.sock', defaults_file=None,
-                 config_section='mysqld'):
+                 config_section='mysqld', pool_size=8, pool_idle_timeout=300,
+                 pool_warm_up=0, status_ttl=0, lazy_warnings=False):
         """Initialize the server object with data.
 
         If a configuration file path is provided, it will be used to
@@ -279,6 +482,43 @@ class Server(object):
            files does not contain a server ID, no server ID is
            assigned.
 
+        pool_size
+           Maximum number of connections to the server. Each thread
+           executing SQL statements checks out a connection from a
+           pool of connections and keeps it until disconnect() is
+           called or the thread exits. It defaults to 8.
+
+        pool_idle_timeout
+           Number of seconds a connection can be unused in the pool
+           before it is closed. It defaults to 300.
+
+        pool_warm_up
+           Number of connections to open when the server object is
+           created. It defaults to 0.
+
+        status_ttl
+           Number of seconds a snapshot of the master or slave status
+           fetched using status() is re-used. Snapshots are not
+           invalidated by writes, so the positions returned are up to
+           status_ttl seconds old. It defaults to 0, which means that
+           every call to status() fetches a new snapshot.
+
+        lazy_warnings
+           If true, the warnings of a statement are fetched from the
+           server only if the warning count returned with the result
+           is non-zero, instead of recording the warnings issued by
+           the connector using the warnings module. This costs nothing
+           for statements without warnings, and is safe when several
+           threads execute statements, which recording using the
+           warnings module is not. Warnings of streamed results are
+           not fetched. Batches always record the warnings using the
+           warnings module, since the warnings of a statement in a
+           batch cannot be fetched before the results of the following
+           statements have been read. It defaults to False.
+
+        Statistics for the SQL statements, shell commands, connects,
+        and sleeps of the server are collected, see stats().
+
         """
 
         if not defaults_file:
@@ -301,27 +541,76 @@ class Server(object):
 
         self.__machine = machine
         self.__config_manager = config_manager
-        self.__conn = None
+        self.__pool = pool.ConnectionPool(self.__new_connection,
+                                          size=pool_size,
+                                          idle_timeout=pool_idle_timeout)
+        self.__local = threading.local()
+        self.__sessions = {}    # Guard reference -> _Session
         self.__config = None
         self.__tmpfile = None
         self.__warnings = None
+        self.status_ttl = status_ttl
+        self.__status = {}      # kind -> (time fetched, row)
+        self.__instrumentation = stats.Instrumentation()
+        self.lazy_warnings = lazy_warnings
 
         self.__role = role
         self.imbue(role)
-            
+        if pool_warm_up:
+            self.__pool.warm_up(pool_warm_up)
+
+    def __new_connection(self):
+        instr = self.__instrumentation
+        instr.before('connect', self.host, None)
+        start = time.time()
+        try:
+            conn = _connector.connect(host=self.host, port=self.port,
+                                      unix_socket=self.socket,
+                                      user=self.sql_user.name,
+                                      passwd=self.sql_user.passwd)
+        except Exception, err:
+            instr.record('connect', self.host, time.time() - start,
+                         error=err)
+            raise
+        instr.record('connect', self.host, time.time() - start)
+        return conn
+
     def _connect(self, database=''):
         """Method to connect to the server, preparing for execution of
-        SQL statements.  If a connection is already established, this
-        function does nothing."""
-        if not self.__conn:
-            self.__conn = _connector.connect(
-                host=self.host, port=self.port,
-                unix_socket=self.socket,
-                db=database,
-                user=self.sql_user.name,
-                passwd=self.sql_user.passwd)
-        elif database:
-            self.__conn.select_database(database)
+        SQL statements.  If the current thread already has a
+        connection checked out, it is used, otherwise a connection is
+        checked out from the connection pool."""
+        local = self.__local
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = _Session(self.__pool.checkout())
+            # If the thread exits without calling disconnect(), the
+            # guard is freed and the connection is reclaimed.
+            local.guard = _Guard()
+            session.guard = weakref.ref(local.guard, self.__reclaim)
+            self.__sessions[session.guard] = session
+            local.session = session
+        if database:
+            session.conn.select_database(database)
+            session.stateful = True
+        return session.conn
+
+    def __reclaim(self, guard):
+        """Reclaim the connection of a thread that exited without
+        calling disconnect(). This is called when the guard is freed,
+        possibly in another thread, so the session is not reset here:
+        a connection with session state is closed instead."""
+        session = self.__sessions.pop(guard, None)
+        if session is not None:
+            if session.stateful:
+                self.__pool.discard(session.conn)
+            else:
+                self.__pool.checkin(session.conn)
+
+    def __mark_stateful(self):
+        session = getattr(self.__local, 'session', None)
+        if session is not None:
+            session.stateful = True
                                       
     def imbue(self, role):
         """Imbue a server with a new role."""
@@ -330,11 +619,33 @@ class Server(object):
         self.__role.imbue(self)
         
     def disconnect(self):
-        """Method to disconnect from the server."""
-        self.__conn = None
+        """Method to disconnect from the server.
+
+        The connection of the current thread is returned to the
+        connection pool. If a statement that leaves state in the
+        session (such as a table lock, session variable, or default
+        database) was executed on it, the session is first reset by
+        changing to the same user again, and if that fails, the
+        connection is closed instead."""
+        self.__close_stream()
+        local = self.__local
+        session = getattr(local, 'session', None)
+        if session is not None:
+            local.session = None
+            self.__sessions.pop(session.guard, None)
+            local.guard = None
+            conn = session.conn
+            if session.stateful:
+                try:
+                    conn.change_user(self.sql_user.name, self.sql_user.passwd)
+                except Exception:   # pylint: disable=W0703
+                    self.__pool.discard(conn)
+                    return self
+            self.__pool.checkin(conn)
         return self
                                       
-    def sql(self, command, args=None, database=''):
+    def sql(self, command, args=None, database='', stream=False,
+            batch_size=1000, compact=False, columnar=False):
         """Execute a SQL command on the server.
 
         This first requires a connection to the server.
@@ -346,14 +657,242 @@ class Server(object):
            for database in server.sql("SHOW DATABASES")
               print database["Database"]
 
+        By default, the entire result is read into memory when the
+        statement is executed. If stream is true, a server-side
+        cursor is used instead and the rows are read batch_size rows
+        at a time as the result is iterated over. Since the result
+        of a server-side cursor has to be read before another
+        statement can be executed on the connection, executing another
+        statement in the same thread raises StreamOpenError until all
+        rows of the streamed result have been read or the result has
+        been closed using close().
+
+        By default, each row is a dictionary. If compact is true, each
+        row is instead a tuple of the column values that also supports
+        access by column name, such as row["Database"], using a column
+        index shared by all rows of the result. This avoids storing
+        the column names again in each row, which matters for large
+        results.
+
+        If columnar is true, the complete result is read batch_size
+        rows at a time and returned as an ordered dictionary mapping
+        each column name to the values of that column. Numeric columns
+        are NumPy arrays if NumPy is installed, and array.array
+        otherwise, which avoids one Python object for each value and
+        allows aggregation over the columns to be vectorized::
+
+           sizes = server.sql("SELECT data_length FROM tables",
+                              database="information_schema",
+                              columnar=True)
+           print sum(sizes["data_length"])
+
          """
 
-        self._connect(database)
-        cur = self.__conn.cursor(_connector.cursors.DictCursor)
-        with warnings.catch_warnings(record=True) as warn:
+        instr = self.__instrumentation
+        statement = stats.analyze(command)
+        key = statement.klass
+        instr.before('sql', key, command)
+        start = time.time()
+        try:
+            result, warns = self.__sql(command, statement, args, database,
+                                       stream, batch_size, compact, columnar)
+        except Exception, err:
+            instr.record('sql', key, time.time() - start, command, err)
+            raise
+        # The row count of a streamed result is not known until all
+        # rows have been read, so those rows are not counted.
+        rows = 0
+        if columnar:
+            if result:
+                rows = len(result.values()[0])
+        elif not stream:
+            rows = result.rowcount
+        instr.record('sql', key, time.time() - start, command,
+                     rows=rows, warnings=len(warns))
+        return result
+
+    def __sql(self, command, statement, args, database, stream, batch_size,
+              compact, columnar):
+        self.__check_stream()
+        conn = self._connect(database)
+        if statement.stateful:
+            self.__mark_stateful()
+        if statement.replication:
+            self.invalidate_status()
+        key = (bool(stream), bool(compact or columnar))
+        if self.lazy_warnings:
+            cur = conn.cursor(_QUIET_CURSORS[key])
             cur.execute(command, args)
-            self.__warnings = warn
-        return Server.Row(cur)
+            warns = [] if stream else _fetch_warnings(conn)
+        else:
+            cur = conn.cursor(_CURSORS[key])
+            with warnings.catch_warnings(record=True) as warns:
+                cur.execute(command, args)
+        self.__warnings = warns
+        if columnar:
+            try:
+                return _read_columns(cur, batch_size), warns
+            finally:
+                cur.close()
+        if stream:
+            row = Server.Row(cur, batch_size, compact)
+            self.__local.stream = row
+            return row, warns
+        return Server.Row(cur, compact=compact), warns
+
+    def batch(self, database=''):
+        """Create a batch of statements to be executed in a single
+        round trip. See Server.Batch for how to use it."""
+        return Server.Batch(self, database)
+
+    def _execute_batch(self, statements, database, warns):
+        """Execute a list of statements and arguments as a single
+        multi-statement query and return the results."""
+        self.__check_stream()
+        conn = self._connect(database)
+        for command, _ in statements:
+            statement = stats.analyze(command)
+            if statement.stateful:
+                self.__mark_stateful()
+            if statement.replication:
+                self.invalidate_status()
+        if len(statements) == 1:
+            query, args = statements[0]
+        else:
+            query, args = _batch_query(conn, statements), None
+        instr = self.__instrumentation
+        instr.before('sql', 'BATCH', query)
+        start = time.time()
+        cur = conn.cursor(_connector.cursors.DictCursor)
+        with warnings.catch_warnings(record=True) as warn:
+            try:
+                cur.execute(query, args)
+            except Exception, err:  # pylint: disable=W0703
+                results = [BatchResult(statements[0][0], None, None, err)]
+            else:
+                results = _batch_results(cur, statements)
+            finally:
+                warns.extend(warn)
+                self.__warnings = warn
+                # Read any remaining results so that the connection
+                # can be used for the next statement.
+                try:
+                    while cur.nextset():
+                        pass
+                except Exception:   # pylint: disable=W0703
+                    pass
+                cur.close()
+        instr.record('sql', 'BATCH', time.time() - start, query,
+                     results[-1].error,
+                     rows=sum(max(result.rowcount or 0, 0)
+                              for result in results),
+                     warnings=len(warn))
+        return results
+
+    def status(self, kind, refresh=False):
+        """Return a snapshot of the master or slave status of the
+        server, that is, the row of SHOW MASTER STATUS or SHOW SLAVE
+        STATUS as a dictionary, or None if the server is not a master
+        or slave respectively. The kind is either 'master' or 'slave'.
+
+        Snapshots are re-used for status_ttl seconds, so that callers
+        polling the status do not each execute the statement. Pass
+        refresh=True to always fetch a new snapshot. Statements that
+        change the replication state of the server, such as CHANGE
+        MASTER or STOP SLAVE, or wait for it to change, such as
+        MASTER_POS_WAIT(), invalidate the snapshots.
+        """
+        now = time.time()
+        if not refresh:
+            fetched, row = self.__status.get(kind, (None, None))
+            if fetched is not None and now - fetched < self.status_ttl:
+                return row
+        result = self.sql(_STATUS_STATEMENTS[kind])
+        row = next(result, None)
+        if row is not None:
+            row = dict(row)
+        self.__status[kind] = (now, row)
+        return row
+
+    def invalidate_status(self):
+        "Discard the status snapshots, forcing the next status() to fetch."
+        self.__status = {}
+
+    def stats(self):
+        """Return a snapshot of the statistics collected for the server.
+
+        The snapshot is a dictionary mapping a pair (kind, key) to a
+        stats.Stats object with the number of operations, failed
+        operations, rows, and warnings, the total and maximum time in
+        seconds, and a latency histogram supporting percentile(). The
+        kinds and keys are:
+
+        'sql'
+           SQL statements, with the statement class as key, for
+           example 'SELECT' or 'SHOW SLAVE'. Batches have key 'BATCH'.
+           Rows are not counted for streamed results, that is, when
+           sql() is called with stream=True.
+
+        'ssh'
+           Shell commands executed using ssh(), with the name of the
+           command as key. The rows are the lines of output.
+
+        'connect'
+           New connections to the server, with the host as key.
+
+        'sleep'
+           Sleeps done using sleep(), with 'sleep' as key.
+
+        Taking a snapshot does not block statements executing.
+        """
+        return self.__instrumentation.snapshot()
+
+    def reset_stats(self):
+        "Discard the statistics collected for the server."
+        self.__instrumentation.reset()
+
+    def add_hook(self, before=None, after=None):
+        """Add hooks called around each operation of the server.
+
+        The before hook is called as before(kind, key, detail) when an
+        operation starts, and the after hook as after(kind, key,
+        detail, seconds, error) when it completes, where kind and key
+        are as for stats(), detail is the SQL statement or the shell
+        command, and error is the exception raised, or None. Hooks
+        are called in the thread executing the operation.
+        """
+        self.__instrumentation.add_hook(before, after)
+
+    def remove_hook(self, before=None, after=None):
+        "Remove hooks added using add_hook()."
+        self.__instrumentation.remove_hook(before, after)
+
+    def sleep(self, seconds):
+        """Sleep for a number of seconds, recording the time slept in
+        the statistics of the server."""
+        instr = self.__instrumentation
+        instr.before('sleep', 'sleep', None)
+        start = time.time()
+        time.sleep(seconds)
+        instr.record('sleep', 'sleep', time.time() - start)
+
+    def __check_stream(self):
+        """Close the streamed result of the current thread if all its
+        rows have been read, and raise StreamOpenError otherwise."""
+        row = getattr(self.__local, 'stream', None)
+        if row is not None:
+            if not row.finished():
+                raise errors.StreamOpenError(
+                    "Statement executed while a streamed result has rows"
+                    " left to read")
+            self.__close_stream()
+
+    def __close_stream(self):
+        "Close the streamed result of the current thread, if any."
+        row = getattr(self.__local, 'stream', None)
+        if row is not None:
+            self.__local.stream = None
+            row.close()
 
     def ssh(self, command):
         """Execute a shell command on the server.
@@ -373,15 +912,50 @@ class Server(object):
 
         from subprocess import Popen, PIPE, STDOUT
 
+        instr = self.__instrumentation
+        key = command[0] if command else None
+        instr.before('ssh', key, command)
+        start = time.time()
+        try:
+            process = Popen(self._ssh_command(command), stdout=PIPE,
+                            stderr=STDOUT)
+            output = process.communicate()[0]
+        except Exception, err:
+            instr.record('ssh', key, time.time() - start, command, err)
+            raise
+        lines = output.split("\n")
+        instr.record('ssh', key, time.time() - start, command,
+                     rows=len(lines))
+        return lines
+
+    def ssh_stream(self, command, timeout=None, chunk_size=None):
+        """Execute a shell command on the server, streaming the output.
+
+        Returns a CommandOutput, which is an iterator over the output
+        as it arrives, with stdout and stderr kept separate::
+
+           output = server.ssh_stream(["du", "-a", datadir], timeout=60)
+           for stream, line in output:
+               if stream == ssh.STDOUT:
+                   print line
+           print "Exit status:", output.returncode
+
+        If timeout is given, the command is killed and
+        ServerTimeoutError raised if it has not completed within
+        timeout seconds. If chunk_size is given, the output is
+        returned in chunks of at most chunk_size bytes instead of in
+        lines.
+        """
+        return ssh.CommandOutput(self._ssh_command(command, "-qTx"),
+                                 timeout, chunk_size)
+
+    def _ssh_command(self, command, flags="-fqTx"):
+        "Return the command line to execute a shell command on the server."
         if self.host == "localhost":
-            cmd = ["sudo", "-u" + self.ssh_user.name] + command
-            process = Popen(cmd, stdout=PIPE, stderr=STDOUT)
+            return ["sudo", "-u" + self.ssh_user.name] + command
         else:
-            fullname = self.ssh_user.name + "@" + self.host
-            process = Popen(["ssh", "-fqTx", fullname, ' '.join(command)],
-                            stdout=PIPE, stderr=STDOUT)
-        output = process.communicate()[0]
-        return output.split("\n")
+            return ssh.SESSIONS.ssh_command(self.ssh_user.name, self.host,
+                                            command, flags)
 
     def fetch_config(self, path=None):
         return self.__config_manager.fetch_config(self, path)
@@ -391,10 +965,14 @@ class Server(object):
         return self
 
     def stop(self):
+        self.invalidate_status()
+        self.disconnect()
         self.__machine.stop_server(self)
+        self.__pool.clear()
         return self
 
     def start(self):
+        self.invalidate_status()
         self.__machine.start_server(self)
         return self
 
@@ -0,0 +1,210 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Use of this source code is goverened by a BSD licence that can be
+# found in the LICENCE file.
+
+"""Module holding persistent SSH sessions to remote hosts.
+
+Each ssh and scp command normally makes a new connection to the
+remote host, which means a full TCP and SSH handshake, including
+authentication, for every command. The session manager instead makes
+ssh and scp share one connection for each user and host using the
+ControlMaster feature of OpenSSH: the first command to a host starts
+a master connection, later commands are multiplexed over it, and the
+master connection is closed when it has been idle for persist
+seconds::
+
+   sessions = SessionManager(persist=600)
+   subprocess.check_call(sessions.ssh_command("mats", "example.com",
+                                              ["ls"]))
+   subprocess.check_call(sessions.scp_command(["my.cnf"],
+                                              "mats@example.com:/tmp"))
+
+The commands of the package use the session manager SESSIONS.
+"""
+
+import errno
+import os
+import select
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+STDOUT = 'stdout'
+STDERR = 'stderr'
+
+class SessionManager(object):
+    """Manager of persistent SSH sessions.
+
+    control_dir
+       Directory for the control sockets of the master connections.
+       By default, a private temporary directory is created when
+       first needed.
+
+    persist
+       Number of seconds a master connection stays open when it is
+       not used. If it is zero, each command makes a connection of
+       its own.
+    """
+
+    def __init__(self, control_dir=None, persist=300):
+        self.persist = persist
+        self.__control_dir = control_dir
+        self.__created = False
+        self.__lock = threading.Lock()
+
+    @property
+    def control_dir(self):
+        with self.__lock:
+            if self.__control_dir is None:
+                # Keep the path short: control sockets are Unix sockets
+                # and their paths are limited to about 100 characters.
+                self.__control_dir = tempfile.mkdtemp(prefix='rpl-ssh-',
+                                                      dir='/tmp')
+                self.__created = True
+            return self.__control_dir
+
+    def options(self):
+        "Return the options to use for ssh and scp."
+        if not self.persist:
+            return []
+        control_path = os.path.join(self.control_dir, "%r@%h:%p")
+        return ["-o", "ControlMaster=auto",
+                "-o", "ControlPath=" + control_path,
+                "-o", "ControlPersist=%d" % (self.persist,)]
+
+    def ssh_command(self, user, host, command, flags="-fqTx"):
+        """Return the command line to execute a shell command on a
+        remote host."""
+        if not isinstance(command, basestring):
+            command = ' '.join(command)
+        return ["ssh", flags] + self.options() + [user + "@" + host, command]
+
+    def scp_command(self, sources, target):
+        """Return the command line to copy files to or from a remote
+        host."""
+        return ["scp", "-qB"] + self.options() + list(sources) + [target]
+
+    def close(self, user, host):
+        "Close the master connection to a host, if there is one."
+        if self.persist:
+            with open(os.devnull, 'w') as devnull:
+                subprocess.call(["ssh"] + self.options() +
+                                ["-O", "exit", user + "@" + host],
+                                stdout=devnull, stderr=devnull)
+
+    def close_all(self):
+        """Close all master connections and remove the control
+        directory, if it was created by the session manager."""
+        with self.__lock:
+            control_dir = self.__control_dir
+            if control_dir is None or not os.path.isdir(control_dir):
+                return
+            with open(os.devnull, 'w') as devnull:
+                for name in os.listdir(control_dir):
+                    user_host = name.rsplit(':', 1)[0]
+                    path = os.path.join(control_dir, name)
+                    subprocess.call(["ssh", "-o", "ControlPath=" + path,
+                                     "-O", "exit", user_host],
+                                    stdout=devnull, stderr=devnull)
+            if self.__created:
+                shutil.rmtree(control_dir, ignore_errors=True)
+                self.__control_dir = None
+                self.__created = False
+
+SESSIONS = SessionManager()
+
+class CommandOutput(object):
+    """Iterator over the output of a command as it arrives.
+
+    Each item is a pair (stream, data), where stream is STDOUT or
+    STDERR and data is a line without the trailing newline, or a
+    chunk of at most chunk_size bytes if chunk_size is given. Only
+    partial lines are buffered, so memory use does not grow with the
+    amount of output.
+
+    When the iteration is complete, the exit status of the command is
+    available as returncode. If the command does not complete within
+    timeout seconds, it is killed and ServerTimeoutError is raised.
+    Use close() to kill a command before reading all output.
+    """
+
+    def __init__(self, args, timeout=None, chunk_size=None):
+        self.args = args
+        self.returncode = None
+        self.__chunk_size = chunk_size
+        self.__deadline = None
+        if timeout is not None:
+            self.__deadline = time.time() + timeout
+        with open(os.devnull) as devnull:
+            self.__process = subprocess.Popen(args, stdin=devnull,
+                                              stdout=subprocess.PIPE,
+                                              stderr=subprocess.PIPE)
+        self.__output = self.__read()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return self.__output.next()
+
+    def __read(self):
+        process = self.__process
+        streams = {process.stdout.fileno(): STDOUT,
+                   process.stderr.fileno(): STDERR}
+        partial = dict((fd, '') for fd in streams)
+        poller = select.poll()
+        for fd in streams:
+            poller.register(fd, select.POLLIN)
+        try:
+            while partial:
+                wait = None
+                if self.__deadline is not None:
+                    wait = self.__deadline - time.time()
+                    if wait <= 0:
+                        from mysql.replicant.errors import ServerTimeoutError
+                        raise ServerTimeoutError(
+                            "Command '%s' did not complete in time"
+                            % (' '.join(self.args),))
+                    wait = int(wait * 1000) + 1
+                try:
+                    ready = poller.poll(wait)
+                except select.error, err:
+                    if err.args[0] == errno.EINTR:
+                        continue
+                    raise
+                for fd, _ in ready:
+                    data = os.read(fd, self.__chunk_size or 65536)
+                    if not data:
+                        poller.unregister(fd)
+                        rest = partial.pop(fd)
+                        if rest:
+                            yield streams[fd], rest
+                        continue
+                    if self.__chunk_size:
+                        yield streams[fd], data
+                        continue
+                    lines = (partial[fd] + data).split("\n")
+                    partial[fd] = lines.pop()
+                    for line in lines:
+                        yield streams[fd], line
+            self.returncode = process.wait()
+        finally:
+            if self.returncode is None:
+                self.close()
+
+    def close(self):
+        "Kill the command if it is still running."
+        process = self.__process
+        if process.poll() is None:
+            try:
+                process.kill()
+            except OSError:
+                pass            # Already exited
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+        self.returncode = process.returncode
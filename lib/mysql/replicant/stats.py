@@ -0,0 +1,296 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Use of this source code is goverened by a BSD licence that can be
+# found in the LICENCE file.
+
+"""Module for collecting statistics about operations on servers.
+
+Each operation is recorded under a kind, such as 'sql', 'ssh', or
+'connect', and a key, such as the statement class 'SHOW SLAVE' or the
+name of the shell command. For each kind and key, the number of
+operations, the number of failed operations, the number of rows and
+warnings, and a histogram of the latencies are collected::
+
+   for (kind, key), stats in sorted(server.stats().items()):
+       print kind, key, stats.count, stats.percentile(99)
+
+Recording is done into counters owned by the recording thread, so no
+locks are taken when recording. A snapshot merges the counters of all
+threads. When a thread exits, its counters are merged into counters
+shared by all exited threads.
+
+The statement class is part of the analysis of a statement returned
+by analyze(), which is computed once for each statement text and also
+tells the server whether the statement leaves state in the session or
+changes the replication state.
+"""
+
+import math
+import re
+import threading
+import weakref
+
+# The histogram has SUB_BUCKETS buckets for each power of two of
+# microseconds, which gives a relative error of at most 1/SUB_BUCKETS
+# for any latency, in the same way as HDR histograms.
+SUB_BUCKETS = 8
+
+def _bucket(micros):
+    "Return the bucket index for a latency in microseconds."
+    if micros < 1:
+        return 0
+    mantissa, exponent = math.frexp(micros)
+    return exponent * SUB_BUCKETS + int((mantissa - 0.5) * 2 * SUB_BUCKETS)
+
+def _bucket_limit(index):
+    "Return the upper limit in seconds of the latencies in a bucket."
+    exponent, sub = divmod(index, SUB_BUCKETS)
+    return math.ldexp(0.5 + (sub + 1) / (2.0 * SUB_BUCKETS), exponent) / 1e6
+
+class Histogram(object):
+    """A histogram of latencies with logarithmic buckets.
+    """
+
+    __slots__ = ('buckets',)
+
+    def __init__(self):
+        self.buckets = {}
+
+    def record(self, seconds):
+        "Record a latency, given in seconds."
+        index = _bucket(seconds * 1e6)
+        buckets = self.buckets
+        buckets[index] = buckets.get(index, 0) + 1
+
+    def merge(self, other):
+        "Add the counts of another histogram to this one."
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+    def percentile(self, percent):
+        """Return an upper bound of the latency in seconds below which
+        the given percentage of the latencies fall, or None if the
+        histogram is empty."""
+        total = sum(self.buckets.itervalues())
+        if total == 0:
+            return None
+        wanted = math.ceil(total * percent / 100.0)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= wanted:
+                return _bucket_limit(index)
+        return _bucket_limit(max(self.buckets))
+
+class Stats(object):
+    """Statistics for one kind and key of operations.
+    """
+
+    __slots__ = ('count', 'errors', 'rows', 'warnings', 'total_time',
+                 'max_time', 'histogram')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.warnings = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.histogram = Histogram()
+
+    def merge(self, other):
+        "Add the statistics of another object to this one."
+        self.count += other.count
+        self.errors += other.errors
+        self.rows += other.rows
+        self.warnings += other.warnings
+        self.total_time += other.total_time
+        self.max_time = max(self.max_time, other.max_time)
+        self.histogram.merge(other.histogram)
+
+    def percentile(self, percent):
+        "Return the latency percentile in seconds, see Histogram."
+        return self.histogram.percentile(percent)
+
+    def __str__(self):
+        return "count={0} errors={1} rows={2} warnings={3} " \
+            "total={4:.6f}s max={5:.6f}s".format(
+            self.count, self.errors, self.rows, self.warnings,
+            self.total_time, self.max_time)
+
+def _merge_table(result, table):
+    "Merge a table of statistics into another table."
+    for name, stats in table.items():
+        try:
+            merged = result[name]
+        except KeyError:
+            merged = result[name] = Stats()
+        merged.merge(stats)
+
+class _Guard(object):
+    """Object kept in the thread-local storage of a recording thread,
+    which is freed when the thread exits."""
+    pass
+
+_CLASS_CRE = re.compile(r'\s*(\w+)(?:\s+(\w+))?')
+
+# Statements that leave state in the session that a later user of the
+# connection should not inherit, which is every SET except SET GLOBAL,
+# transactions, locks, temporary tables, and prepared statements. The
+# session of a connection that executed such a statement is reset on
+# disconnect before the connection is returned to the pool, which also
+# releases any locks held.
+_SESSION_STATE_CRE = re.compile(
+    r'\s*(?:SET\s+(?!GLOBAL\s|@@GLOBAL\.)|LOCK\s|'
+    r'FLUSH\s+TABLES\s+WITH\s+READ\s+LOCK|BEGIN\b|START\s+TRANSACTION\b|'
+    r'SAVEPOINT\s|XA\s|USE\s|CREATE\s+TEMPORARY\s|PREPARE\s|'
+    r'SELECT\s+GET_LOCK)',
+    re.IGNORECASE)
+
+# Statements that change the replication state of a server, or wait
+# for it to change, which means that cached status snapshots are no
+# longer valid.
+_REPLICATION_STATE_CRE = re.compile(
+    r'\s*(?:CHANGE\s+MASTER|START\s+SLAVE|STOP\s+SLAVE|'
+    r'RESET\s+(?:MASTER|SLAVE)|FLUSH\s+(?:\w+\s+)?LOGS|PURGE\s|'
+    r'SELECT\s+MASTER_POS_WAIT\b)',
+    re.IGNORECASE)
+
+# Statements where the second word is needed to tell what the
+# statement does.
+_TWO_WORD_STATEMENTS = frozenset([
+    'SHOW', 'START', 'STOP', 'CHANGE', 'RESET', 'FLUSH', 'CREATE',
+    'DROP', 'ALTER', 'LOCK', 'UNLOCK', 'PURGE',
+])
+
+class Statement(object):
+    """What executing a statement needs to know about it: the class of
+    the statement, whether it leaves state in the session, and whether
+    it changes the replication state of the server."""
+
+    __slots__ = ('klass', 'stateful', 'replication')
+
+    def __init__(self, command):
+        mobj = _CLASS_CRE.match(command)
+        if mobj is None:
+            self.klass = 'OTHER'
+        else:
+            self.klass = mobj.group(1).upper()
+            if self.klass in _TWO_WORD_STATEMENTS and mobj.group(2):
+                self.klass += ' ' + mobj.group(2).upper()
+        self.stateful = _SESSION_STATE_CRE.match(command) is not None
+        self.replication = _REPLICATION_STATE_CRE.match(command) is not None
+
+# Cache of statement analyses, since the same statements are executed
+# over and over again.
+_STATEMENTS = {}
+_MAX_STATEMENTS = 1000
+
+def analyze(command):
+    "Return the Statement for a SQL statement, using the statement cache."
+    try:
+        return _STATEMENTS[command]
+    except KeyError:
+        pass
+    statement = Statement(command)
+    if len(_STATEMENTS) < _MAX_STATEMENTS:
+        _STATEMENTS[command] = statement
+    return statement
+
+def statement_class(command):
+    """Return the class of a SQL statement, which is the first word of
+    the statement in upper case, or the first two words for statements
+    such as SHOW and STOP."""
+    return analyze(command).klass
+
+class Instrumentation(object):
+    """Collect statistics for operations and call hooks around them.
+
+    Hooks are added using add_hook(). The before hook is called as
+    before(kind, key, detail) when an operation starts and the after
+    hook as after(kind, key, detail, seconds, error) when it ends,
+    where error is the exception raised or None.
+    """
+
+    def __init__(self):
+        self.__lock = threading.RLock()
+        self.__local = threading.local()
+        self.__threads = {}     # Guard reference -> statistics of thread
+        self.__exited = {}      # Statistics of exited threads
+        self.__before = ()
+        self.__after = ()
+
+    def add_hook(self, before=None, after=None):
+        "Add hooks called before and after each operation."
+        with self.__lock:
+            if before is not None:
+                self.__before += (before,)
+            if after is not None:
+                self.__after += (after,)
+
+    def remove_hook(self, before=None, after=None):
+        "Remove hooks added using add_hook()."
+        with self.__lock:
+            self.__before = tuple(h for h in self.__before if h != before)
+            self.__after = tuple(h for h in self.__after if h != after)
+
+    def before(self, kind, key, detail):
+        "Call the before hooks for an operation."
+        for hook in self.__before:
+            hook(kind, key, detail)
+
+    def record(self, kind, key, seconds, detail=None, error=None, rows=0,
+               warnings=0):
+        "Record a completed operation and call the after hooks."
+        try:
+            table = self.__local.stats
+        except AttributeError:
+            table = self.__local.stats = {}
+            self.__local.guard = _Guard()
+            with self.__lock:
+                self.__threads[weakref.ref(self.__local.guard,
+                                           self.__release)] = table
+        try:
+            stats = table[kind, key]
+        except KeyError:
+            stats = table[kind, key] = Stats()
+        stats.count += 1
+        if error is not None:
+            stats.errors += 1
+        if rows > 0:
+            stats.rows += rows
+        stats.warnings += warnings
+        stats.total_time += seconds
+        if seconds > stats.max_time:
+            stats.max_time = seconds
+        stats.histogram.record(seconds)
+        for hook in self.__after:
+            hook(kind, key, detail, seconds, error)
+
+    def __release(self, guard):
+        """Merge the statistics of an exited thread into the statistics
+        of exited threads. Called when the guard of the thread is
+        freed."""
+        with self.__lock:
+            table = self.__threads.pop(guard, None)
+            if table is not None:
+                _merge_table(self.__exited, table)
+
+    def snapshot(self):
+        """Return a dictionary mapping (kind, key) to the statistics of
+        those operations, merged over all threads."""
+        result = {}
+        with self.__lock:
+            _merge_table(result, self.__exited)
+            tables = self.__threads.values()
+        for table in tables:
+            _merge_table(result, table)
+        return result
+
+    def reset(self):
+        "Discard all statistics collected."
+        with self.__lock:
+            self.__exited.clear()
+            for table in self.__threads.values():
+                table.clear()
@@ -0,0 +1,123 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Use of this source code is goverened by a BSD licence that can be
+# found in the LICENCE file.
+
+"""Test of the asynchronous server interface.
+"""
+
+import sys
+import os.path
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_ROOTPATH = os.path.split(_HERE)[0]
+sys.path.append(_ROOTPATH)
+
+import errno
+import threading
+import time
+import unittest
+
+from mysql.replicant import errors
+from mysql.replicant.asynchronous import AsyncServer, Executor, Future
+from mysql.replicant import asynchronous
+import tests.utils
+
+class _FakeServer(object):
+    "Server running shell commands locally."
+
+    def __init__(self, name):
+        self.name = name
+        self.disconnects = 0
+
+    def sql(self, command, args=None, database=''):
+        time.sleep(0.1)
+        if command == "FAIL":
+            raise RuntimeError(command)
+        return [{'command': command, 'thread': threading.current_thread()}]
+
+    def disconnect(self):
+        self.disconnects += 1
+
+    def _ssh_command(self, command):
+        return ["sh", "-c", ' '.join(command)]
+
+class _FakeProcess(object):
+    "Process writing some output to a pipe and failing on wait()."
+
+    def __init__(self, output, error=None):
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, output)
+        os.close(write_fd)
+        self.stdout = os.fdopen(read_fd)
+        self.error = error
+
+    def wait(self):
+        if self.error is not None:
+            raise self.error
+        return 0
+
+class TestAsyncServer(unittest.TestCase):
+    """Unit test for the asynchronous server interface.
+    """
+
+    def __init__(self, methodName, options={}):
+        super(TestAsyncServer, self).__init__(methodName)
+
+    def setUp(self):
+        self.server = AsyncServer(_FakeServer("server"), Executor(4))
+
+    def testFuture(self):
+        "Test that callbacks are called on completion"
+        future = Future()
+        called = []
+        future.add_done_callback(called.append)
+        self.assertFalse(future.done())
+        self.assertRaises(errors.ServerTimeoutError, future.result, 0.01)
+        future.set_result(4711)
+        self.assertEqual(called, [future])
+        self.assertEqual(future.result(), 4711)
+        future.add_done_callback(called.append)
+        self.assertEqual(called, [future, future])
+
+    def testSql(self):
+        "Test that statements execute concurrently"
+        start = time.time()
+        futures = [self.server.asql("SELECT %d" % i) for i in range(4)]
+        rows = [future.result(5) for future in futures]
+        self.assertTrue(time.time() - start < 0.35)
+        self.assertEqual([row[0]['command'] for row in rows],
+                         ["SELECT %d" % i for i in range(4)])
+        self.assertEqual(len(set(row[0]['thread'] for row in rows)), 4)
+        self.assertEqual(self.server.disconnects, 4)
+
+    def testSqlError(self):
+        "Test that exceptions are passed through the future"
+        future = self.server.asql("FAIL")
+        self.assertTrue(isinstance(future.exception(5), RuntimeError))
+        self.assertRaises(RuntimeError, future.result)
+
+    def testSsh(self):
+        "Test that shell commands run concurrently"
+        start = time.time()
+        futures = [self.server.assh(["sleep", "0.2;", "echo", str(i)])
+                   for i in range(10)]
+        outputs = [future.result(5) for future in futures]
+        self.assertTrue(time.time() - start < 1.0)
+        self.assertEqual(outputs, [[str(i), ''] for i in range(10)])
+
+    def testWatcherError(self):
+        "Test that a failure watching a process fails its future"
+        watcher = asynchronous._ProcessWatcher()
+        error = OSError(errno.ECHILD, "No child processes")
+        future = watcher.watch(_FakeProcess("lost", error))
+        self.assertTrue(future.exception(5) is error)
+        # The watcher is still running and completes other processes
+        future = watcher.watch(_FakeProcess("one\ntwo"))
+        self.assertEqual(future.result(5), ["one", "two"])
+
+def suite(options={}):
+    return tests.utils.create_suite(__name__, options)
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
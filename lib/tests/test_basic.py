@@ -9,6 +9,8 @@ root = os.path.split(os.path.dirname(os.path.abspath(__file__)))[0]
 sys.path.append(root) 
 
 import inspect
+import threading
+import time
 import mysql.replicant
 import unittest
 import tests.utils
@@ -56,6 +58,615 @@ class TestPosition(unittest.TestCase):
                 else:
                     self.assertTrue(i_pos > j_pos)
 
+class _LagMaster(object):
+    "Master with a list of binary logs."
+
+    def __init__(self):
+        self.queries = 0
+        self.logs = [('master-bin.000009', 1004), ('master-bin.000010', 504),
+                     ('master-bin.000011', 304)]
+        self.position = server.Position('master-bin.000011', 304)
+
+    def sql(self, command, args=None, database=''):
+        self.queries += 1
+        return iter([{'Log_name': name, 'File_size': size}
+                     for name, size in self.logs])
+
+    def status(self, kind, refresh=False):
+        return {'File': self.position.file, 'Position': self.position.pos}
+
+class TestLag(unittest.TestCase):
+    "Test case for computing replication lag."
+
+    def __init__(self, method_name, options={}):
+        super(TestLag, self).__init__(method_name)
+
+    def setUp(self):
+        from mysql.replicant.lag import LagCalculator
+        self.master = _LagMaster()
+        self.lag = LagCalculator(self.master)
+
+    def testSameFile(self):
+        lag = self.lag.lag(server.Position('master-bin.000011', 304),
+                           server.Position('master-bin.000011', 104))
+        self.assertEqual(lag, (200, 0))
+        self.assertEqual(self.master.queries, 0)
+
+    def testFiles(self):
+        master = server.Position('master-bin.000011', 304)
+        lag = self.lag.lag(master, server.Position('master-bin.000009', 904))
+        self.assertEqual(lag, (100 + 500 + 300, 2))
+        lag = self.lag.lag(master, server.Position('master-bin.000010', 4))
+        self.assertEqual(lag, (500 + 300, 1))
+        self.assertEqual(self.master.queries, 1)
+
+        # Rotation on the master fetches the binary logs again
+        self.master.logs.append(('master-bin.000012', 204))
+        master = server.Position('master-bin.000012', 204)
+        lag = self.lag.lag(master, server.Position('master-bin.000011', 304))
+        self.assertEqual(lag, (200, 1))
+        self.assertEqual(self.master.queries, 2)
+
+    def testSequence(self):
+        self.master.logs = [('master-bin.999999', 104),
+                            ('master-bin.1000000', 204)]
+        master = server.Position('master-bin.1000000', 104)
+        slave = server.Position('master-bin.999999', 4)
+        self.assertEqual(self.lag.lag(master, slave), (200, 1))
+        self.assertTrue(slave < master)
+
+    def testPoll(self):
+        class _Slave(object):
+            def __init__(self, pos):
+                self.pos = pos
+            def status(self, kind, refresh=False):
+                if self.pos is None:
+                    return None
+                return {'Relay_Master_Log_File': self.pos.file,
+                        'Exec_Master_Log_Pos': self.pos.pos}
+            def disconnect(self):
+                pass
+        slaves = [_Slave(server.Position('master-bin.000010', 404)),
+                  _Slave(server.Position('master-bin.000011', 304)),
+                  _Slave(None),
+                  _Slave(server.Position('master-bin.000007', 4)),
+                  _Slave(server.Position('master-bin.000008', 4))]
+        result = self.lag.poll(slaves)
+        self.assertEqual(result[slaves[0]], (400, 1))
+        self.assertEqual(result[slaves[1]], (0, 0))
+        self.assertEqual(result[slaves[2]], None)
+        self.assertEqual(result[slaves[3]], None)
+        self.assertEqual(result[slaves[4]], None)
+        self.assertEqual(self.master.queries, 1)
+
+class _FakeCursor(object):
+    "Cursor returning a list of rows and counting the fetches."
+
+    def __init__(self, rows, description=None):
+        self.rows = list(rows)
+        self.rowcount = len(self.rows)
+        self.description = description
+        self.fetches = 0
+        self.closed = False
+
+    def fetchone(self):
+        self.fetches += 1
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchmany(self, size):
+        self.fetches += 1
+        result, self.rows = self.rows[:size], self.rows[size:]
+        return tuple(result)
+
+    def close(self):
+        self.closed = True
+
+class TestRow(unittest.TestCase):
+    "Test case for the result rows of a SQL statement."
+
+    def __init__(self, method_name, options={}):
+        super(TestRow, self).__init__(method_name)
+
+    def setUp(self):
+        self.rows = [{'id': i} for i in range(10)]
+
+    def testFetchOne(self):
+        cursor = _FakeCursor(self.rows)
+        row = server.Server.Row(cursor)
+        self.assertEqual(row['id'], 0)
+        self.assertEqual(list(row), self.rows)
+        self.assertEqual(cursor.fetches, 11)
+
+    def testFetchMany(self):
+        cursor = _FakeCursor(self.rows)
+        row = server.Server.Row(cursor, 4)
+        self.assertEqual(row['id'], 0)
+        self.assertEqual(list(row), self.rows)
+        self.assertEqual(cursor.fetches, 4)
+
+    def testClose(self):
+        cursor = _FakeCursor(self.rows)
+        row = server.Server.Row(cursor, 4)
+        self.assertEqual(row.next(), self.rows[0])
+        row.close()
+        self.assertTrue(cursor.closed)
+        self.assertEqual(list(row), [])
+        self.assertRaises(errors.EmptyRowError, row.__getitem__, 'id')
+
+    def testCompact(self):
+        description = (('id', 3), ('name', 253))
+        rows = [(i, 'row%d' % i) for i in range(10)]
+        row = server.Server.Row(_FakeCursor(rows, description), compact=True)
+        self.assertEqual(row['name'], 'row0')
+        self.assertEqual(row[1], 'row0')
+        result = list(row)
+        self.assertEqual(result, rows)
+        self.assertEqual(result[3]['id'], 3)
+        self.assertEqual(result[3].keys(), ['id', 'name'])
+        self.assertEqual(dict(result[3].items()), {'id': 3, 'name': 'row3'})
+        self.assertRaises(KeyError, result[3].__getitem__, 'other')
+        self.assertTrue(type(result[0]) is type(result[9]))
+
+        # Row classes are shared between results with the same columns
+        other = server.Server.Row(_FakeCursor(rows, description),
+                                  compact=True)
+        self.assertTrue(type(other.next()) is type(result[0]))
+
+    def testColumnar(self):
+        description = (('id', 8), ('size', 5), ('name', 253),
+                       ('total', 246), ('nulls', 3), ('big', 8))
+        rows = [(i, i / 2.0, 'row%d' % i, i, None, 2 ** 63 + i)
+                for i in range(10)]
+        cursor = _FakeCursor(rows, description)
+        columns = server._read_columns(cursor, 4)
+        self.assertEqual(cursor.fetches, 4)
+        self.assertEqual(columns.keys(),
+                         ['id', 'size', 'name', 'total', 'nulls', 'big'])
+        self.assertEqual(list(columns['id']), range(10))
+        self.assertEqual(list(columns['size']), [i / 2.0 for i in range(10)])
+        self.assertEqual(columns['name'], ['row%d' % i for i in range(10)])
+        self.assertFalse(isinstance(columns['id'], list))
+        self.assertFalse(isinstance(columns['size'], list))
+        self.assertTrue(isinstance(columns['total'], list))
+        self.assertEqual(columns['nulls'], [None] * 10)
+        self.assertEqual(columns['big'], [2 ** 63 + i for i in range(10)])
+
+    def testColumnarMixed(self):
+        description = (('nulls', 8), ('big', 8))
+        rows = [(1, 1), (2, 2), (None, 2 ** 63), (4, 4), (5, 5)]
+        cursor = _FakeCursor(rows, description)
+        columns = server._read_columns(cursor, 4)
+        self.assertEqual(columns['nulls'], [1, 2, None, 4, 5])
+        self.assertEqual(columns['big'], [1, 2, 2 ** 63, 4, 5])
+
+class _FakeBatchCursor(object):
+    "Cursor returning one result for each statement of a batch."
+
+    def __init__(self, results):
+        self.results = list(results)
+        self.rowcount = None
+
+    def __next(self):
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        self.rowcount = len(result)
+        self.rows = result
+
+    def execute(self, query, args=None):
+        self.__next()
+
+    def nextset(self):
+        if not self.results:
+            return None
+        self.__next()
+        return 1
+
+    def fetchall(self):
+        return self.rows
+
+class _FakeConnection(object):
+    def literal(self, args):
+        return tuple("'%s'" % (arg,) for arg in args)
+
+class TestBatch(unittest.TestCase):
+    "Test case for executing batches of statements."
+
+    def __init__(self, method_name, options={}):
+        super(TestBatch, self).__init__(method_name)
+
+    def setUp(self):
+        self.statements = [("STOP SLAVE", None),
+                           ("CHANGE MASTER TO MASTER_HOST=%s", ('master',)),
+                           ("SELECT 1 AS one;", None)]
+
+    def testQuery(self):
+        query = server._batch_query(_FakeConnection(), self.statements)
+        self.assertEqual(query, "STOP SLAVE;\n"
+                         "CHANGE MASTER TO MASTER_HOST='master';\n"
+                         "SELECT 1 AS one")
+
+    def testResults(self):
+        cursor = _FakeBatchCursor([(), (), [{'one': 1}]])
+        cursor.execute("")
+        results = server._batch_results(cursor, self.statements)
+        self.assertEqual([result.command for result in results],
+                         [command for command, _ in self.statements])
+        self.assertEqual(results[2].rows, [{'one': 1}])
+        self.assertEqual(results[2].rowcount, 1)
+        self.assertTrue(all(result.error is None for result in results))
+
+    def testError(self):
+        error = RuntimeError("failed")
+        cursor = _FakeBatchCursor([(), error])
+        cursor.execute("")
+        results = server._batch_results(cursor, self.statements)
+        self.assertEqual(len(results), 2)
+        self.assertTrue(results[0].error is None)
+        self.assertTrue(results[1].error is error)
+
+class _StatusCursor(object):
+    "Cursor answering status statements and recording all statements."
+
+    def __init__(self, statements, status, last=None):
+        self.statements = statements
+        self.status = status
+        self.last = last
+        self.rows = []
+        self.rowcount = -1
+
+    def execute(self, command, args=None):
+        if command == "FAIL":
+            raise RuntimeError(command)
+        self.statements.append(command)
+        if self.last is not None:
+            self.last.command = command
+        self.rows = list(self.status.get(command, ()))
+        self.rowcount = len(self.rows)
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchmany(self, size):
+        result, self.rows = self.rows[:size], self.rows[size:]
+        return result
+
+    def close(self):
+        pass
+
+class _StatusConnection(object):
+    def __init__(self):
+        self.statements = []
+        self.status = {
+            "SHOW MASTER STATUS": [{'File': 'master-bin.000001',
+                                    'Position': 4711}],
+        }
+        self.warnings = {}
+        self.shown = 0
+        # The connection is shared by all threads, so the last
+        # statement is kept for each thread.
+        self.last = threading.local()
+
+    def cursor(self, cursor_class):
+        return _StatusCursor(self.statements, self.status, self.last)
+
+    def warning_count(self):
+        return len(self.warnings.get(self.last.command, ()))
+
+    def show_warnings(self):
+        self.shown += 1
+        return tuple(('Warning', 1000, message)
+                     for message in self.warnings[self.last.command])
+
+class _StatusServer(server.Server):
+    "Server executing statements on a fake connection."
+
+    def __init__(self, conn, **kwargs):
+        from mysql.replicant.machine import Linux
+        from mysql.replicant.configmanager import ConfigManagerFile
+        from mysql.replicant.server import User
+        self.conn = conn
+        super(_StatusServer, self).__init__(
+            'fake', User('root', ''), Linux(),
+            config_manager=ConfigManagerFile(), **kwargs)
+
+    def _connect(self, database=''):
+        return self.conn
+
+class TestStatus(unittest.TestCase):
+    "Test case for the status snapshot cache."
+
+    def __init__(self, method_name, options={}):
+        super(TestStatus, self).__init__(method_name)
+
+    def setUp(self):
+        self.conn = _StatusConnection()
+        self.server = _StatusServer(self.conn, status_ttl=60)
+
+    def testCached(self):
+        from mysql.replicant.commands import fetch_master_position
+        for _ in range(3):
+            position = fetch_master_position(self.server)
+            self.assertEqual(position,
+                             server.Position('master-bin.000001', 4711))
+        self.assertEqual(self.conn.statements, ["SHOW MASTER STATUS"])
+        self.server.status('master', refresh=True)
+        self.assertEqual(len(self.conn.statements), 2)
+
+    def testEmpty(self):
+        from mysql.replicant.commands import fetch_slave_position
+        self.assertEqual(self.server.status('slave'), None)
+        self.assertRaises(errors.NotSlaveError,
+                          fetch_slave_position, self.server)
+        self.assertEqual(self.conn.statements, ["SHOW SLAVE STATUS"])
+
+    def testExpire(self):
+        self.server.status_ttl = 0
+        self.server.status('master')
+        self.server.status('master')
+        self.assertEqual(len(self.conn.statements), 2)
+
+    def testInvalidate(self):
+        self.server.status('master')
+        self.server.sql("select 1")
+        self.server.status('master')
+        self.assertEqual(len(self.conn.statements), 2)
+        self.server.sql("STOP SLAVE")
+        self.server.status('master')
+        self.assertEqual(self.conn.statements[-1], "SHOW MASTER STATUS")
+        self.assertEqual(len(self.conn.statements), 4)
+        self.server.sql("SELECT MASTER_POS_WAIT(%s, %s)",
+                        ('master-bin.000001', 4711))
+        self.server.status('master')
+        self.assertEqual(len(self.conn.statements), 6)
+
+    def testDefault(self):
+        srv = _StatusServer(self.conn)
+        self.assertEqual(srv.status_ttl, 0)
+        srv.status('master')
+        srv.status('master')
+        self.assertEqual(len(self.conn.statements), 2)
+
+    def testStreamOpen(self):
+        self.conn.status["SELECT 2"] = [{'n': 1}, {'n': 2}]
+        result = self.server.sql("SELECT 2", stream=True, batch_size=1)
+        self.assertEqual(next(result), {'n': 1})
+        self.assertRaises(errors.StreamOpenError,
+                          self.server.sql, "SELECT 1")
+        self.assertEqual(list(result), [{'n': 2}])
+        self.server.sql("SELECT 1")
+        result = self.server.sql("SELECT 2", stream=True)
+        self.assertRaises(errors.StreamOpenError,
+                          self.server.status, 'master', True)
+        result.close()
+        self.assertEqual(self.server.status('master', True)['Position'], 4711)
+
+class TestStats(unittest.TestCase):
+    "Test case for the statistics and hooks of a server."
+
+    def __init__(self, method_name, options={}):
+        super(TestStats, self).__init__(method_name)
+
+    def setUp(self):
+        self.conn = _StatusConnection()
+        self.server = _StatusServer(self.conn, status_ttl=0)
+
+    def testHistogram(self):
+        from mysql.replicant.stats import Histogram
+        histogram = Histogram()
+        self.assertEqual(histogram.percentile(50), None)
+        for micros in range(1, 1001):
+            histogram.record(micros / 1e6)
+        for percent in (1, 50, 90, 99, 100):
+            value = histogram.percentile(percent) * 1e6
+            self.assertTrue(10 * percent <= value <= 10 * percent * 1.125,
+                            (percent, value))
+
+    def testStatementClass(self):
+        from mysql.replicant.stats import statement_class
+        self.assertEqual(statement_class("select 1"), "SELECT")
+        self.assertEqual(statement_class("  SHOW slave STATUS"),
+                         "SHOW SLAVE")
+        self.assertEqual(statement_class("STOP SLAVE"), "STOP SLAVE")
+        self.assertEqual(statement_class("COMMIT"), "COMMIT")
+        self.assertEqual(statement_class(""), "OTHER")
+
+    def testCounters(self):
+        for _ in range(3):
+            self.server.status('master')
+        self.server.sql("SELECT 1")
+        self.assertRaises(RuntimeError, self.server.sql, "FAIL")
+        snapshot = self.server.stats()
+        self.assertEqual(sorted(snapshot.keys()),
+                         [('sql', 'FAIL'), ('sql', 'SELECT'),
+                          ('sql', 'SHOW MASTER')])
+        show = snapshot['sql', 'SHOW MASTER']
+        self.assertEqual((show.count, show.errors, show.rows), (3, 0, 3))
+        self.assertTrue(show.max_time <= show.total_time)
+        self.assertTrue(show.percentile(100) >= show.max_time)
+        fail = snapshot['sql', 'FAIL']
+        self.assertEqual((fail.count, fail.errors), (1, 1))
+        self.server.sql("SHOW MASTER STATUS", stream=True).close()
+        show = self.server.stats()['sql', 'SHOW MASTER']
+        self.assertEqual((show.count, show.rows), (4, 3))
+        self.server.reset_stats()
+        self.assertEqual(self.server.stats(), {})
+
+    def testThreads(self):
+        def work():
+            for _ in range(100):
+                self.server.sql("SELECT 1")
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.server.stats()['sql', 'SELECT'].count, 400)
+
+    def testThreadExit(self):
+        from mysql.replicant.stats import Instrumentation
+        instr = Instrumentation()
+        for _ in range(200):
+            thread = threading.Thread(target=instr.record,
+                                      args=('sql', 'SELECT', 0.001))
+            thread.start()
+            thread.join()
+        # The statistics of a thread are merged when its thread state
+        # is freed, which is shortly after join() returns.
+        for _ in range(100):
+            if len(instr._Instrumentation__threads) <= 1:
+                break
+            time.sleep(0.01)
+        self.assertTrue(len(instr._Instrumentation__threads) <= 1)
+        self.assertEqual(instr.snapshot()['sql', 'SELECT'].count, 200)
+
+    def testHooks(self):
+        calls = []
+        def before(kind, key, detail):
+            calls.append(('before', kind, key, detail))
+        def after(kind, key, detail, seconds, error):
+            calls.append(('after', kind, key, detail, type(error)))
+        self.server.add_hook(before, after)
+        self.server.sql("SELECT 1")
+        self.assertRaises(RuntimeError, self.server.sql, "FAIL")
+        self.server.sleep(0)
+        self.assertEqual(calls, [
+            ('before', 'sql', 'SELECT', 'SELECT 1'),
+            ('after', 'sql', 'SELECT', 'SELECT 1', type(None)),
+            ('before', 'sql', 'FAIL', 'FAIL'),
+            ('after', 'sql', 'FAIL', 'FAIL', RuntimeError),
+            ('before', 'sleep', 'sleep', None),
+            ('after', 'sleep', 'sleep', None, type(None)),
+            ])
+        self.server.remove_hook(before, after)
+        self.server.sql("SELECT 1")
+        self.assertEqual(len(calls), 6)
+
+class TestStatementCache(unittest.TestCase):
+    "Test case for the statement cache and lazy warnings."
+
+    def __init__(self, method_name, options={}):
+        super(TestStatementCache, self).__init__(method_name)
+
+    def setUp(self):
+        self.conn = _StatusConnection()
+
+    def testCache(self):
+        from mysql.replicant.stats import analyze
+        srv = _StatusServer(self.conn, status_ttl=60)
+        srv.status('master')
+        srv.sql("SELECT 1")
+        self.assertEqual(srv.status('master')['Position'], 4711)
+        srv.sql("STOP SLAVE")
+        srv.status('master')
+        srv.sql("STOP SLAVE")
+        srv.status('master')
+        self.assertEqual(self.conn.statements,
+                         ["SHOW MASTER STATUS", "SELECT 1",
+                          "STOP SLAVE", "SHOW MASTER STATUS",
+                          "STOP SLAVE", "SHOW MASTER STATUS"])
+        self.assertEqual(srv.stats()['sql', 'STOP SLAVE'].count, 2)
+        statement = analyze("STOP SLAVE")
+        self.assertTrue(analyze("STOP SLAVE") is statement)
+        self.assertEqual((statement.klass, statement.stateful,
+                          statement.replication), ("STOP SLAVE", False, True))
+        statement = analyze("SET @pos = 4")
+        self.assertEqual((statement.klass, statement.stateful,
+                          statement.replication), ("SET", True, False))
+
+    def testLazyWarnings(self):
+        srv = _StatusServer(self.conn, lazy_warnings=True)
+        self.conn.warnings["SELECT 1/0"] = ["Division by 0"]
+        srv.sql("SELECT 1")
+        srv.sql("SELECT 1")
+        self.assertEqual(self.conn.shown, 0)
+        srv.sql("SELECT 1/0")
+        self.assertEqual(self.conn.shown, 1)
+        snapshot = srv.stats()
+        self.assertEqual(snapshot['sql', 'SELECT'].warnings, 1)
+
+    def testWarningsPerThread(self):
+        srv = _StatusServer(self.conn, lazy_warnings=True)
+        self.conn.warnings["SELECT 1/0"] = ["Division by 0"]
+        def work(command):
+            for _ in range(200):
+                srv.sql(command)
+        threads = [threading.Thread(target=work, args=(command,))
+                   for command in ("SELECT 1/0", "SELECT 1")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(srv.stats()['sql', 'SELECT'].warnings, 200)
+
+    def testQuietCursor(self):
+        class _Cursor(object):
+            def _warning_check(self):
+                raise AssertionError("Warnings checked")
+        quiet = server._quiet_cursor(_Cursor)
+        self.assertTrue(issubclass(quiet, _Cursor))
+        quiet()._warning_check()
+
+class _RelayConfig(object):
+    def get(self, option):
+        return 'value'
+
+    def set(self, option, value=None):
+        pass
+
+class _RelayServer(object):
+    "Server where altering tables fails."
+
+    name = 'relay'
+    server_id = 1
+
+    def __init__(self):
+        self.statements = []
+
+    def fetch_config(self):
+        return _RelayConfig()
+
+    def replace_config(self, config):
+        return self
+
+    def stop(self):
+        return self
+
+    def start(self):
+        return self
+
+    def sql(self, command, args=None):
+        self.statements.append(command)
+        if command == "SHOW DATABASES":
+            return [{'Database': 'test'}, {'Database': 'mysql'}]
+        if command == "SHOW TABLES FROM test":
+            return [{'Tables_in_test': 't1'}]
+        return []
+
+    def batch(self):
+        return server.Server.Batch(self)
+
+    def _execute_batch(self, statements, database, warns):
+        self.statements.extend(command for command, _ in statements[:2])
+        error = RuntimeError("Unknown storage engine")
+        return [server.BatchResult(statements[0][0], [], 0, None),
+                server.BatchResult(statements[1][0], None, None, error)]
+
+class TestRelay(unittest.TestCase):
+    "Test case for imbuing the relay role."
+
+    def __init__(self, method_name, options={}):
+        super(TestRelay, self).__init__(method_name)
+
+    def testRestoreBinlog(self):
+        from mysql.replicant.roles import Relay
+        relay = _RelayServer()
+        self.assertRaises(RuntimeError, Relay(None).imbue, relay)
+        self.assertEqual(relay.statements[-3:],
+                         ["SET SQL_LOG_BIN = 0",
+                          "ALTER TABLE test.t1 ENGINE=BLACKHOLE",
+                          "SET SQL_LOG_BIN = 1"])
+
 class TestGTID(unittest.TestCase):
     "Test case for GTID classes."
 
@@ -96,6 +707,26 @@ class TestGTID(unittest.TestCase):
         for gtid in bad_gtids:
             self.assertRaises(ValueError, GTIDSet, gtid)
         
+    def testParse(self):
+        uuid1 = '523f5f6d-36ec-11e3-b034-0021cc6850ca'
+        uuid2 = '4f4fada0-37b6-11e3-854d-0021cc6850ca'
+        # Output from the server has newlines between the UUID sets
+        gtids = GTIDSet(uuid2 + ':1-4,\n' + uuid1.upper() + ':1-5')
+        self.assertEqual(str(gtids), uuid2 + ':1-4,' + uuid1 + ':1-5')
+        self.assertEqual(str(GTIDSet('')), '')
+        self.assertEqual(len(GTIDSet('\n')), 0)
+        self.assertEqual(str(GTIDSet(uuid1 + ':1-5,' + uuid1 + ':6-7')),
+                         uuid1 + ':1-7')
+
+        # UUIDs are shared between sets
+        lhs, rhs = GTIDSet(uuid1 + ':1'), GTIDSet(uuid1.upper() + ':1')
+        self.assertTrue(next(lhs.ranges())[0] is next(rhs.ranges())[0])
+
+        # The string is updated when the set changes
+        self.assertEqual(str(lhs), uuid1 + ':1-1')
+        lhs.union(uuid1 + ':2')
+        self.assertEqual(str(lhs), uuid1 + ':1-2')
+
     def testUnion(self):
         gtid = GTIDSet('523f5f6d-36ec-11e3-b034-0021cc6850ca:1-5')
         gtid.union('523f5f6d-36ec-11e3-b034-0021cc6850ca:6-10')
@@ -110,6 +741,77 @@ class TestGTID(unittest.TestCase):
         self.assertEqual(str(gtid), '523f5f6d-36ec-11e3-b034-0021cc6850ca:1-10')
 
 
+    def testOr(self):
+        lhs = GTIDSet('523f5f6d-36ec-11e3-b034-0021cc6850ca:1-5:20-30')
+        rhs = GTIDSet('523f5f6d-36ec-11e3-b034-0021cc6850ca:6-8:10-19,'
+                      '4f4fada0-37b6-11e3-854d-0021cc6850ca:1-4')
+        result = lhs | rhs
+        self.assertEqual(str(result), '4f4fada0-37b6-11e3-854d-0021cc6850ca:1-4,'
+                         '523f5f6d-36ec-11e3-b034-0021cc6850ca:1-8:10-30')
+        # The operands are not changed
+        self.assertEqual(str(lhs), '523f5f6d-36ec-11e3-b034-0021cc6850ca:1-5:20-30')
+        result.union('4f4fada0-37b6-11e3-854d-0021cc6850ca:5')
+        self.assertEqual(str(rhs), '4f4fada0-37b6-11e3-854d-0021cc6850ca:1-4,'
+                         '523f5f6d-36ec-11e3-b034-0021cc6850ca:6-8:10-19')
+
+    def testSubset(self):
+        large = GTIDSet('523f5f6d-36ec-11e3-b034-0021cc6850ca:' +
+                        ':'.join('%d-%d' % (i, i + 5) for i in range(1, 10000, 10)))
+        small = GTIDSet('523f5f6d-36ec-11e3-b034-0021cc6850ca:2-3:5003-5006:9993')
+        self.assertTrue(small.issubset(large))
+        self.assertTrue(small <= large)
+        self.assertTrue(small < large)
+        self.assertFalse(large <= small)
+        other = GTIDSet('523f5f6d-36ec-11e3-b034-0021cc6850ca:2-3:5003-5007')
+        self.assertFalse(other <= large)
+        self.assertTrue(large == large.copy())
+        self.assertTrue(small <= '523f5f6d-36ec-11e3-b034-0021cc6850ca:1-10000')
+
+    def testAlgebra(self):
+        uuid1 = '523f5f6d-36ec-11e3-b034-0021cc6850ca'
+        uuid2 = '4f4fada0-37b6-11e3-854d-0021cc6850ca'
+        lhs = GTIDSet(uuid1 + ':1-10:20-30,' + uuid2 + ':1-5')
+        rhs = GTIDSet(uuid1 + ':5-25:28')
+        self.assertEqual(str(lhs & rhs), uuid1 + ':5-10:20-25:28-28')
+        self.assertEqual(str(lhs - rhs),
+                         uuid2 + ':1-5,' + uuid1 + ':1-4:26-27:29-30')
+        self.assertEqual(str(rhs - lhs), uuid1 + ':11-19')
+        self.assertEqual(str(lhs ^ rhs),
+                         uuid2 + ':1-5,' + uuid1 + ':1-4:11-19:26-27:29-30')
+        self.assertEqual(str(lhs & uuid2 + ':7'), '')
+        self.assertEqual(len(lhs), 26)
+        self.assertEqual(len(lhs - lhs), 0)
+        self.assertTrue(uuid1 + ':25' in lhs)
+        self.assertFalse(uuid1 + ':15' in lhs)
+        self.assertTrue(server.GTID(uuid2, 5) in lhs)
+        self.assertFalse(server.GTID(uuid2, 6) in lhs)
+        self.assertFalse('0021cc6850ca-37b6-11e3-854d-4f4fada0:1' in lhs)
+        self.assertEqual(list(lhs.gaps()), [(uuid1, 11, 19)])
+        self.assertEqual(list(rhs.missing(lhs)),
+                         [(uuid2, 1, 5), (uuid1, 1, 4), (uuid1, 26, 27),
+                          (uuid1, 29, 30)])
+
+    def testAlgebraRandom(self):
+        import random
+        uuid = '523f5f6d-36ec-11e3-b034-0021cc6850ca'
+        rand = random.Random(4711)
+        def make():
+            gids = set(rand.sample(range(1, 200), rand.randint(1, 150)))
+            text = uuid + ':' + ':'.join(str(gid) for gid in gids)
+            return gids, GTIDSet(text)
+        def gids(gtid_set):
+            return set(gid for _, start, end in gtid_set.ranges()
+                       for gid in range(start, end + 1))
+        for _ in range(50):
+            lset, lhs = make()
+            rset, rhs = make()
+            self.assertEqual(gids(lhs & rhs), lset & rset)
+            self.assertEqual(gids(lhs - rhs), lset - rset)
+            self.assertEqual(gids(lhs ^ rhs), lset ^ rset)
+            self.assertEqual(gids(lhs | rhs), lset | rset)
+            self.assertEqual(len(lhs), len(lset))
+            self.assertEqual(lhs <= rhs, lset <= rset)
+
     def testNormalize(self):
         "Test internal normalisation function."
 
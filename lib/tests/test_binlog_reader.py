@@ -14,10 +14,13 @@ _ROOTPATH = os.path.split(_HERE)[0]
 sys.path.append(_ROOTPATH)
 
 import mysql.replicant.binary_log as binlog
+import struct
 import tests.utils
 import time
 import unittest
 
+from StringIO import StringIO
+
 from itertools import izip, imap
 
 def _data_file(fname):
@@ -542,6 +545,148 @@ class TestBinlogParser(unittest.TestCase):
                                                   value=value, expect=expect)
                     self.assertEqual(value, expect, msg)
 
+    def test_format_description(self):
+        """Test that the format description event is used to frame
+        the events.
+        """
+
+        for fname in _STUBS.keys():
+            binary_log = binlog.BinaryLog(_data_file(fname))
+            stubs = list(binary_log.events())
+            fdesc = binary_log.format_description
+            self.assertEqual(fdesc.header_length, 19)
+            self.assertEqual(fdesc.checksum_length, 0)
+            self.assertEqual(fdesc.post_header_length(binlog.QUERY_EVENT), 13)
+            self.assertEqual(fdesc.post_header_length(binlog.ROTATE_EVENT), 8)
+            self.assertEqual(fdesc.post_header_length(binlog.XID_EVENT), 0)
+            # 5.1 servers do not know about events added later
+            self.assertEqual(
+                fdesc.post_header_length(binlog.ROWS_QUERY_EVENT), None)
+            for stub in stubs[1:]:
+                self.assertTrue(stub.format_description is fdesc)
+
+    def test_unknown_event(self):
+        """Test that events of types that are not known are decoded
+        as unknown events.
+        """
+
+        fdesc = binlog.BinaryLog(_data_file('context-bin.000001')).events()
+        fdesc = fdesc.next().decode()
+        for type_code in [binlog.ROWS_QUERY_EVENT, 200]:
+            body = "\x01\x02\x03"
+            header = struct.pack("<LBLLLH", 0, type_code, 1,
+                                 19 + len(body), 4 + 19 + len(body), 0)
+            istream = StringIO(header + body)
+            stub = binlog.Stub(istream, fdesc)
+            self.assertEqual(stub.type_name, "Unknown")
+            self.assertEqual(stub.decode().type_name, "Unknown")
+            self.assertEqual(istream.tell(), len(header + body))
+
+    def test_default_format(self):
+        """Test that events read without a format description event
+        are decoded using the layout of binlog format 4.
+        """
+
+        body = struct.pack("<LLBHH", 82, 0, 4, 0, 0) + "test\0drop table t1"
+        stub = binlog.Stub(StringIO(_event(binlog.QUERY_EVENT, body, 4)))
+        event = stub.decode()
+        self.assertEqual(event.database, "test")
+        self.assertEqual(event.query, "drop table t1")
+        self.assertEqual(event.thread_id, 82)
+
+        body = struct.pack("<Q", 4) + "master-bin.000002"
+        stub = binlog.Stub(StringIO(_event(binlog.ROTATE_EVENT, body, 4)))
+        event = stub.decode()
+        self.assertEqual(event.next_pos, 4)
+        self.assertEqual(event.next_file, "master-bin.000002")
+
+_UUID = '523f5f6d-36ec-11e3-b034-0021cc6850ca'
+
+def _event(type_code, body, pos):
+    header = struct.pack("<LBLLLH", 0, type_code, 1, 19 + len(body),
+                         pos + 19 + len(body), 0)
+    return header + body
+
+def _query(query, database='test'):
+    return struct.pack("<LLBHH", 1, 0, len(database), 0, 0) \
+        + database + '\0' + query
+
+def _gtid_binlog(events):
+    """Create a binary log in the 5.6 format with GTIDs, holding the
+    given events after the format description event."""
+    import uuid
+    post_header = [0] * 35
+    post_header[binlog.QUERY_EVENT - 1] = 13
+    post_header[binlog.ROTATE_EVENT - 1] = 8
+    post_header[binlog.GTID_LOG_EVENT - 1] = 25
+    fde = struct.pack("<H50sLB", 4, "5.6.14-log", 0, 19) \
+        + ''.join(chr(length) for length in post_header) + '\0\0\0\0\0'
+    sid = uuid.UUID(_UUID).bytes
+    previous = struct.pack("<Q16sQqq", 1, sid, 1, 1, 11)
+    data = [binlog.FileReader.MAGIC, _event(binlog.FORMAT_DESCRIPTION_EVENT, fde, 4)]
+    data.append(_event(binlog.PREVIOUS_GTIDS_LOG_EVENT, previous,
+                       len(''.join(data))))
+    for type_code, body in events:
+        if type_code == binlog.GTID_LOG_EVENT:
+            body = struct.pack("<B16sQ", 1, sid, body)
+        data.append(_event(type_code, body, len(''.join(data))))
+    return ''.join(data)
+
+class _StringReader(binlog.Reader):
+    def __init__(self, data):
+        self.istream = StringIO(data)
+        self.istream.seek(4)
+
+class TestGTIDTracker(unittest.TestCase):
+    """Unit test for tracking the executed GTIDs in a binary log.
+    """
+
+    def __init__(self, methodName, options={}):
+        super(TestGTIDTracker, self).__init__(methodName)
+
+    def testTracker(self):
+        events = [
+            (binlog.GTID_LOG_EVENT, 11),
+            (binlog.QUERY_EVENT, _query("BEGIN")),
+            (binlog.QUERY_EVENT, _query("INSERT INTO t VALUES (1)")),
+            (binlog.XID_EVENT, struct.pack("<Q", 4711)),
+            (binlog.GTID_LOG_EVENT, 12),
+            (binlog.QUERY_EVENT, _query("CREATE TABLE u (a INT)")),
+            (binlog.GTID_LOG_EVENT, 13),
+            (binlog.QUERY_EVENT, _query("BEGIN")),
+            (binlog.QUERY_EVENT, _query("INSERT INTO t VALUES (2)")),
+            (binlog.QUERY_EVENT, _query("COMMIT")),
+            ]
+        log = binlog.BinaryLog(_StringReader(_gtid_binlog(events)))
+        tracker = binlog.GTIDTracker()
+        executed = []
+        for stub in tracker.feed(log.events()):
+            executed.append(str(tracker.executed))
+        executed.append(str(tracker.executed))
+        # The executed set is updated once the consumer asks for the
+        # event following the one that completes a transaction.
+        self.assertEqual(executed[:2], ['', ''])
+        self.assertEqual(executed[2:], [_UUID + ':1-10'] * 4 +
+                         [_UUID + ':1-11'] * 2 +
+                         [_UUID + ':1-12'] * 4 +
+                         [_UUID + ':1-13'])
+
+        snapshot = tracker.snapshot()
+        tracker.executed.add(_UUID, 20)
+        self.assertEqual(str(snapshot), _UUID + ':1-13')
+        self.assertEqual(str(tracker.executed), _UUID + ':1-13:20-20')
+
+    def testDecode(self):
+        events = [(binlog.GTID_LOG_EVENT, 11)]
+        stubs = list(binlog.BinaryLog(
+                _StringReader(_gtid_binlog(events))).events())
+        previous = stubs[1].decode()
+        self.assertEqual(previous.type_name, "PreviousGtids")
+        self.assertEqual(str(previous.gtids), _UUID + ':1-10')
+        gtid = stubs[2].decode()
+        self.assertEqual(gtid.type_name, "Gtid")
+        self.assertEqual(gtid.gtid, (_UUID, 11))
+
 def suite(options={}):
     return tests.utils.create_suite(__name__, options)
 
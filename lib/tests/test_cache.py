@@ -0,0 +1,93 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Use of this source code is goverened by a BSD licence that can be
+# found in the LICENCE file.
+
+"""Test of the persistent parse cache.
+"""
+
+import sys
+import os.path
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_ROOTPATH = os.path.split(_HERE)[0]
+sys.path.append(_ROOTPATH)
+
+import shutil
+import tempfile
+import unittest
+
+import mysql.replicant.binary_log as binlog
+import mysql.replicant.parser.mysqlbinlog as parser
+import tests.utils
+
+from mysql.replicant.cache import ParseCache
+
+def _data_file(fname):
+    return os.path.join(_HERE, 'data', fname)
+
+def _header(stub):
+    return (stub.pos, stub.when, stub.type_code, stub.server_id,
+            stub.size, stub.end_pos, stub.flags)
+
+class TestParseCache(unittest.TestCase):
+    """Unit test for the parse cache.
+    """
+
+    def __init__(self, methodName, options={}):
+        super(TestParseCache, self).__init__(methodName)
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = ParseCache(os.path.join(self.tmpdir, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testTextDump(self):
+        "Test that events from a text dump are cached"
+        fname = _data_file('mysqld-bin.000013.txt')
+        expected = list(parser.read_events(open(fname)))
+        first = list(parser.read_events(open(fname), cache=self.cache))
+        self.assertNotEqual(self.cache.load(fname, 'mysqlbinlog'), None)
+        second = list(parser.read_events(open(fname), cache=self.cache))
+        self.assertEqual(len(second), len(expected))
+        for events in (first, second):
+            for event, orig in zip(events, expected):
+                self.assertEqual(type(event), type(orig))
+                self.assertEqual(vars(event), vars(orig))
+        self.assertEqual(second[3].rows, expected[3].rows)
+
+    def testBinaryLog(self):
+        "Test that the common headers of a binary log are cached"
+        fname = _data_file('context-bin.000001')
+        expected = list(binlog.BinaryLog(fname).events())
+        first = list(binlog.BinaryLog(fname, cache=self.cache).events())
+        self.assertNotEqual(self.cache.load(fname, 'binlog'), None)
+        second = list(binlog.BinaryLog(fname, cache=self.cache).events())
+        for stubs in (first, second):
+            self.assertEqual([_header(stub) for stub in stubs],
+                             [_header(stub) for stub in expected])
+            for stub, orig in zip(stubs, expected):
+                self.assertEqual(stub.body, orig.body)
+                self.assertEqual(vars(stub.decode()).get('query'),
+                                 vars(orig.decode()).get('query'))
+
+    def testChangedFile(self):
+        "Test that the cache is not used for a file that has changed"
+        fname = os.path.join(self.tmpdir, 'dump.txt')
+        shutil.copy(_data_file('mysqld-bin.000011.txt'), fname)
+        list(parser.read_events(open(fname), cache=self.cache))
+        self.assertNotEqual(self.cache.load(fname, 'mysqlbinlog'), None)
+        shutil.copy(_data_file('mysqld-bin.000012.txt'), fname)
+        self.assertEqual(self.cache.load(fname, 'mysqlbinlog'), None)
+        events = list(parser.read_events(open(fname), cache=self.cache))
+        expected = list(parser.read_events(open(fname)))
+        self.assertEqual([vars(event) for event in events],
+                         [vars(event) for event in expected])
+
+def suite(options={}):
+    return tests.utils.create_suite(__name__, options)
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,88 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Use of this source code is goverened by a BSD licence that can be
+# found in the LICENCE file.
+
+"""Test of the query digest aggregation.
+"""
+
+import sys
+import os.path
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_ROOTPATH = os.path.split(_HERE)[0]
+sys.path.append(_ROOTPATH)
+
+import unittest
+
+import mysql.replicant.binary_log as binlog
+import tests.utils
+
+from mysql.replicant.digest import (
+    Digester,
+    fingerprint,
+    )
+
+def _data_file(fname):
+    return os.path.join(_HERE, 'data', fname)
+
+class TestDigest(unittest.TestCase):
+    """Unit test for query fingerprints and digest statistics.
+    """
+
+    def __init__(self, methodName, options={}):
+        super(TestDigest, self).__init__(methodName)
+
+    def testFingerprint(self):
+        "Test normalization of queries into fingerprints"
+        queries = [
+            ("SELECT * FROM t1  WHERE a = 1", "select * from t1 where a = ?"),
+            ("select * from t1 where a='it''s' and b=\"x\"",
+             "select * from t1 where a=? and b=?"),
+            ("SELECT a FROM t1 WHERE b IN (1, 2, 3)",
+             "select a from t1 where b in (?+)"),
+            ("INSERT INTO t1(a, b) VALUES (1, 'a'), (2, 'b');",
+             "insert into t1(a, b) values (?+)"),
+            ("SELECT 1.5e3, 0xFF FROM `T1` /* comment */\n WHERE c2 = 3",
+             "select ?, ? from `T1` where c2 = ?"),
+            ("SELECT a FROM t1 WHERE b IN(1,2,3)",
+             "select a from t1 where b in (?+)"),
+            ("select a from t1 where b in ( 1 , 2 )",
+             "select a from t1 where b in (?+)"),
+            ("INSERT INTO t1 VALUES(-1,'a'),( 2 , 'b' )",
+             "insert into t1 values (?+)"),
+            ("SELECT a - 1, -2 FROM t1 WHERE b = -3 AND c IN (-1, - 2)",
+             "select a - ?, ? from t1 where b = ? and c in (?+)"),
+            ("UPDATE t1 SET a=-1 WHERE b<-2",
+             "update t1 set a=? where b<?"),
+            ]
+        for query, expected in queries:
+            self.assertEqual(fingerprint(query), expected)
+
+    def testDigest(self):
+        "Test that queries differing in literals get the same digest"
+        digester = Digester(memo_size=2)
+        digest1 = digester.digest("SELECT * FROM t1 WHERE a = 1")
+        digest2 = digester.digest("select * from t1 where a = 2")
+        digest3 = digester.digest("select * from t2 where a = 2")
+        self.assertEqual(digest1, digest2)
+        self.assertNotEqual(digest1, digest3)
+        self.assertEqual(digester.digest("SELECT * FROM t1 WHERE a = 1"),
+                         digest1)
+
+    def testAggregate(self):
+        "Test aggregating the query events of a binary log"
+        digester = Digester()
+        fname = _data_file('mysqld1-bin.000005')
+        digester.feed(binlog.BinaryLog(fname).events())
+        stats = dict((s.fingerprint, s) for s in digester.stats())
+        self.assertEqual(stats["drop user ?"].count, 6)
+        self.assertEqual(stats["create table t1 (a int)"].count, 3)
+        self.assertEqual(sum(s.count for s in stats.values()), 24)
+        self.assertEqual(stats["drop user ?"].bytes, 6 * 80)
+
+def suite(options={}):
+    return tests.utils.create_suite(__name__, options)
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
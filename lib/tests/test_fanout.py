@@ -0,0 +1,101 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Use of this source code is goverened by a BSD licence that can be
+# found in the LICENCE file.
+
+"""Test of the binary log fan-out hub.
+"""
+
+import sys
+import os.path
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_ROOTPATH = os.path.split(_HERE)[0]
+sys.path.append(_ROOTPATH)
+
+import multiprocessing
+import unittest
+
+import mysql.replicant.binary_log as binlog
+import mysql.replicant.fanout as fanout
+import tests.utils
+
+def _data_file(fname):
+    return os.path.join(_HERE, 'data', fname)
+
+def _positions(stubs):
+    return [(stub.pos, stub.type_code, stub.end_pos) for stub in stubs]
+
+def _consume(consumer, queue):
+    queue.put(_positions(consumer.events()))
+
+class TestFanout(unittest.TestCase):
+    """Unit test for the fan-out hub.
+    """
+
+    def __init__(self, methodName, options={}):
+        super(TestFanout, self).__init__(methodName)
+
+    def setUp(self):
+        self.fname = _data_file('mysqld1-bin.000005')
+        self.expected = _positions(binlog.BinaryLog(self.fname).events())
+
+    def testSingleConsumer(self):
+        "Test that a consumer sees all events in order"
+        hub = fanout.Hub(binlog.BinaryLog(self.fname))
+        consumer = hub.subscribe()
+        hub.run()
+        stubs = list(consumer.events())
+        self.assertEqual(_positions(stubs), self.expected)
+        for stub, orig in zip(stubs, binlog.BinaryLog(self.fname).events()):
+            self.assertEqual(stub.body, orig.body)
+            self.assertEqual(stub.decode().type_name, orig.decode().type_name)
+
+    def testTypeFilter(self):
+        "Test that a consumer can skip events by type"
+        hub = fanout.Hub(binlog.BinaryLog(self.fname))
+        consumer = hub.subscribe()
+        hub.run()
+        types = [binlog.STOP_EVENT]
+        self.assertEqual(_positions(consumer.events(types)),
+                         [pos for pos in self.expected if pos[1] in types])
+
+    def testProcesses(self):
+        "Test that consumers in other processes see all events"
+        # Small buffer to force wrap-around and blocking on consumers
+        hub = fanout.Hub(binlog.BinaryLog(self.fname), size=512)
+        queue = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=_consume,
+                                         args=(hub.subscribe(), queue))
+                 for _ in range(3)]
+        for proc in procs:
+            proc.start()
+        hub.run()
+        for _ in procs:
+            self.assertEqual(queue.get(timeout=10), self.expected)
+        for proc in procs:
+            proc.join()
+
+    def testDrop(self):
+        "Test that a slow consumer loses the oldest events"
+        hub = fanout.Hub(binlog.BinaryLog(self.fname), size=512,
+                         policy=fanout.DROP)
+        consumer = hub.subscribe()
+        hub.run()
+        stubs = list(consumer.events())
+        received = _positions(stubs)
+        self.assertTrue(consumer.dropped > 0)
+        self.assertEqual(len(received) + consumer.dropped, len(self.expected))
+        # The format description event is delivered first even though
+        # it was dropped, and the events following it can be decoded.
+        self.assertEqual(received[0], self.expected[0])
+        self.assertEqual(received[0][1], binlog.FORMAT_DESCRIPTION_EVENT)
+        self.assertEqual(received[1:], self.expected[-len(received) + 1:])
+        for stub in stubs:
+            stub.decode()
+
+def suite(options={}):
+    return tests.utils.create_suite(__name__, options)
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
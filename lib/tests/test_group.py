@@ -0,0 +1,122 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Use of this source code is goverened by a BSD licence that can be
+# found in the LICENCE file.
+
+"""Test of concurrent execution on server groups.
+"""
+
+import sys
+import os.path
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_ROOTPATH = os.path.split(_HERE)[0]
+sys.path.append(_ROOTPATH)
+
+import threading
+import time
+import unittest
+
+from mysql.replicant import errors
+from mysql.replicant.group import ServerGroup
+import tests.utils
+
+class _FakeServer(object):
+    "Server answering SQL statements after a delay."
+
+    def __init__(self, name, delay=0.0):
+        self.name = name
+        self.delay = delay
+        self.disconnects = 0
+
+    def sql(self, command, args=None, database=''):
+        time.sleep(self.delay)
+        if command == "FAIL":
+            raise RuntimeError(self.name)
+        return (self.name, command)
+
+    def disconnect(self):
+        self.disconnects += 1
+
+class TestServerGroup(unittest.TestCase):
+    """Unit test for the server group.
+    """
+
+    def __init__(self, methodName, options={}):
+        super(TestServerGroup, self).__init__(methodName)
+
+    def setUp(self):
+        self.servers = [_FakeServer("server%d" % i, 0.05 * (5 - i))
+                        for i in range(5)]
+
+    def testOrdered(self):
+        "Test that outcomes are returned in server order"
+        group = ServerGroup(self.servers, workers=5)
+        outcomes = group.sql("SHOW SLAVE STATUS").wait()
+        self.assertEqual([outcome.server for outcome in outcomes],
+                         self.servers)
+        self.assertEqual([outcome.result for outcome in outcomes],
+                         [(server.name, "SHOW SLAVE STATUS")
+                          for server in self.servers])
+        self.assertTrue(all(server.disconnects == 1
+                            for server in self.servers))
+
+    def testAsCompleted(self):
+        "Test that outcomes are returned as they complete"
+        group = ServerGroup(self.servers, workers=5)
+        outcomes = list(group.sql("SELECT 1").as_completed())
+        self.assertEqual([outcome.server for outcome in outcomes],
+                         list(reversed(self.servers)))
+
+    def testConcurrent(self):
+        "Test that the workers bound the concurrency"
+        running = [0, 0]
+        lock = threading.Lock()
+        def work(server):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+        servers = [_FakeServer("server%d" % i) for i in range(10)]
+        start = time.time()
+        ServerGroup(servers, workers=3).call(work).wait()
+        self.assertEqual(running[1], 3)
+        self.assertTrue(time.time() - start < 10 * 0.05)
+
+    def testErrors(self):
+        "Test that exceptions are collected per server"
+        group = ServerGroup(self.servers)
+        call = group.sql("FAIL")
+        failed = call.errors()
+        self.assertEqual(sorted(failed.keys()), sorted(self.servers))
+        self.assertEqual(failed[self.servers[0]].args, ("server0",))
+        self.assertEqual(call.results(), {})
+
+    def testTimeout(self):
+        "Test that slow servers time out"
+        servers = [_FakeServer("fast"), _FakeServer("slow", 1.0)]
+        outcomes = ServerGroup(servers, timeout=0.2).sql("SELECT 1").wait()
+        self.assertEqual(outcomes[0].result, ("fast", "SELECT 1"))
+        self.assertTrue(isinstance(outcomes[1].error,
+                                   errors.ServerTimeoutError))
+
+    def testTimeoutQueued(self):
+        "Test that servers queued behind a hanging server are started"
+        servers = [_FakeServer("hang", 2.0), _FakeServer("fast1"),
+                   _FakeServer("fast2")]
+        start = time.time()
+        group = ServerGroup(servers, workers=1, timeout=0.2)
+        outcomes = group.sql("SELECT 1").wait()
+        self.assertTrue(time.time() - start < 1.0)
+        self.assertTrue(isinstance(outcomes[0].error,
+                                   errors.ServerTimeoutError))
+        self.assertEqual([outcome.result for outcome in outcomes[1:]],
+                         [("fast1", "SELECT 1"), ("fast2", "SELECT 1")])
+
+def suite(options={}):
+    return tests.utils.create_suite(__name__, options)
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
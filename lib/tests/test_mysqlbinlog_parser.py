@@ -15,9 +15,17 @@ sys.path.append(_ROOTPATH)
 
 import glob
 import mysql.replicant.parser.mysqlbinlog as parser
+import shutil
+import tempfile
 import tests.utils
 import unittest
 
+# Stand-in for mysqlbinlog that just prints the file given as last
+# argument, which is one of the dumps in the data directory.
+_FAKE_MYSQLBINLOG = """#!/bin/sh
+eval cat \\"\\${$#}\\"
+"""
+
 class TestBinlogReader(unittest.TestCase):
     """
     Unit test for testing that the binlog reader works as
@@ -30,7 +38,7 @@ class TestBinlogReader(unittest.TestCase):
 
     def setUp(self):
         pattern = os.path.join(_HERE, "data/mysqld-bin.*.txt")
-        self.filenames = glob.iglob(pattern)
+        self.filenames = glob.glob(pattern)
 
     def testSizeAndPos(self):
         """Test that the length and end position of each event matches
@@ -49,6 +57,174 @@ class TestBinlogReader(unittest.TestCase):
             for event in parser.read_events(istream):
                 pass
 
+    def testEventFields(self):
+        "Test that the fields of the events are parsed correctly"
+        fname = os.path.join(_HERE, "data/mysqld-bin.000012.txt")
+        events = list(parser.read_events(open(fname)))
+        self.assertEqual([event.event_type for event in events],
+                         ['Start', 'Query', 'Query', 'Intvar', 'Query', 'Xid',
+                          'Intvar', 'Query', 'User_var', 'Query', 'Rotate'])
+        self.assertEqual(events[0].server_version, '5.1.41-3ubuntu12.3-log')
+        self.assertEqual(events[1].query, 'alter table employee engine innodb')
+        self.assertEqual(events[1].thread_id, '6')
+        self.assertEqual((events[3].name, events[3].value), ('INSERT_ID', '1'))
+        self.assertEqual(events[3].timestamp[:6], (2010, 7, 11, 23, 16, 6))
+        self.assertEqual(events[5].xid, '43')
+        self.assertEqual((events[8].name, events[8].value), ('@`foo`', '32'))
+        self.assertEqual(events[-1].start_pos, 722)
+        self.assertEqual(events[-1].end_pos, 767)
+
+    def testRowEvents(self):
+        "Test that the row images of verbose output are parsed"
+        fname = os.path.join(_HERE, "data/mysqld-bin.000013.txt")
+        events = list(parser.read_events(open(fname)))
+        self.assertEqual([event.event_type for event in events],
+                         ['Start', 'Query', 'Table_map', 'Write_rows', 'Xid',
+                          'Query', 'Table_map', 'Update_rows', 'Xid',
+                          'Query', 'Table_map', 'Delete_rows', 'Xid',
+                          'Rotate'])
+        table_map = events[2]
+        self.assertEqual((table_map.database, table_map.table,
+                          table_map.table_id), ('test', 't1', 70))
+        write_rows, update_rows, delete_rows = events[3], events[7], events[11]
+        self.assertEqual(write_rows.table_id, 70)
+        self.assertEqual(write_rows.flags, 'STMT_END_F')
+        self.assertEqual(write_rows.table, '`test`.`t1`')
+        self.assertEqual(write_rows.rows,
+                         [{1: 1, 2: 'one', 3: None},
+                          {1: 2, 2: "it's two", 3: 2.5}])
+        self.assertEqual(update_rows.rows,
+                         [({1: 2, 2: "it's two", 3: 2.5},
+                           {1: 2, 2: 'tw\\o\n', 3: None})])
+        self.assertEqual(delete_rows.rows, [{1: 1, 2: 'one', 3: None}])
+
+    def testRowEscapes(self):
+        "Test that the escapes written by mysqlbinlog are decoded"
+        value = parser._row_value
+        self.assertEqual(value(r"'it\x27s'"), "it's")
+        self.assertEqual(value(r"'a\x0ab'"), "a\nb")
+        self.assertEqual(value(r"'a\x5cb'"), "a\\b")
+        self.assertEqual(value(r"'a\x5Cx41'"), "a\\x41")
+        self.assertEqual(value(r"'it\'s\n'"), "it's\n")
+
+    def testChunks(self):
+        "Test that events split between chunks are parsed correctly"
+        for fname in self.filenames:
+            expected = [(event.start_pos, getattr(event, 'query', None))
+                        for event in parser.read_events(open(fname))]
+            saved = parser._CHUNK_SIZE
+            try:
+                for size in (7, 100, 1000):
+                    parser._CHUNK_SIZE = size
+                    result = [(event.start_pos, getattr(event, 'query', None))
+                              for event in parser.read_events(open(fname))]
+                    self.assertEqual(result, expected)
+                    lines = iter(open(fname))
+                    result = [(event.start_pos, getattr(event, 'query', None))
+                              for event in parser.read_events(lines)]
+                    self.assertEqual(result, expected)
+            finally:
+                parser._CHUNK_SIZE = saved
+
+    def testAtLineInQuery(self):
+        "Test that '# at' lines in queries are not taken as event starts"
+        with open(os.path.join(_HERE, "data/mysqld-bin.000012.txt")) as dump:
+            text = dump.read()
+        query = "alter table employee engine innodb"
+        text = text.replace(query, query + "\n# at least one comment line")
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, "mysqld-bin.txt")
+            with open(fname, 'w') as dump:
+                dump.write(text)
+            expected = [(event.start_pos, getattr(event, 'query', None))
+                        for event in parser.read_events(open(fname))]
+            self.assertEqual(expected[1][1],
+                             query + "\n# at least one comment line")
+            saved = parser._CHUNK_SIZE
+            try:
+                for size in range(50, 1500, 50):
+                    parser._CHUNK_SIZE = size
+                    result = [(event.start_pos, getattr(event, 'query', None))
+                              for event in parser.read_events(open(fname))]
+                    self.assertEqual(result, expected, size)
+            finally:
+                parser._CHUNK_SIZE = saved
+            for chunk_size in range(100, 1500, 100):
+                events = parser.read_events_parallel(fname, processes=2,
+                                                     chunk_size=chunk_size)
+                result = [(event.start_pos, getattr(event, 'query', None))
+                          for event in events]
+                self.assertEqual(result, expected, chunk_size)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testParallel(self):
+        "Test that parallel parsing returns the events in order"
+        for fname in self.filenames:
+            expected = [(event.start_pos, getattr(event, 'query', None))
+                        for event in parser.read_events(open(fname))]
+            for chunk_size in (1, 500, 1024 * 1024):
+                events = parser.read_events_parallel(fname, processes=2,
+                                                     chunk_size=chunk_size)
+                result = [(event.start_pos, getattr(event, 'query', None))
+                          for event in events]
+                self.assertEqual(result, expected)
+
+class TestMysqlbinlog(unittest.TestCase):
+    """
+    Unit test for running mysqlbinlog and parsing the output. A fake
+    mysqlbinlog program is used to produce the output.
+    """
+
+    def __init__(self, methodName, options={}):
+        super(TestMysqlbinlog, self).__init__(methodName)
+
+    def setUp(self):
+        self.bindir = tempfile.mkdtemp()
+        program = os.path.join(self.bindir, "mysqlbinlog")
+        with open(program, "w") as output:
+            output.write(_FAKE_MYSQLBINLOG)
+        os.chmod(program, 0755)
+        self.path = os.environ["PATH"]
+        os.environ["PATH"] = self.bindir + os.pathsep + self.path
+        pattern = os.path.join(_HERE, "data/mysqld-bin.*.txt")
+        self.filenames = sorted(glob.glob(pattern))
+
+    def tearDown(self):
+        os.environ["PATH"] = self.path
+        shutil.rmtree(self.bindir)
+
+    def testFileOrder(self):
+        "Test that events are returned in file order"
+        expected = []
+        for fname in self.filenames:
+            expected.extend((event.event_type, event.start_pos)
+                            for event in parser.read_events(open(fname)))
+        for processes in (1, 2, 4):
+            events = parser.mysqlbinlog(self.filenames * 2,
+                                        processes=processes, queue_size=1)
+            self.assertEqual([(event.event_type, event.start_pos)
+                              for event in events], expected * 2)
+
+    def testEarlyStop(self):
+        "Test that the generator can be closed before all events are read"
+        events = parser.mysqlbinlog(self.filenames * 4, processes=2,
+                                    queue_size=1)
+        self.assertEqual(events.next().event_type, 'Start')
+        events.close()
+
+    def testFailure(self):
+        "Test that a failing mysqlbinlog raises an exception"
+        events = parser.mysqlbinlog([os.path.join(self.bindir, "missing")])
+        self.assertRaises(parser.subprocess.CalledProcessError, list, events)
+
+    def testStartFailure(self):
+        "Test that an error starting mysqlbinlog is raised in the reader"
+        # Popen raises TypeError for arguments containing a NUL byte
+        events = parser.mysqlbinlog(["master-bin\0.000001"])
+        self.assertRaises(TypeError, list, events)
+
 def suite(options={}):
     """Create a test suite for the binary log reader.
     """
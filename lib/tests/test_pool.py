@@ -0,0 +1,244 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Use of this source code is goverened by a BSD licence that can be
+# found in the LICENCE file.
+
+"""Test of the connection pool.
+"""
+
+import sys
+import os.path
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_ROOTPATH = os.path.split(_HERE)[0]
+sys.path.append(_ROOTPATH)
+
+import threading
+import time
+import unittest
+
+import tests.utils
+
+from mysql.replicant import server, stats
+from mysql.replicant.errors import ConnectionPoolTimeoutError
+from mysql.replicant.pool import ConnectionPool
+
+class _Connection(object):
+    "Connection stand-in that counts pings and tracks if it is closed."
+
+    def __init__(self):
+        self.closed = False
+        self.alive = True
+        self.pings = 0
+
+    def ping(self):
+        self.pings += 1
+        if not self.alive:
+            raise IOError("Connection lost")
+
+    def close(self):
+        self.closed = True
+
+class _Cursor(object):
+    "Cursor stand-in recording the statements executed."
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 0
+        self.description = None
+
+    def execute(self, command, args=None):
+        self.conn.statements.append(command)
+
+    def fetchone(self):
+        return None
+
+    def close(self):
+        pass
+
+class _SQLConnection(_Connection):
+    "Connection stand-in that can execute statements."
+
+    def __init__(self):
+        super(_SQLConnection, self).__init__()
+        self.statements = []
+        self.resets = 0
+        self.reset_fails = False
+
+    def cursor(self, cursor_class):
+        return _Cursor(self)
+
+    def select_database(self, database):
+        self.statements.append("USE " + database)
+
+    def change_user(self, user, passwd):
+        if self.reset_fails:
+            raise IOError("Access denied")
+        self.resets += 1
+
+class TestConnectionPool(unittest.TestCase):
+    """Unit test for the connection pool.
+    """
+
+    def __init__(self, methodName, options={}):
+        super(TestConnectionPool, self).__init__(methodName)
+
+    def setUp(self):
+        self.created = []
+
+    def _connect(self):
+        conn = _Connection()
+        self.created.append(conn)
+        return conn
+
+    def testReuse(self):
+        "Test that connections are re-used"
+        pool = ConnectionPool(self._connect, size=2)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        self.assertTrue(pool.checkout() is conn)
+        self.assertEqual(len(self.created), 1)
+        self.assertEqual(conn.pings, 0)
+
+    def testBound(self):
+        "Test that the number of connections is bounded"
+        pool = ConnectionPool(self._connect, size=2, checkout_timeout=0.1)
+        conns = [pool.checkout(), pool.checkout()]
+        self.assertRaises(ConnectionPoolTimeoutError, pool.checkout)
+
+        # Returning a connection from another thread wakes up a
+        # waiting checkout
+        timer = threading.Timer(0.05, pool.checkin, [conns[0]])
+        timer.start()
+        self.assertTrue(pool.checkout() is conns[0])
+        timer.join()
+        pool.discard(conns[1])
+        self.assertTrue(conns[1].closed)
+        self.assertEqual(len(pool), 1)
+
+    def testPing(self):
+        "Test that dead idle connections are replaced"
+        pool = ConnectionPool(self._connect, ping_interval=0)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        conn.alive = False
+        time.sleep(0.01)
+        other = pool.checkout()
+        self.assertTrue(other is not conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(conn.pings, 1)
+        self.assertEqual(len(pool), 1)
+
+    def testIdleTimeout(self):
+        "Test that connections idle for too long are closed"
+        pool = ConnectionPool(self._connect, idle_timeout=0)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        time.sleep(0.01)
+        self.assertTrue(pool.checkout() is not conn)
+        self.assertTrue(conn.closed)
+
+    def testWarmUp(self):
+        "Test that warming up opens connections"
+        pool = ConnectionPool(self._connect, size=3)
+        pool.warm_up()
+        self.assertEqual(len(self.created), 3)
+        self.assertEqual(len(pool), 3)
+        pool.clear()
+        self.assertEqual(len(pool), 0)
+        self.assertTrue(all(conn.closed for conn in self.created))
+
+class TestServerPool(unittest.TestCase):
+    """Unit test for the use of the connection pool by servers.
+    """
+
+    def __init__(self, methodName, options={}):
+        super(TestServerPool, self).__init__(methodName)
+
+    def setUp(self):
+        from mysql.replicant.machine import Linux
+        from mysql.replicant.configmanager import ConfigManagerFile
+        self.created = []
+        self.__connect = server._connector.connect
+        server._connector.connect = self._connect
+        self.server = server.Server('fake', server.User('root', ''), Linux(),
+                                    config_manager=ConfigManagerFile(),
+                                    pool_size=2)
+
+    def tearDown(self):
+        server._connector.connect = self.__connect
+
+    def _connect(self, **kwargs):
+        conn = _SQLConnection()
+        self.created.append(conn)
+        return conn
+
+    def _run(self, command):
+        "Execute a statement in a thread that exits without disconnecting."
+        failed = []
+        def work():
+            try:
+                self.server.sql(command)
+            except Exception, err:
+                failed.append(err)
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+        self.assertEqual(failed, [])
+
+    def testThreadExit(self):
+        "Test that connections of exited threads are reclaimed"
+        for _ in range(5):
+            self._run("SELECT 1")
+        self.assertTrue(len(self.created) <= 2)
+        self._run("SET SQL_LOG_BIN = 0")
+        # The connection is reclaimed when the thread state is freed,
+        # which is shortly after join() returns.
+        for _ in range(100):
+            if any(conn.closed for conn in self.created):
+                break
+            time.sleep(0.01)
+        self.assertEqual(len([conn for conn in self.created if conn.closed]),
+                         1)
+
+    def testReset(self):
+        "Test that sessions with state are reset before re-use"
+        self.server.sql("SELECT 1").close()
+        self.server.disconnect()
+        conn = self.created[0]
+        self.assertEqual(conn.resets, 0)
+        self.server.sql("SET SQL_LOG_BIN = 0")
+        self.server.disconnect()
+        self.assertEqual(conn.resets, 1)
+        self.server.sql("SELECT 1", database="mysql")
+        self.server.disconnect()
+        self.assertEqual(conn.resets, 2)
+        self.assertEqual(len(self.created), 1)
+        conn.reset_fails = True
+        self.server.sql("BEGIN")
+        self.server.disconnect()
+        self.assertTrue(conn.closed)
+        self.server.sql("SELECT 1")
+        self.assertEqual(len(self.created), 2)
+
+    def testStateful(self):
+        "Test which statements leave state in the session"
+        for command in ["SET SQL_LOG_BIN = 0", "set names utf8",
+                        "SET SESSION sql_mode = ''", "SET @pos = 4",
+                        "SET autocommit = 0", "BEGIN", "START TRANSACTION",
+                        "LOCK TABLES t1 READ", "USE test",
+                        "FLUSH TABLES WITH READ LOCK",
+                        "CREATE TEMPORARY TABLE t1 (a INT)"]:
+            self.assertTrue(stats._SESSION_STATE_CRE.match(command),
+                            command)
+        for command in ["SET GLOBAL read_only = 1",
+                        "SET @@global.read_only = 1", "SELECT 1",
+                        "SHOW SLAVE STATUS", "STOP SLAVE"]:
+            self.assertFalse(stats._SESSION_STATE_CRE.match(command),
+                             command)
+
+def suite(options={}):
+    return tests.utils.create_suite(__name__, options)
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
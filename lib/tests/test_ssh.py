@@ -0,0 +1,116 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Use of this source code is goverened by a BSD licence that can be
+# found in the LICENCE file.
+
+"""Test of the persistent SSH session manager.
+"""
+
+import sys
+import os.path
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_ROOTPATH = os.path.split(_HERE)[0]
+sys.path.append(_ROOTPATH)
+
+import time
+import unittest
+
+from mysql.replicant import errors, ssh
+from mysql.replicant.ssh import SessionManager
+import tests.utils
+
+class TestSessionManager(unittest.TestCase):
+    """Unit test for the session manager.
+    """
+
+    def __init__(self, methodName, options={}):
+        super(TestSessionManager, self).__init__(methodName)
+
+    def setUp(self):
+        self.sessions = SessionManager(persist=60)
+
+    def tearDown(self):
+        self.sessions.close_all()
+
+    def testSsh(self):
+        "Test that ssh commands share a control socket"
+        command = self.sessions.ssh_command("mats", "example.com",
+                                            ["ls", "-l"])
+        self.assertEqual(command[0:2], ["ssh", "-fqTx"])
+        self.assertEqual(command[-2:], ["mats@example.com", "ls -l"])
+        self.assertTrue("ControlMaster=auto" in command)
+        self.assertTrue("ControlPersist=60" in command)
+        path = os.path.join(self.sessions.control_dir, "%r@%h:%p")
+        self.assertTrue("ControlPath=" + path in command)
+        self.assertTrue(os.path.isdir(self.sessions.control_dir))
+
+    def testScp(self):
+        "Test that scp commands use the same options as ssh"
+        command = self.sessions.scp_command(["my.cnf"], "example.com:/tmp")
+        self.assertEqual(command[0:2], ["scp", "-qB"])
+        self.assertEqual(command[2:-2], self.sessions.options())
+        self.assertEqual(command[-2:], ["my.cnf", "example.com:/tmp"])
+
+    def testNoPersist(self):
+        "Test that sessions can be disabled"
+        sessions = SessionManager(persist=0)
+        self.assertEqual(sessions.ssh_command("mats", "example.com", "ls"),
+                         ["ssh", "-fqTx", "mats@example.com", "ls"])
+
+    def testCloseAll(self):
+        "Test that the control directory is removed"
+        control_dir = self.sessions.control_dir
+        self.sessions.close_all()
+        self.assertFalse(os.path.exists(control_dir))
+
+class TestCommandOutput(unittest.TestCase):
+    """Unit test for streaming the output of commands.
+    """
+
+    def __init__(self, methodName, options={}):
+        super(TestCommandOutput, self).__init__(methodName)
+
+    def testLines(self):
+        "Test that stdout and stderr are kept separate"
+        output = ssh.CommandOutput(
+            ["sh", "-c", "echo one; echo two >&2; printf three; exit 3"])
+        items = list(output)
+        self.assertEqual([line for stream, line in items
+                          if stream == ssh.STDOUT], ["one", "three"])
+        self.assertEqual([line for stream, line in items
+                          if stream == ssh.STDERR], ["two"])
+        self.assertEqual(output.returncode, 3)
+
+    def testChunks(self):
+        "Test that output can be read in chunks"
+        output = ssh.CommandOutput(["sh", "-c", "printf 0123456789"],
+                                   chunk_size=4)
+        chunks = [data for _, data in output]
+        self.assertTrue(all(len(chunk) <= 4 for chunk in chunks))
+        self.assertEqual(''.join(chunks), "0123456789")
+        self.assertEqual(output.returncode, 0)
+
+    def testFirstResult(self):
+        "Test that output is returned as it arrives"
+        start = time.time()
+        output = ssh.CommandOutput(["sh", "-c", "echo first; sleep 5"],
+                                   timeout=10)
+        self.assertEqual(output.next(), (ssh.STDOUT, "first"))
+        self.assertTrue(time.time() - start < 2)
+        output.close()
+        self.assertNotEqual(output.returncode, 0)
+
+    def testTimeout(self):
+        "Test that slow commands are killed"
+        output = ssh.CommandOutput(["sleep", "5"], timeout=0.2)
+        start = time.time()
+        self.assertRaises(errors.ServerTimeoutError, list, output)
+        self.assertTrue(time.time() - start < 2)
+        self.assertNotEqual(output.returncode, 0)
+
+def suite(options={}):
+    return tests.utils.create_suite(__name__, options)
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')